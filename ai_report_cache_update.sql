@@ -0,0 +1,12 @@
+-- ==========================================
+-- AIレポートキャッシュ用の列追加
+-- ==========================================
+-- fingerprint: (company_id, report_type, プロンプト版, 課題セットのハッシュ) のSHA-256
+-- ダッシュボードは同じ fingerprint の行があれば Gemini を呼ばずにその report_data を再利用する
+ALTER TABLE ai_reports
+ADD COLUMN IF NOT EXISTS report_type TEXT NOT NULL DEFAULT 'ai_intro',
+ADD COLUMN IF NOT EXISTS fingerprint TEXT;
+
+-- キャッシュ参照用インデックス
+CREATE INDEX IF NOT EXISTS idx_ai_reports_company_fingerprint ON ai_reports(company_id, fingerprint);
+CREATE INDEX IF NOT EXISTS idx_ai_reports_company_created_at ON ai_reports(company_id, created_at DESC);
@@ -0,0 +1,16 @@
+-- ==========================================
+-- AIレポートの差分再解析用の列追加
+-- ==========================================
+-- 前回の report_data + それ以降の新着課題だけでレポートを更新するために、生成時の条件を記録する。
+-- prompt_version: 生成に使ったプロンプト版 (版が変わったら差分ではなく全件から作り直す)
+-- grievance_count: 解析対象にした課題の件数
+-- last_grievance_at: 解析対象にした課題の最終投稿日時 (次回はこれより後の課題だけを渡す)
+-- incremental_depth: 全件解析から何回続けて差分更新したか (上限に達したら全件から作り直す)
+ALTER TABLE ai_reports
+ADD COLUMN IF NOT EXISTS prompt_version TEXT,
+ADD COLUMN IF NOT EXISTS grievance_count INTEGER,
+ADD COLUMN IF NOT EXISTS last_grievance_at TIMESTAMPTZ,
+ADD COLUMN IF NOT EXISTS incremental_depth INTEGER NOT NULL DEFAULT 0;
+
+-- 差分の基準となる最新レポートの参照用 (企業 x レポート種別ごとの最新1件)
+CREATE INDEX IF NOT EXISTS idx_ai_reports_company_type_created_at ON ai_reports(company_id, report_type, created_at DESC);
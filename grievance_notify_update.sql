@@ -0,0 +1,60 @@
+-- ==========================================
+-- 課題の追加・削除の通知 (LISTEN/NOTIFY)
+-- ==========================================
+-- ダッシュボードは一定間隔で新着を問い合わせる代わりに、grievance_changes チャンネルを LISTEN し、
+-- 通知が来た企業だけ新着分を取得する (manager_dashboard/grievance_notifications.py)。
+-- 通知の内容は企業ID・件数・最終投稿日時のみで、投稿本文や投稿者は含めない。
+-- 一括INSERTでも企業ごとに1件だけ通知するよう、文単位のトリガーで遷移テーブルを集計する。
+
+-- 1. 通知関数
+CREATE OR REPLACE FUNCTION public.notify_grievance_changes()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  r RECORD;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    FOR r IN SELECT company_id, count(*) AS n, max(created_at) AS last_created_at FROM new_rows GROUP BY company_id LOOP
+      PERFORM pg_notify('grievance_changes', json_build_object(
+        'op', TG_OP, 'company_id', r.company_id, 'count', r.n, 'last_created_at', r.last_created_at
+      )::text);
+    END LOOP;
+  ELSIF TG_OP = 'DELETE' THEN
+    FOR r IN SELECT company_id, count(*) AS n FROM old_rows GROUP BY company_id LOOP
+      PERFORM pg_notify('grievance_changes', json_build_object(
+        'op', TG_OP, 'company_id', r.company_id, 'count', r.n
+      )::text);
+    END LOOP;
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+-- ==========================================
+-- 2. トリガー (INSERT / DELETE)
+-- ==========================================
+-- 通知はトランザクションのコミット時に配信されるため、受け取った時点で新しい行は取得できる
+DROP TRIGGER IF EXISTS trigger_grievance_notify_insert ON public.grievances;
+DROP TRIGGER IF EXISTS trigger_grievance_notify_delete ON public.grievances;
+
+CREATE TRIGGER trigger_grievance_notify_insert
+AFTER INSERT ON public.grievances
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.notify_grievance_changes();
+
+CREATE TRIGGER trigger_grievance_notify_delete
+AFTER DELETE ON public.grievances
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.notify_grievance_changes();
+
+-- ==========================================
+-- 3. 動作確認 (ローカルの Postgres で)
+-- ==========================================
+-- psql で LISTEN grievance_changes; を実行した状態で別のセッションから課題をINSERTすると
+--   Asynchronous notification "grievance_changes" with payload "{"op" : "INSERT", "company_id" : "...", ...}"
+-- が表示される。
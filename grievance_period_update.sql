@@ -0,0 +1,48 @@
+-- ==========================================
+-- 期間を絞った解析のためのインデックスとレポート保持件数
+-- ==========================================
+-- ダッシュボードで「直近30日 / 直近90日 / 四半期 / 任意の期間」を選ぶと、その期間の課題だけを取得・解析する。
+
+-- 1. 企業 x 投稿日時の複合インデックス (init_schema_complete.sql の新規構築時と同じ構成にする)
+-- 期間指定 (created_at >= 開始 AND created_at < 終了) と、差分取得のキーセットページネーション
+-- (ORDER BY created_at, id) を企業内の範囲スキャンで処理する。
+-- 稼働中の grievances への投稿を止めないよう CONCURRENTLY で作成・削除する。
+-- CONCURRENTLY はトランザクション内では実行できないため、psql で (-1 / --single-transaction を付けずに) 実行すること。
+-- 作成が途中で失敗すると INVALID なインデックスが残り IF NOT EXISTS で作り直されないため、
+-- その場合は DROP INDEX CONCURRENTLY public.idx_grievances_company_created_at; を実行してからやり直す。
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_grievances_company_created_at ON public.grievances(company_id, created_at, id);
+
+-- company_id 単独のインデックスは上記の先頭列で代替できるため削除する (INSERT 時の更新コストを減らす)
+DROP INDEX CONCURRENTLY IF EXISTS public.idx_grievances_company_id;
+
+ANALYZE public.grievances;
+
+-- ==========================================
+-- 2. AIレポートの保持件数 (企業 x レポート種別ごと)
+-- ==========================================
+-- 期間ごとのレポートは report_type = 'ai_intro@<期間>' で保存する ('ai_intro@30d' / 'ai_intro@2024q1' / 'ai_intro@custom' など。
+-- 直近N日・任意の期間は日付を含まない固定の種別なので、種別の数は四半期の数程度にしか増えない)。
+-- 従来の「企業ごとに最新3件」だと期間を見比べただけで全期間のレポート (差分更新の基準) が消えるため、
+-- レポート種別ごとに最新3件を保持し、期間ごとのレポートは企業全体でも最新30件までとする。
+-- 全期間のレポート ('@' を含まない種別) は企業全体の上限の対象外とし、期間ごとのレポートに押し出されないようにする。
+CREATE OR REPLACE FUNCTION maintain_recent_ai_reports()
+RETURNS trigger AS $$
+BEGIN
+  DELETE FROM ai_reports
+  WHERE id IN (
+    SELECT id
+    FROM (
+      SELECT
+        id,
+        position('@' in report_type) > 0 AS windowed,
+        row_number() OVER (PARTITION BY report_type ORDER BY created_at DESC) AS type_rank,
+        row_number() OVER (PARTITION BY position('@' in report_type) > 0 ORDER BY created_at DESC) AS group_rank
+      FROM ai_reports
+      WHERE company_id = NEW.company_id
+    ) ranked
+    WHERE type_rank > 3 OR (windowed AND group_rank > 30)
+  );
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,206 @@
+-- ==========================================
+-- 企業ごとの課題集計テーブル (トリガーで自動更新)
+-- ==========================================
+-- ダッシュボードのヘッダー表示・キャッシュキー・新着判定のために grievances を全件取得しなくて済むよう、
+-- 企業ごとの件数・ストレス合計・最終投稿日時をトリガーで常に最新に保つ。
+-- 読み取りは grievance_stats_summary ビューの1行 (カテゴリ別の内訳はJSONで同梱) のみ。
+
+-- 1. 企業ごとの合計
+CREATE TABLE IF NOT EXISTS public.grievance_stats (
+    company_id UUID PRIMARY KEY REFERENCES public.companies(id) ON DELETE CASCADE,
+    total_count BIGINT NOT NULL DEFAULT 0,
+    stress_sum BIGINT NOT NULL DEFAULT 0,
+    stress_count BIGINT NOT NULL DEFAULT 0,
+    high_stress_count BIGINT NOT NULL DEFAULT 0,
+    last_submitted_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+-- 2. 企業 x カテゴリごとの内訳
+CREATE TABLE IF NOT EXISTS public.grievance_category_stats (
+    company_id UUID NOT NULL REFERENCES public.companies(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    total_count BIGINT NOT NULL DEFAULT 0,
+    stress_sum BIGINT NOT NULL DEFAULT 0,
+    stress_count BIGINT NOT NULL DEFAULT 0,
+    high_stress_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (company_id, category)
+);
+
+-- ==========================================
+-- 3. 集計の更新関数 (文単位のトリガー)
+-- ==========================================
+-- 一括INSERT (insert_dummy_data.sql 等) でも1文につき企業ごとに1回だけ更新するよう、遷移テーブルを集計して反映する。
+-- 高ストレスの閾値 (8以上) は manager_dashboard/aggregates.py の HIGH_STRESS_THRESHOLD と合わせること。
+-- 従業員のINSERTからも更新できるよう SECURITY DEFINER で実行する。
+CREATE OR REPLACE FUNCTION public.apply_grievance_stats()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO public.grievance_stats AS s (company_id, total_count, stress_sum, stress_count, high_stress_count, last_submitted_at, updated_at)
+    SELECT company_id, count(*), coalesce(sum(stress_level), 0), count(stress_level),
+           count(*) FILTER (WHERE stress_level >= 8), max(created_at), timezone('utc'::text, now())
+    FROM new_rows
+    GROUP BY company_id
+    ON CONFLICT (company_id) DO UPDATE SET
+      total_count = s.total_count + EXCLUDED.total_count,
+      stress_sum = s.stress_sum + EXCLUDED.stress_sum,
+      stress_count = s.stress_count + EXCLUDED.stress_count,
+      high_stress_count = s.high_stress_count + EXCLUDED.high_stress_count,
+      last_submitted_at = GREATEST(s.last_submitted_at, EXCLUDED.last_submitted_at),
+      updated_at = EXCLUDED.updated_at;
+
+    INSERT INTO public.grievance_category_stats AS c (company_id, category, total_count, stress_sum, stress_count, high_stress_count)
+    SELECT company_id, category, count(*), coalesce(sum(stress_level), 0), count(stress_level),
+           count(*) FILTER (WHERE stress_level >= 8)
+    FROM new_rows
+    GROUP BY company_id, category
+    ON CONFLICT (company_id, category) DO UPDATE SET
+      total_count = c.total_count + EXCLUDED.total_count,
+      stress_sum = c.stress_sum + EXCLUDED.stress_sum,
+      stress_count = c.stress_count + EXCLUDED.stress_count,
+      high_stress_count = c.high_stress_count + EXCLUDED.high_stress_count;
+
+  ELSIF TG_OP = 'DELETE' THEN
+    UPDATE public.grievance_stats s SET
+      total_count = s.total_count - d.n,
+      stress_sum = s.stress_sum - d.stress_sum,
+      stress_count = s.stress_count - d.stress_count,
+      high_stress_count = s.high_stress_count - d.high_stress_count,
+      -- 削除後の最終投稿日時は残っている行から求め直す
+      last_submitted_at = (SELECT max(g.created_at) FROM public.grievances g WHERE g.company_id = s.company_id),
+      updated_at = timezone('utc'::text, now())
+    FROM (
+      SELECT company_id, count(*) AS n, coalesce(sum(stress_level), 0) AS stress_sum, count(stress_level) AS stress_count,
+             count(*) FILTER (WHERE stress_level >= 8) AS high_stress_count
+      FROM old_rows
+      GROUP BY company_id
+    ) d
+    WHERE s.company_id = d.company_id;
+
+    UPDATE public.grievance_category_stats c SET
+      total_count = c.total_count - d.n,
+      stress_sum = c.stress_sum - d.stress_sum,
+      stress_count = c.stress_count - d.stress_count,
+      high_stress_count = c.high_stress_count - d.high_stress_count
+    FROM (
+      SELECT company_id, category, count(*) AS n, coalesce(sum(stress_level), 0) AS stress_sum, count(stress_level) AS stress_count,
+             count(*) FILTER (WHERE stress_level >= 8) AS high_stress_count
+      FROM old_rows
+      GROUP BY company_id, category
+    ) d
+    WHERE c.company_id = d.company_id AND c.category = d.category;
+
+    DELETE FROM public.grievance_category_stats WHERE total_count <= 0;
+  END IF;
+
+  RETURN NULL;
+END;
+$$;
+
+-- ==========================================
+-- 4. トリガー (INSERT / DELETE)
+-- ==========================================
+-- 課題の内容は投稿後に編集されない前提のため UPDATE は対象外
+DROP TRIGGER IF EXISTS trigger_grievance_stats_insert ON public.grievances;
+DROP TRIGGER IF EXISTS trigger_grievance_stats_delete ON public.grievances;
+
+CREATE TRIGGER trigger_grievance_stats_insert
+AFTER INSERT ON public.grievances
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.apply_grievance_stats();
+
+CREATE TRIGGER trigger_grievance_stats_delete
+AFTER DELETE ON public.grievances
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.apply_grievance_stats();
+
+-- ==========================================
+-- 5. 既存データからの初期集計 (再実行しても同じ結果になる)
+-- ==========================================
+INSERT INTO public.grievance_stats (company_id, total_count, stress_sum, stress_count, high_stress_count, last_submitted_at)
+SELECT company_id, count(*), coalesce(sum(stress_level), 0), count(stress_level),
+       count(*) FILTER (WHERE stress_level >= 8), max(created_at)
+FROM public.grievances
+GROUP BY company_id
+ON CONFLICT (company_id) DO UPDATE SET
+  total_count = EXCLUDED.total_count,
+  stress_sum = EXCLUDED.stress_sum,
+  stress_count = EXCLUDED.stress_count,
+  high_stress_count = EXCLUDED.high_stress_count,
+  last_submitted_at = EXCLUDED.last_submitted_at,
+  updated_at = timezone('utc'::text, now());
+
+DELETE FROM public.grievance_category_stats;
+INSERT INTO public.grievance_category_stats (company_id, category, total_count, stress_sum, stress_count, high_stress_count)
+SELECT company_id, category, count(*), coalesce(sum(stress_level), 0), count(stress_level),
+       count(*) FILTER (WHERE stress_level >= 8)
+FROM public.grievances
+GROUP BY company_id, category;
+
+-- ==========================================
+-- 6. ダッシュボード用の1行ビュー
+-- ==========================================
+-- security_invoker により、ビュー経由でも下記の RLS (自社のみ / 特権管理者は全社) が適用される
+CREATE OR REPLACE VIEW public.grievance_stats_summary
+WITH (security_invoker = true) AS
+SELECT
+  s.company_id,
+  s.total_count,
+  s.stress_sum,
+  s.stress_count,
+  s.high_stress_count,
+  s.last_submitted_at,
+  s.updated_at,
+  coalesce(
+    (SELECT jsonb_object_agg(c.category, jsonb_build_object(
+              'total_count', c.total_count,
+              'stress_sum', c.stress_sum,
+              'stress_count', c.stress_count,
+              'high_stress_count', c.high_stress_count))
+     FROM public.grievance_category_stats c
+     WHERE c.company_id = s.company_id),
+    '{}'::jsonb
+  ) AS categories
+FROM public.grievance_stats s;
+
+-- ==========================================
+-- 7. RLS (閲覧のみ。更新はトリガー経由)
+-- ==========================================
+ALTER TABLE public.grievance_stats ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.grievance_category_stats ENABLE ROW LEVEL SECURITY;
+
+DO $$ BEGIN
+    DROP POLICY IF EXISTS "Managers can view company grievance stats" ON public.grievance_stats;
+    DROP POLICY IF EXISTS "Super admins can view all grievance stats" ON public.grievance_stats;
+    DROP POLICY IF EXISTS "Managers can view company grievance category stats" ON public.grievance_category_stats;
+    DROP POLICY IF EXISTS "Super admins can view all grievance category stats" ON public.grievance_category_stats;
+END $$;
+
+CREATE POLICY "Managers can view company grievance stats"
+    ON public.grievance_stats FOR SELECT
+    USING (
+        company_id = public.get_my_company_id()
+        AND public.get_my_role() = 'manager'
+    );
+
+CREATE POLICY "Super admins can view all grievance stats"
+    ON public.grievance_stats FOR SELECT
+    USING (public.get_my_role() = 'super_admin');
+
+CREATE POLICY "Managers can view company grievance category stats"
+    ON public.grievance_category_stats FOR SELECT
+    USING (
+        company_id = public.get_my_company_id()
+        AND public.get_my_role() = 'manager'
+    );
+
+CREATE POLICY "Super admins can view all grievance category stats"
+    ON public.grievance_category_stats FOR SELECT
+    USING (public.get_my_role() = 'super_admin');
@@ -64,7 +64,8 @@ CREATE TABLE IF NOT EXISTS public.invite_tokens (
 -- 3. インデックス（パフォーマンス最適化）
 -- ==========================================
 CREATE INDEX IF NOT EXISTS idx_profiles_company_id ON public.profiles(company_id);
-CREATE INDEX IF NOT EXISTS idx_grievances_company_id ON public.grievances(company_id);
+-- 企業ごとの期間指定・差分取得 (ORDER BY created_at, id) 用。company_id 単独の検索もこの先頭列で処理する
+CREATE INDEX IF NOT EXISTS idx_grievances_company_created_at ON public.grievances(company_id, created_at, id);
 CREATE INDEX IF NOT EXISTS idx_grievances_user_id ON public.grievances(user_id);
 CREATE INDEX IF NOT EXISTS idx_analyses_company_id ON public.analyses(company_id);
 CREATE INDEX IF NOT EXISTS idx_invite_tokens_company_id ON public.invite_tokens(company_id);
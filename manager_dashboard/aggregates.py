@@ -0,0 +1,249 @@
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 課題データのローカル集計エンジン
+# ==========================================
+# 件数・平均・分布・推移といった定量的な指標は LLM に数えさせず、pandas/NumPy でベクトル演算する。
+# 結果はプロンプトへの要約入力、定量レポート (業務量・バーンアウト・生産性・カテゴリ別の課題分析)、グラフ描画に使う。
+
+CATEGORY_LABELS = {
+    "equipment": "設備・機材",
+    "human_relations": "人間関係・コミュニケーション",
+    "work_environment": "職場環境・ルール",
+    "workload": "業務量・スケジュール",
+    "other": "その他",
+}
+
+HIGH_STRESS_THRESHOLD = 8
+
+# カテゴリ別の課題分析レポート: report_id -> 対象カテゴリ
+CATEGORY_REPORTS = {
+    "human_relations_analysis": "human_relations",
+    "environment_analysis": "work_environment",
+    "equipment_analysis": "equipment",
+}
+
+# LLMを使わずローカル集計だけで作成するレポート
+QUANTITATIVE_REPORTS = {"workload_analysis", "burnout_risk", "productivity_bottlenecks", *CATEGORY_REPORTS}
+
+
+def category_label(category):
+    return CATEGORY_LABELS.get(category, category)
+
+
+def compute_aggregates(df, freq="W"):
+    n = len(df)
+    stress = pd.to_numeric(df["stress_level"], errors="coerce") if "stress_level" in df.columns else pd.Series(np.nan, index=df.index)
+    high = (stress >= HIGH_STRESS_THRESHOLD).to_numpy()
+
+    # ストレス度の分布 (1〜10)
+    valid = stress.dropna().to_numpy(dtype=np.int64).clip(1, 10)
+    distribution = pd.Series(np.bincount(valid, minlength=11)[1:], index=range(1, 11), name="count")
+
+    # カテゴリ別の件数・平均/合計ストレス・高ストレス件数
+    frame = pd.DataFrame({
+        "category": df["category"].astype(str).to_numpy() if "category" in df.columns else np.full(n, "other"),
+        "stress": stress.to_numpy(),
+        "high": high,
+    })
+    by_category = frame.groupby("category", observed=True).agg(
+        count=("stress", "size"),
+        mean_stress=("stress", "mean"),
+        stress_sum=("stress", "sum"),
+        high_stress=("high", "sum"),
+    )
+    # 件数 x 平均ストレス を「影響度」とみなす
+    by_category["impact"] = by_category["count"] * by_category["mean_stress"].fillna(0)
+    by_category = by_category.sort_values("impact", ascending=False)
+
+    # 期間ごとの推移 (全体と、カテゴリ別の件数)
+    trend = pd.DataFrame(columns=["count", "mean_stress", "high_stress_share"])
+    category_trend = pd.DataFrame()
+    if "created_at" in df.columns and n:
+        created = pd.to_datetime(df["created_at"], utc=True, errors="coerce", format="ISO8601")
+        series = pd.DataFrame({"stress": stress.to_numpy(), "high": high, "category": frame["category"].to_numpy()}, index=created.to_numpy())
+        series = series[series.index.notna()]
+        if len(series):
+            resampled = series.resample(freq)
+            trend = pd.DataFrame({
+                "count": resampled["stress"].size(),
+                "mean_stress": resampled["stress"].mean(),
+                "high_stress_share": resampled["high"].mean(),
+            })
+            category_trend = series.groupby([pd.Grouper(freq=freq), "category"]).size().unstack(fill_value=0).reindex(trend.index, fill_value=0)
+
+    # カテゴリ別のストレス度の分布 (行: カテゴリ, 列: 1〜10)
+    category_distribution = (
+        pd.crosstab(frame["category"], stress.clip(1, 10).to_numpy()).reindex(columns=range(1, 11), fill_value=0)
+        if stress.notna().any() else pd.DataFrame(columns=range(1, 11))
+    )
+
+    # 投稿者ごとの投稿頻度 (個人は特定せず分布だけを扱う)
+    user_frequency = pd.Series(dtype="int64")
+    repeat_high_stress_users = 0
+    if "user_id" in df.columns and n:
+        # user_id はカテゴリ型 (grievance_frames) のことがあるため、投稿の無いカテゴリ (0件) は除く
+        user_frequency = df["user_id"].value_counts()
+        user_frequency = user_frequency[user_frequency > 0]
+        repeat_high_stress_users = int((df.loc[high, "user_id"].value_counts() >= 2).sum())
+
+    summary = {
+        "total_grievances": int(n),
+        "average_stress_level": round(float(stress.mean()), 2) if stress.notna().any() else None,
+        "high_stress_share": round(float(high.mean()), 3) if n else 0.0,
+        "unique_posters": int(len(user_frequency)),
+        "posts_per_poster_median": float(user_frequency.median()) if len(user_frequency) else 0.0,
+        "repeat_high_stress_posters": repeat_high_stress_users,
+    }
+    return {
+        "summary": summary,
+        "by_category": by_category,
+        "stress_distribution": distribution,
+        "trend": trend,
+        "category_trend": category_trend,
+        "category_distribution": category_distribution,
+        "user_frequency": user_frequency,
+    }
+
+
+def aggregates_for_prompt(agg, max_periods=12):
+    # プロンプトに載せるコンパクトな集計値 (JSONシリアライズ可能な形)
+    by_category = agg["by_category"]
+    trend = agg["trend"].tail(max_periods)
+    return {
+        **agg["summary"],
+        "categories": [
+            {
+                "category": category_label(cat),
+                "count": int(row["count"]),
+                "mean_stress": round(float(row["mean_stress"]), 2) if pd.notna(row["mean_stress"]) else None,
+                "high_stress": int(row["high_stress"]),
+            }
+            for cat, row in by_category.iterrows()
+        ],
+        "stress_distribution": {int(k): int(v) for k, v in agg["stress_distribution"].items()},
+        "trend": [
+            {
+                "period": idx.strftime("%Y-%m-%d"),
+                "count": int(row["count"]),
+                "mean_stress": round(float(row["mean_stress"]), 2) if pd.notna(row["mean_stress"]) else None,
+            }
+            for idx, row in trend.iterrows()
+        ],
+    }
+
+
+def _category_table(by_category, columns):
+    md = "| カテゴリ | " + " | ".join(label for label, _ in columns) + " |\n"
+    md += "| :--- |" + " :---: |" * len(columns) + "\n"
+    for cat, row in by_category.iterrows():
+        cells = [fmt(row) for _, fmt in columns]
+        md += f"| {category_label(cat)} | " + " | ".join(cells) + " |\n"
+    return md + "\n"
+
+
+def _trend_direction(trend, column):
+    values = trend[column].dropna()
+    if len(values) < 2:
+        return "推移を判断するにはデータが不足しています"
+    recent = values.tail(4).mean()
+    earlier = values.head(max(1, len(values) - 4)).mean()
+    if recent > earlier * 1.1:
+        return "直近で**増加傾向**にあります"
+    if recent < earlier * 0.9:
+        return "直近で**減少傾向**にあります"
+    return "概ね**横ばい**です"
+
+
+def format_quantitative_report(report_id, agg):
+    summary = agg["summary"]
+    by_category = agg["by_category"]
+    trend = agg["trend"]
+
+    if report_id == "workload_analysis":
+        workload = by_category.loc[by_category.index == "workload"]
+        count = int(workload["count"].sum())
+        share = count / summary["total_grievances"] if summary["total_grievances"] else 0
+        md = "## 📊 業務量・スケジュールに関する定量分析\n\n"
+        md += f"- 業務量・スケジュールに関する投稿: **{count}件** (全体の {share:.0%})\n"
+        if count:
+            md += f"- 同カテゴリの平均ストレス度: **{float(workload['mean_stress'].iloc[0]):.1f} / 10**\n"
+        md += f"- 投稿件数の推移: {_trend_direction(trend, 'count')}\n\n"
+        md += "### カテゴリ別の投稿件数\n\n"
+        md += _category_table(by_category, [
+            ("件数", lambda r: f"{int(r['count'])}件"),
+            ("平均ストレス", lambda r: f"{r['mean_stress']:.1f}"),
+        ])
+        return md
+
+    if report_id == "burnout_risk":
+        share = summary["high_stress_share"]
+        level = "高" if share >= 0.3 else ("中" if share >= 0.15 else "低")
+        md = "## 🔥 バーンアウトリスクの定量判定\n\n"
+        md += f"| 指標 | 値 |\n| :--- | :---: |\n"
+        md += f"| **総合リスク判定** | `{level}` |\n"
+        md += f"| 高ストレス投稿 (ストレス度{HIGH_STRESS_THRESHOLD}以上) の割合 | `{share:.0%}` |\n"
+        md += f"| 平均ストレス度 | `{summary['average_stress_level']} / 10` |\n"
+        md += f"| 高ストレス投稿を繰り返している投稿者数 | `{summary['repeat_high_stress_posters']}人` |\n\n"
+        md += f"- 平均ストレス度の推移: {_trend_direction(trend, 'mean_stress')}\n\n"
+        md += "### カテゴリ別の高ストレス投稿\n\n"
+        md += _category_table(by_category, [
+            ("高ストレス件数", lambda r: f"{int(r['high_stress'])}件"),
+            ("平均ストレス", lambda r: f"{r['mean_stress']:.1f}"),
+        ])
+        return md
+
+    if report_id == "productivity_bottlenecks":
+        md = "## ⚙️ 生産性低下要因の定量ランキング\n\n"
+        md += "件数 × 平均ストレス度 を「影響度」として、優先的に対処すべき領域を並べています。\n\n"
+        md += _category_table(by_category, [
+            ("影響度", lambda r: f"{r['impact']:.0f}"),
+            ("件数", lambda r: f"{int(r['count'])}件"),
+            ("平均ストレス", lambda r: f"{r['mean_stress']:.1f}"),
+        ])
+        if len(by_category):
+            top = category_label(by_category.index[0])
+            md += f"> 最も影響度が大きい領域は **{top}** です。\n"
+        return md
+
+    if report_id in CATEGORY_REPORTS:
+        return _format_category_report(CATEGORY_REPORTS[report_id], agg)
+
+    raise ValueError(f"定量レポートではありません: {report_id}")
+
+
+def _format_category_report(category, agg):
+    # 1カテゴリに絞った件数・ストレス度・推移と、他カテゴリとの比較
+    summary = agg["summary"]
+    by_category = agg["by_category"]
+    label = category_label(category)
+    md = f"## 📊 {label}に関する定量分析\n\n"
+    if category not in by_category.index:
+        return md + f"{label}に関する投稿はまだありません。\n"
+
+    row = by_category.loc[category]
+    count = int(row["count"])
+    share = count / summary["total_grievances"] if summary["total_grievances"] else 0
+    rank = list(by_category.index).index(category) + 1
+    md += f"| 指標 | 値 |\n| :--- | :---: |\n"
+    md += f"| 投稿件数 | `{count}件 (全体の {share:.0%})` |\n"
+    md += f"| 平均ストレス度 | `{row['mean_stress']:.1f} / 10` (全体平均 {summary['average_stress_level']}) |\n"
+    md += f"| 高ストレス投稿 (ストレス度{HIGH_STRESS_THRESHOLD}以上) | `{int(row['high_stress'])}件` |\n"
+    md += f"| 影響度 (件数 × 平均ストレス) の順位 | `{rank}位 / {len(by_category)}カテゴリ` |\n\n"
+
+    category_trend = agg["category_trend"]
+    if category in category_trend.columns:
+        md += f"- 投稿件数の推移: {_trend_direction(category_trend, category)}\n\n"
+
+    distribution = agg["category_distribution"]
+    if category in distribution.index:
+        counts = distribution.loc[category]
+        md += "### ストレス度の分布\n\n"
+        md += "| ストレス度 | " + " | ".join(str(level) for level in counts.index) + " |\n"
+        md += "| :--- |" + " :---: |" * len(counts) + "\n"
+        md += "| 件数 | " + " | ".join(str(int(v)) for v in counts.to_numpy()) + " |\n\n"
+
+    if rank == 1:
+        md += f"> {label}は全カテゴリの中で最も影響度が大きく、優先的な対処が必要です。\n"
+    return md
@@ -0,0 +1,121 @@
+from datetime import date, datetime, time, timedelta, timezone
+
+# ==========================================
+# 解析期間 (直近30日 / 直近90日 / 四半期 / 任意の期間)
+# ==========================================
+# 期間は日本時間の日付で区切り、[start, end) の UTC の ISO 8601 文字列として扱う (None は制限なし)。
+# key は画面側の期間ごとの状態 (結合PDFなど) のキー。直近N日は日付が変わるまで同じ key になる。
+# report_key は ai_reports の report_type ('ai_intro@<report_key>') に使う、日付を含まない固定のキー
+# (直近N日は "30d" / "90d"、四半期は "2024q1"、任意の期間はまとめて "custom")。
+# report_type の種類が日ごとに増えないようにし、ワーカーが作った最新の結果を翌日も「再解析待ち」として表示できるようにする。
+# レポート自体の同一性は課題セットから作る指紋で判定するため、同じ report_key の中で期間がずれても取り違えない。
+
+JST = timezone(timedelta(hours=9))
+
+WINDOW_CHOICES = {
+    "all": "全期間",
+    "30d": "直近30日",
+    "90d": "直近90日",
+    "quarter": "四半期",
+    "custom": "期間を指定",
+}
+
+
+def today_jst():
+    return datetime.now(JST).date()
+
+
+def day_start(d):
+    # 日本時間の d の 0:00 を UTC の ISO 8601 文字列にする
+    return datetime.combine(d, time.min, tzinfo=JST).astimezone(timezone.utc).isoformat()
+
+
+def all_window():
+    return {"key": "all", "report_key": "all", "kind": "all", "label": WINDOW_CHOICES["all"], "start": None, "end": None}
+
+
+def rolling_window(days, today=None):
+    # 今日を含む直近 days 日 (終了は制限なし)
+    first = (today or today_jst()) - timedelta(days=days - 1)
+    return {
+        "key": f"{days}d-{first.isoformat()}",
+        "report_key": f"{days}d",
+        "kind": "rolling",
+        "label": f"直近{days}日 ({first:%Y/%m/%d}〜)",
+        "start": day_start(first),
+        "end": None,
+    }
+
+
+def quarter_start(year, quarter):
+    return date(year, 3 * quarter - 2, 1)
+
+
+def quarter_window(year, quarter):
+    first = quarter_start(year, quarter)
+    following = quarter_start(year + 1, 1) if quarter == 4 else quarter_start(year, quarter + 1)
+    return {
+        "key": f"{year}q{quarter}",
+        "report_key": f"{year}q{quarter}",
+        "kind": "quarter",
+        "label": f"{year}年 第{quarter}四半期",
+        "start": day_start(first),
+        "end": day_start(following),
+    }
+
+
+def recent_quarters(today=None, count=8):
+    # 今四半期から遡って count 件の (年, 四半期)
+    today = today or today_jst()
+    year, quarter = today.year, (today.month - 1) // 3 + 1
+    quarters = []
+    for _ in range(count):
+        quarters.append((year, quarter))
+        year, quarter = (year - 1, 4) if quarter == 1 else (year, quarter - 1)
+    return quarters
+
+
+def custom_window(first, last):
+    # first〜last (両端の日を含む)
+    if last < first:
+        first, last = last, first
+    return {
+        "key": f"{first.isoformat()}_{last.isoformat()}",
+        "report_key": "custom",
+        "kind": "custom",
+        "label": f"{first:%Y/%m/%d}〜{last:%Y/%m/%d}",
+        "start": day_start(first),
+        "end": day_start(last + timedelta(days=1)),
+    }
+
+
+# report_worker.py が事前計算する期間 (REPORT_MODE=precomputed 用。任意の期間は事前計算できないため選べない)
+PRECOMPUTED_WINDOWS = ["30d", "90d", "quarter"]
+
+
+def preset_window(name, today=None):
+    # サイドバーの既定の選択肢と同じ期間 ("quarter" は今四半期、"last_quarter" は前四半期)
+    today = today or today_jst()
+    if name == "all":
+        return all_window()
+    if name in ("30d", "90d"):
+        return rolling_window(int(name[:-1]), today)
+    if name in ("quarter", "last_quarter"):
+        return quarter_window(*recent_quarters(today, count=2)[0 if name == "quarter" else 1])
+    raise ValueError(f"不明な期間です: {name}")
+
+
+def window_report_is_stale(window, last_grievance, last_report, today=None):
+    # ワーカーがこの期間のレポートを作り直す必要があるか
+    # last_grievance: 企業の最終投稿日時 / last_report: この期間の最新レポートの作成日時 (いずれも datetime か None)
+    if last_grievance is None or (window["start"] is not None and last_grievance < datetime.fromisoformat(window["start"])):
+        # 期間内に投稿が無い (空の期間のレポートは作らない)
+        return False
+    if last_report is None:
+        return True
+    if window["kind"] == "rolling" and last_report < datetime.fromisoformat(day_start(today or today_jst())):
+        # 直近N日は投稿が無くても日付が変わると対象がずれるため、1日1回作り直す
+        return True
+    # 終了後に作ったレポートには、その後の投稿は含まれない (= 期間の課題は変わらない)
+    ended = window["end"] is not None and last_report >= datetime.fromisoformat(window["end"])
+    return last_grievance > last_report and not ended
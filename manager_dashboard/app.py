@@ -1,14 +1,16 @@
 import streamlit as st
-import pandas as pd
-from supabase import create_client, Client
-import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 import streamlit.components.v1 as components
-import json
-import markdown
-import pdfkit
-import base64
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import threading
+import queue
+import time
+from tracing import TracedClient, begin_trace, record_elapsed, tracer
+
+# pandas・Gemini SDK・レポート関連モジュールは読み込みが重いため、ログイン画面では読み込まず
+# ログイン後 (「4. データ取得関数」の直前) に読み込む。plotly はグラフを描くときに読み込む。
+bootstrap_started_ns = time.time_ns()
 
 # ==========================================
 # 1. 環境設定と初期化
@@ -98,16 +100,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# 環境変数の読み込み (app.pyが配置されているmanager_dashboardの親ディレクトリにある.env.localを読み込む)
-current_dir = os.path.dirname(os.path.abspath(__file__))
-env_path = os.path.join(current_dir, '..', '.env.local')
-load_dotenv(env_path)
-
-SUPABASE_URL = ""
-SUPABASE_KEY = ""
-GEMINI_API_KEY = ""
-PAYPAL_CLIENT_ID = "test"
-
 # Streamlit CloudのSecretsか、ローカルのOS環境変数から取得する関数
 def get_env_var(key, default=""):
     try:
@@ -117,21 +109,74 @@ def get_env_var(key, default=""):
         pass
     return os.environ.get(key, default)
 
-SUPABASE_URL = get_env_var("NEXT_PUBLIC_SUPABASE_URL", "")
-SUPABASE_KEY = get_env_var("NEXT_PUBLIC_SUPABASE_ANON_KEY", "")
-GEMINI_API_KEY = get_env_var("GEMINI_API_KEY", "")
-PAYPAL_CLIENT_ID = get_env_var("PAYPAL_CLIENT_ID", "test")
+@st.cache_resource
+def load_config():
+    # 環境変数の読み込み (app.pyが配置されているmanager_dashboardの親ディレクトリにある.env.localを読み込む)
+    # .env.local の読み込みと設定値の解決はプロセスで1回だけ行い、再実行ごとには繰り返さない
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    load_dotenv(os.path.join(current_dir, '..', '.env.local'))
+    return {
+        "SUPABASE_URL": get_env_var("NEXT_PUBLIC_SUPABASE_URL", ""),
+        "SUPABASE_KEY": get_env_var("NEXT_PUBLIC_SUPABASE_ANON_KEY", ""),
+        "GEMINI_API_KEY": get_env_var("GEMINI_API_KEY", ""),
+        "PAYPAL_CLIENT_ID": get_env_var("PAYPAL_CLIENT_ID", "test"),
+        # 特権管理者の一括生成専用 (RLSを越えて全企業のレポートを読み書きする)。未設定なら一括生成は使えない
+        "SUPABASE_SERVICE_ROLE_KEY": get_env_var("SUPABASE_SERVICE_ROLE_KEY", ""),
+        # レポート生成の同時実行数と1レポートあたりのタイムアウト(秒)
+        "REPORT_CONCURRENCY": int(get_env_var("REPORT_CONCURRENCY", "4")),
+        "REPORT_TIMEOUT_SECONDS": float(get_env_var("REPORT_TIMEOUT_SECONDS", "180")),
+        # "inline": 画面表示時に必要ならモデルを呼ぶ / "precomputed": report_worker.py の結果のみを表示する
+        "REPORT_MODE": get_env_var("REPORT_MODE", "inline"),
+        # Gemini 呼び出しの流量制限 (プロセス全体・全セッション共通)
+        "GEMINI_RATE_PER_MINUTE": float(get_env_var("GEMINI_RATE_PER_MINUTE", "60")),
+        "GEMINI_BURST": int(get_env_var("GEMINI_BURST", "10")),
+        "GEMINI_MAX_WAITING": int(get_env_var("GEMINI_MAX_WAITING", "32")),
+        # 企業ごとの課題フレームをプロセス内に保持する合計の上限 (MB)。超えたら最も古く使われた企業から捨てる
+        "GRIEVANCE_CACHE_MB": float(get_env_var("GRIEVANCE_CACHE_MB", "512")),
+        # 課題スナップショット (Arrow IPC) の保存先。投稿本文を含むためリポジトリの外に置く (未設定ならユーザーのキャッシュディレクトリ)
+        "GRIEVANCE_SNAPSHOT_DIR": get_env_var("GRIEVANCE_SNAPSHOT_DIR", ""),
+        # 課題の変更通知 (LISTEN/NOTIFY) を受け取る Postgres への直接接続。未設定なら従来通り問い合わせで新着を確認する
+        "GRIEVANCE_NOTIFY_DSN": get_env_var("GRIEVANCE_NOTIFY_DSN", ""),
+    }
+
+config = load_config()
+SUPABASE_URL = config["SUPABASE_URL"]
+SUPABASE_KEY = config["SUPABASE_KEY"]
+GEMINI_API_KEY = config["GEMINI_API_KEY"]
+PAYPAL_CLIENT_ID = config["PAYPAL_CLIENT_ID"]
+SUPABASE_SERVICE_ROLE_KEY = config["SUPABASE_SERVICE_ROLE_KEY"]
+REPORT_CONCURRENCY = config["REPORT_CONCURRENCY"]
+REPORT_TIMEOUT_SECONDS = config["REPORT_TIMEOUT_SECONDS"]
+REPORT_MODE = config["REPORT_MODE"]
+GEMINI_RATE_PER_MINUTE = config["GEMINI_RATE_PER_MINUTE"]
+GEMINI_BURST = config["GEMINI_BURST"]
+GEMINI_MAX_WAITING = config["GEMINI_MAX_WAITING"]
+GRIEVANCE_CACHE_MB = config["GRIEVANCE_CACHE_MB"]
+GRIEVANCE_SNAPSHOT_DIR = config["GRIEVANCE_SNAPSHOT_DIR"]
+GRIEVANCE_NOTIFY_DSN = config["GRIEVANCE_NOTIFY_DSN"]
 
 # クライアント初期化
-if SUPABASE_URL and SUPABASE_KEY:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-else:
+if not (SUPABASE_URL and SUPABASE_KEY):
     st.error("Supabaseの環境変数が設定されていません")
     st.stop()
 
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-else:
+def get_supabase():
+    # 認証状態 (セッション・トークン) はクライアントが持つため、プロセス全体ではなくセッションごとに1つ作って再実行間で使い回す
+    if "supabase_client" not in st.session_state:
+        from supabase import create_client
+        # table(...).execute() ごとの所要時間・行数・バイト数を計測するラッパー
+        st.session_state.supabase_client = TracedClient(create_client(SUPABASE_URL, SUPABASE_KEY))
+        st.session_state.auth_applied_token = None
+    return st.session_state.supabase_client
+
+@st.cache_resource
+def configure_gemini(api_key):
+    # Gemini SDK の読み込みと設定はプロセスで1回だけ (ログイン画面では読み込まない)
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return True
+
+if not GEMINI_API_KEY:
     st.warning("Gemini API Keyが設定されていません。レポートはダミーで表示されます。")
 
 # ==========================================
@@ -146,10 +191,11 @@ if "access_token" not in st.session_state:
 if "refresh_token" not in st.session_state:
     st.session_state.refresh_token = None
 
-# セッションの復元
-if st.session_state.access_token and st.session_state.refresh_token:
+# セッションの復元 (トークンが変わったときだけ。同じクライアントには再実行のたびに設定し直さない)
+if st.session_state.access_token and st.session_state.refresh_token and st.session_state.get("auth_applied_token") != st.session_state.access_token:
     try:
-        supabase.auth.set_session(st.session_state.access_token, st.session_state.refresh_token)
+        get_supabase().auth.set_session(st.session_state.access_token, st.session_state.refresh_token)
+        st.session_state.auth_applied_token = st.session_state.access_token
     except Exception:
         st.session_state.user = None
         st.session_state.profile = None
@@ -167,6 +213,7 @@ def login():
     password = st.text_input("パスワード", type="password")
     
     if st.button("ログイン"):
+        supabase = get_supabase()
         try:
             res = supabase.auth.sign_in_with_password({"email": email, "password": password})
             if res.user:
@@ -178,6 +225,8 @@ def login():
                     st.session_state.profile = profile.data
                     st.session_state.access_token = res.session.access_token
                     st.session_state.refresh_token = res.session.refresh_token
+                    # sign_in 済みのクライアントにはトークンが設定されているため、次の再実行で set_session しない
+                    st.session_state.auth_applied_token = res.session.access_token
                     st.success("ログイン成功！")
                     st.rerun()
                 else:
@@ -189,6 +238,31 @@ if not st.session_state.user:
     login()
     st.stop()
 
+supabase = get_supabase()
+
+# ログイン後にだけ必要な重いモジュール (2回目以降の再実行では sys.modules から即座に返る)
+import pandas as pd
+from datetime import timedelta
+from report_cache import ReportLRU
+from pdf_renderer import PdfRenderer, combined_pdf_key
+from entitlements import EntitlementService
+from grievance_loader import IncrementalGrievanceLoader
+from grievance_stats import fetch_grievance_stats
+from grievance_snapshots import DEFAULT_SNAPSHOT_DIR, GrievanceSnapshotStore
+from grievance_notifications import GrievanceChangeListener
+from report_runner import run_concurrently
+from gemini_gateway import GeminiGateway
+from grievance_clusters import GrievanceClusterer
+from report_engine import format_ai_intro_report, format_ai_intro_markdown, generate_report_json, read_precomputed_report_json, gemini_generate, gemini_generate_stream, streaming_caller
+from report_worker import process_company
+from bulk_reports import BulkReportRun, BulkReportRunner, select_companies
+from report_stream import AiIntroStreamParser
+from report_cache import grievance_set_hash
+from analysis_windows import WINDOW_CHOICES, all_window, custom_window, quarter_window, recent_quarters, rolling_window, today_jst
+from aggregates import CATEGORY_REPORTS, QUANTITATIVE_REPORTS, category_label, compute_aggregates, format_quantitative_report
+if GEMINI_API_KEY:
+    configure_gemini(GEMINI_API_KEY)
+
 company_id = st.session_state.profile.get("company_id")
 manager_id = st.session_state.profile.get("id")
 is_super_admin = st.session_state.profile.get("role") == "super_admin"
@@ -196,22 +270,72 @@ is_super_admin = st.session_state.profile.get("role") == "super_admin"
 # ==========================================
 # 4. データ取得関数 (DB Query)
 # ==========================================
+def get_entitlements():
+    # サブスク状態・購入済みレポート・企業一覧をセッション単位で短時間キャッシュする
+    if "entitlements" not in st.session_state:
+        st.session_state.entitlements = EntitlementService(ttl=60)
+    return st.session_state.entitlements
+
 def get_all_companies():
-    res = supabase.table("companies").select("id, name").order("created_at").execute()
-    return {c["id"]: c["name"] for c in res.data}
+    return get_entitlements().all_companies(supabase)
+
+@st.cache_resource
+def get_grievance_loader():
+    # 企業ごとのDataFrameとウォーターマークをプロセス全体で共有する
+    # 再起動後や別プロセスとはディスク上のスナップショット (Arrow IPC) を共有し、新着分だけを取得する
+    # 型を詰めたフレームを合計 GRIEVANCE_CACHE_MB までLRUで保持する (特権管理者が多数の企業を見て回っても増え続けない)
+    return IncrementalGrievanceLoader(
+        page_size=1000, refresh_interval=60, snapshot_store=GrievanceSnapshotStore(GRIEVANCE_SNAPSHOT_DIR or DEFAULT_SNAPSHOT_DIR),
+        max_bytes=int(GRIEVANCE_CACHE_MB * 1024 * 1024)
+    )
 
-@st.cache_data(ttl=60)
-def get_grievances(cid):
-    res = supabase.table("grievances").select("*").eq("company_id", cid).execute()
-    return pd.DataFrame(res.data)
+@st.cache_data(ttl=5, show_spinner=False)
+def get_grievance_stats(cid):
+    # DB側のトリガーが更新している企業ごとの集計 (1行)。未適用の環境では None
+    return fetch_grievance_stats(supabase, cid)
+
+@st.cache_resource
+def get_change_listener():
+    # 課題の追加・削除の通知を受け取るスレッド (プロセスで1つ)。GRIEVANCE_NOTIFY_DSN が未設定なら None
+    if not GRIEVANCE_NOTIFY_DSN:
+        return None
+    listener = GrievanceChangeListener(GRIEVANCE_NOTIFY_DSN)
+    listener.subscribe(get_grievance_loader().notify_change)
+    return listener.start()
+
+def grievances_live():
+    # 変更通知を受信中か (切断中は従来の問い合わせによる確認に戻る)
+    listener = get_change_listener()
+    return listener is not None and listener.connected
+
+def get_grievances(cid, window=None):
+    # 変更通知を受信中は、通知が来た企業だけ前回以降の新着分を取得してマージする
+    # それ以外は集計の件数・最終投稿日時が変わったときだけ取得する (集計が使えない環境では60秒ごと)
+    # window (analysis_windows) を渡すとその期間の課題だけを返す (期間ごとのフレームも同じローダーが保持する)
+    start, end = (window["start"], window["end"]) if window else (None, None)
+    if grievances_live():
+        return get_grievance_loader().load_window(supabase, cid, start, end, live=True)
+    return get_grievance_loader().load_window(supabase, cid, start, end, stats=get_grievance_stats(cid))
+
+def watch_grievance_changes(cid):
+    # 表示中の企業に新しい課題が届いたら1秒以内に再実行する (比較はメモリ上の変更回数のみで、DBには問い合わせない)
+    listener = get_change_listener()
+    if listener is None:
+        return
+    seen = listener.version(cid)
+
+    @st.fragment(run_every=1)
+    def watcher():
+        if listener.version(cid) != seen:
+            st.rerun()
+
+    watcher()
 
 def check_subscription(cid):
-    res = supabase.table("subscriptions").select("*").eq("company_id", cid).eq("status", "active").execute()
-    return len(res.data) > 0, res.data
+    return get_entitlements().get(supabase, cid)["is_subscribed"]
 
 def get_purchased_reports(cid):
-    res = supabase.table("report_purchases").select("report_type").eq("company_id", cid).execute()
-    return [r["report_type"] for r in res.data]
+    return get_entitlements().get(supabase, cid)["purchased_reports"]
 
 # ==========================================
 # 5. 特権管理者向けの動的切り替えUI (サイドバーの一部)
@@ -237,189 +361,109 @@ if is_super_admin:
     
     # Selected Name -> Selected ID
     if filtered_options:
-        inv_map = {v: k for k, v in all_companies.items()}
-        company_id = inv_map[selected_company_name]
+        company_id = get_entitlements().company_id_by_name(selected_company_name)
     
     is_subscribed = True # スーパー管理者は全開放
     purchased_reports = []
     st.sidebar.markdown(f"**サブスク状態:** [ 全開放 (Super Admin) ]")
 else:
-    is_subscribed, sub_data = check_subscription(company_id)
+    # サブスク状態と購入済みレポートは1回のクエリでまとめて取得される
+    is_subscribed = check_subscription(company_id)
     purchased_reports = get_purchased_reports(company_id)
     st.sidebar.markdown(f"**サブスク状態:** {'[ 有効 (全開放) ]' if is_subscribed else '[ 未登録 ]'}")
+    if st.sidebar.button("購入状況を更新"):
+        # 決済完了後にキャッシュを破棄して最新の状態を読み直す
+        get_entitlements().invalidate(company_id)
+        st.rerun()
+
+# ==========================================
+# 5.5 解析期間の選択 (サイドバー)
+# ==========================================
+def select_analysis_window():
+    # 期間を絞ると、その期間の課題だけを取得・集計・解析する (期間ごとの結果はキャッシュされ、見比べても再解析しない)
+    st.sidebar.markdown("### ▶ 解析期間")
+    # precomputed ではワーカーが作った期間のレポートしか表示できないため、任意の期間は選べない
+    choices = [c for c in WINDOW_CHOICES if not (REPORT_MODE == "precomputed" and c == "custom")]
+    choice = st.sidebar.selectbox("解析期間", choices, format_func=WINDOW_CHOICES.get, key="analysis_window", label_visibility="collapsed")
+    if choice == "30d":
+        return rolling_window(30)
+    if choice == "90d":
+        return rolling_window(90)
+    if choice == "quarter":
+        year, quarter = st.sidebar.selectbox("四半期", recent_quarters(), format_func=lambda q: f"{q[0]}年 第{q[1]}四半期", key="analysis_quarter")
+        return quarter_window(year, quarter)
+    if choice == "custom":
+        today = today_jst()
+        picked = st.sidebar.date_input("期間", value=(today - timedelta(days=29), today), max_value=today, key="analysis_range")
+        # 開始日だけを選んだ途中の状態では、その1日を対象にする
+        picked = picked if isinstance(picked, (list, tuple)) else (picked,)
+        return custom_window(picked[0], picked[-1])
+    return all_window()
+
+analysis_window = select_analysis_window()
 
 # ==========================================
 # 6. Gemini AI 解析・提言生成関数 & PDF出力
 # ==========================================
-def create_pdf_from_md(md_content, title):
-    # マークダウンをHTMLに変換
-    html_body = markdown.markdown(md_content, extensions=['tables'])
-    
-    # PDF用のCSS＆HTMLラッパー (日本語フォント対応)
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="ja">
-    <head>
-        <meta charset="UTF-8">
-        <title>{title}</title>
-        <style>
-            body {{
-                font-family: "Noto Sans JP", "Hiragino Kaku Gothic ProN", "Meiryo", sans-serif;
-                color: #333;
-                line-height: 1.6;
-                padding: 20px;
-                background-color: #fff;
-            }}
-            h1, h2, h3, h4 {{ color: #1e293b; border-bottom: 1px solid #cbd5e1; padding-bottom: 8px; }}
-            h1 {{ font-size: 24px; }}
-            h2 {{ font-size: 20px; margin-top: 24px; }}
-            h3 {{ font-size: 16px; margin-top: 20px; }}
-            code {{ background-color: #f1f5f9; padding: 2px 6px; border-radius: 4px; font-family: monospace; color: #0f172a; font-weight: bold; }}
-            pre code {{ display: block; padding: 10px; overflow-x: auto; }}
-            ul {{ padding-left: 20px; }}
-            hr {{ border: 0; border-top: 1px dashed #cbd5e1; margin: 20px 0; }}
-        </style>
-    </head>
-    <body>
-        <h1>■ {title}</h1>
-        {html_body}
-    </body>
-    </html>
-    """
-    
-    options = {
-        'page-size': 'A4',
-        'margin-top': '0.75in',
-        'margin-right': '0.75in',
-        'margin-bottom': '0.75in',
-        'margin-left': '0.75in',
-        'encoding': "UTF-8",
-        'no-outline': None
-    }
-    
-    try:
-        # ローカル環境のパスやCloud環境に応じてwkhtmltopdfを実行
-        # Streamlit Cloudでは packages.txt で wkhtmltopdf をインストール済み
-        pdf_bytes = pdfkit.from_string(html_content, False, options=options)
-        return pdf_bytes
-    except Exception as e:
-        print(f"PDF生成エラー: {e}")
-        return None
+@st.cache_resource
+def get_pdf_renderer():
+    # wkhtmltopdf の同時起動数を全セッション合計で2つまでに制限し、生成済みPDFは共有する
+    return PdfRenderer(max_renderers=2, cache_bytes=64 * 1024 * 1024)
 
-def format_ai_intro_report(json_str):
-    try:
-        data = json.loads(json_str)
-        
-        md = f"## 📊 Executive Summary\n"
-        md += f"> {data.get('executive_summary', '')}\n\n"
-        
-        # 2カラムレイアウト風のスコア表示 (マークダウンテーブルを使用)
-        md += "---\n\n"
-        md += "### 🎯 組織の現状インデックス\n\n"
-        md += "| 指標 | スコア | 評価 |\n"
-        md += "| :--- | :---: | :--- |\n"
-        
-        readiness = data.get('readiness_score', 0)
-        readiness_eval = "高 (即時導入推奨)" if readiness >= 70 else ("中 (基盤整備が必要)" if readiness >= 40 else "低 (意識改革から)")
-        md += f"| **AI導入 Readiness Score** | `{readiness} / 100` | {readiness_eval} |\n"
-        md += f"| **蓄積された深刻度 (Gポイント)** | `{data.get('earned_g_points', 0)} Gpt` | 組織の不満の総量 |\n\n"
-        
-        md += "### 📉 課題別 ペイン・インジケーター (ECRS分析起点)\n"
-        charts = data.get('chart_data', {})
-        
-        def render_stars(score):
-            return f"`{'★' * score}{'☆' * (5 - score)}` ({score}/5)"
-            
-        md += f"- **手入力・転記作業の疲弊**: {render_stars(charts.get('manual_work', 0))}\n"
-        md += f"- **連絡・確認待ちのタイムロス**: {render_stars(charts.get('communication', 0))}\n"
-        md += f"- **ナレッジの属人化・ブラックボックス化**: {render_stars(charts.get('knowledge_silo', 0))}\n"
-        md += f"- **承認フローの滞留・サイロ化**: {render_stars(charts.get('workflow', 0))}\n\n"
-        
-        md += "---\n\n"
-        md += "## 💡 具体的なDX/AI 導入プラン (ROI最適化)\n\n"
-        
-        for idx, sol in enumerate(data.get('ai_solutions', [])):
-            md += f"### 【提案 {idx+1}】 {sol.get('title', '')}\n\n"
-            
-            md += f"#### 🔍 現状のペインと根本原因\n"
-            md += f"{sol.get('current_pain_and_cause', '')}\n\n"
-            
-            md += f"#### ⚙️ 推奨技術アーキテクチャ\n"
-            md += f"{sol.get('tech_architecture', '')}\n\n"
-            
-            md += f"#### 💰 定量的ROIシミュレーション\n"
-            md += f"> **想定インパクト:**\n> {sol.get('quantitative_roi', '')}\n\n"
-            
-            if idx < len(data.get('ai_solutions', [])) - 1:
-                md += "<br><hr><br>\n\n"
-                
-        return md
-    except Exception as e:
-        return f"レポートの表示フォーマット構築に失敗しました。\nエラー詳細: {e}\n\n生データ:\n```json\n{json_str}\n```"
-
-def generate_report(report_id, title, df, cid=None):
+def create_pdf_from_md(md_content, title):
+    return get_pdf_renderer().render(md_content, title)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_aggregates(cid, set_hash, _df):
+    # 課題セットのハッシュが同じ間は集計結果を再利用する (_df はキャッシュキーに含めない)
+    return compute_aggregates(_df)
+
+@st.cache_resource
+def get_report_lru():
+    # 全セッション共通のレポートキャッシュ (プロセス内)
+    return ReportLRU(maxsize=256)
+
+@st.cache_resource
+def get_gemini_gateway():
+    # 同じ企業・同じ課題セットのレポート生成を全セッションで1回にまとめ、Geminiの呼び出し頻度を制限する
+    return GeminiGateway(rate_per_minute=GEMINI_RATE_PER_MINUTE, burst=GEMINI_BURST, max_waiting=GEMINI_MAX_WAITING)
+
+@st.cache_resource
+def get_grievance_clusterer():
+    # 類似投稿のまとめ (クラスタ割り当て) を企業ごとに保持し、新しい投稿だけを追加で割り当てる
+    return GrievanceClusterer()
+
+def generate_report(report_id, title, df, cid=None, on_chunk=None, full_refresh=False, window_key=None, stats=None):
+    # stats: 全期間の df に対応する集計行 (レポートの指紋をフレームを走査せずに作る)。期間を絞った場合は None
     if df.empty:
         return "データが不足しているため解析できません。"
         
-    # テスト対応: APIコスト節約のため、ai_intro以外はダミーを返す
+    # 定量レポートはローカル集計のみで作成する (LLMは使わない)
+    if report_id in QUANTITATIVE_REPORTS:
+        return format_quantitative_report(report_id, get_aggregates(cid, grievance_set_hash(df, stats), df))
+
     if report_id != "ai_intro":
-        return f"【開発中ダミーデータ】\n\n**{title}** に関する「解析と提言」がここに表示されます。現在はプロンプト調整・テスト中のため、APIリクエストをスキップしています。"
-
-    # プロンプトの調整（Gポイント・重厚なDXコンサルタント形式）
-    prompt = f"""
-あなたは、時給数万円のトップレベルDX・AIコンサルタントです。
-提供された「現場の不満（生の声）」の裏に潜む組織的なボトルネックを特定し、経営者が即座に予算承認できるレベルの、極めて詳細かつ重厚な「AI導入提案レポート」を作成してください。
-出力は以下のJSONフォーマットのみとし、各プロパティの指示（思考フレームワーク、文字数、必須項目）を絶対に厳守すること。
-
-{{
-  "executive_summary": "(String) 組織の病巣と、AI導入による変革のビジョン。入力された具体的な不満を引用しながら、なぜ今、既存のやり方を捨ててAI投資が必要なのかを論理的かつ情熱的に説くこと。経営者の危機感と期待を煽るストーリー仕立てで、必ず800文字以上で記述せよ。",
-  "readiness_score": "(Integer, 0-100) 組織のアナログ度合いから算出する、AI導入による「投資対効果の出やすさ」。",
-  "chart_data": {{
-    "manual_work": "(Integer 1-5) 手入力・転記作業の深刻度",
-    "communication": "(Integer 1-5) 連絡・確認待ちのロスの深刻度",
-    "knowledge_silo": "(Integer 1-5) ナレッジの属人化の深刻度",
-    "workflow": "(Integer 1-5) 承認フローの滞留の深刻度"
-  }},
-  "ai_solutions": [
-    {{
-      "title": "(String) 経営者の目を引く、具体的な導入案の名称（例：「社内規程RAG構築による問い合わせゼロ化」等）",
-      "current_pain_and_cause": "(String) 現場の不満を起点とし、ECRSの原則（排除・結合・交換・簡素化）を用いて現状の業務プロセスがなぜ破綻しているかを分析すること。（400文字以上）",
-      "tech_architecture": "(String) 推奨する具体的な技術スタック（例：Gemini 1.5 Pro, Dify, Supabase, OCR等）を挙げ、それが現場の業務フローにどう組み込まれるのか、データの流れと操作手順をエンジニアが実装できるレベルで詳細に解説すること。（500文字以上）",
-      "quantitative_roi": "(String) 削減される想定労働時間、平均的な人件費換算でのコストダウン金額（年額）、およびミスの削減率など、具体的な数値を交えた「シビアな投資対効果のシミュレーション」を提示すること。（400文字以上）"
-    }},
-    {{ ...提案2... }},
-    {{ ...提案3... }}
-  ],
-  "earned_g_points": "(Integer) 今回の不満群から獲得した「Gポイント」（深刻度と解決時のインパクトに応じ100〜10000で算出）"
-}}
-
-データ: 
-{df.to_json(orient='records', force_ascii=False)}
-
-重要: 出力は純粋なJSONテキストのみとし、マークダウンブロック(`json `)などを含めないでください。JSONとしてそのままパース可能な形式にしてください。
-"""
+        return f"【エラー】{title} は現在提供していません。"
+
+    if REPORT_MODE == "precomputed":
+        # バックグラウンドワーカーが作成済みの結果だけを読む (画面表示でモデルは呼ばない)
+        # 期間ごとのレポートも、ワーカーがまだ作り直していなければその期間の最新の結果を「再解析待ち」として表示する
+        json_text, is_stale = read_precomputed_report_json(supabase, get_report_lru(), cid, report_id, df, window_key=window_key, stats=stats)
+        if json_text is None:
+            return "レポートを準備中です。バックグラウンドで解析が完了するとここに表示されます。"
+        content = format_ai_intro_report(json_text)
+        if is_stale:
+            content = "※最新の投稿はまだ反映されていません（再解析待ち）。\n\n" + content
+        return content
+
     if GEMINI_API_KEY:
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json"
-            )
-        )
-        
-        # 成功した場合、DBにJSONテキストとして保存 (JSONB型に対応)
-        if cid:
-            try:
-                # パースして保存
-                json_data = json.loads(response.text)
-                supabase.table("ai_reports").insert({
-                    "company_id": cid,
-                    "report_data": json_data
-                }).execute()
-            except Exception as e:
-                print(f"DB保存エラー: {e}")
-
-        return format_ai_intro_report(response.text)
+        # 同じ企業・同じ課題セット・同じプロンプト版なら保存済みの結果を再利用する
+        # 前回のレポートがあれば新着分だけで差分更新し、full_refresh の場合は全件から解析し直す
+        # 課題件数が多い場合は map-reduce で分割処理される
+        # on_chunk が渡された場合は最終出力をストリーミングで受け取り、逐次呼び出し元に渡す
+        final_model = streaming_caller(gemini_generate_stream, on_chunk) if on_chunk else None
+        json_text, _source = generate_report_json(supabase, get_report_lru(), cid, report_id, df, final_model=final_model, gateway=get_gemini_gateway(), clusterer=get_grievance_clusterer(), full_refresh=full_refresh, window_key=window_key, stats=stats)
+        return format_ai_intro_report(json_text)
     else:
         return f"【エラー】Gemini APIキーが設定されていません。"
 
@@ -507,9 +551,87 @@ if not is_super_admin:
                 "paypal_subscription_id": "DEBUG_SUB_123",
                 "status": "active"
             }).execute()
+        get_entitlements().invalidate(company_id)
         st.sidebar.success("強制有効化しました！ページをリロードします。")
         st.rerun()
 
+# ==========================================
+# 8.5 全企業のレポート一括生成 (特権管理者向け)
+# ==========================================
+@st.cache_resource
+def get_bulk_runner():
+    # 一括生成はセッションをまたいでプロセス内で1つだけ実行する
+    return BulkReportRunner()
+
+@st.cache_resource
+def get_service_client():
+    # 一括生成は report_worker.py / bulk_reports.py と同じく Service Role のクライアントで行う
+    # (特権管理者のセッションでは ai_reports の RLS で保存済みレポートの参照・保存ができず、ログアウトでも途切れるため)
+    if not SUPABASE_SERVICE_ROLE_KEY:
+        return None
+    from supabase import create_client
+    return TracedClient(create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY))
+
+def render_bulk_panel():
+    runner = get_bulk_runner()
+    with st.sidebar.expander("▶ レポート一括生成"):
+        if runner.is_running():
+            p = runner.run.progress()
+            st.progress((p["done"] + p["failed"]) / max(1, p["total"]), text=f"{p['done'] + p['failed']}/{p['total']}社 完了 (失敗 {p['failed']}社)")
+            st.button("進捗を更新", key="bulk_refresh")
+            return
+
+        if runner.run is not None:
+            p = runner.run.progress()
+            st.success(f"前回の一括生成: 成功 {p['done']}社 / 失敗 {p['failed']}社")
+            st.download_button(
+                label="📥 集計をダウンロード (CSV)",
+                data=runner.run.summary().to_csv(index=False).encode("utf-8-sig"),
+                file_name=f"bulk_reports_{runner.run.state['run_id']}.csv",
+                mime="text/csv",
+                key="bulk_summary_download"
+            )
+
+        if not GEMINI_API_KEY:
+            st.caption("Gemini APIキーが設定されていないため利用できません。")
+            return
+        service_client = get_service_client()
+        if service_client is None:
+            st.caption("SUPABASE_SERVICE_ROLE_KEY が設定されていないため利用できません。")
+            return
+
+        targets = select_companies(get_all_companies())
+        selected = st.multiselect("対象企業 (未選択なら全企業)", list(targets.values()), key="bulk_targets")
+        full_refresh = st.checkbox("全件から再解析する", key="bulk_full_refresh")
+        unfinished = BulkReportRun.latest_unfinished()
+
+        # st.cache_resource の取得はメインスレッドで済ませ、バックグラウンドのスレッドには結果だけを渡す
+        loader, lru, gateway, clusterer = get_grievance_loader(), get_report_lru(), get_gemini_gateway(), get_grievance_clusterer()
+        def processor(run):
+            # 再開時もチェックボックスではなく、その実行を開始したときのオプションに従う
+            full = run.state["options"].get("full", False)
+            def process(cid):
+                return process_company(service_client, loader, lru, cid, gemini_generate, gateway=gateway, clusterer=clusterer, full_refresh=full)
+            return process
+
+        if st.button("一括生成を開始", key="bulk_start"):
+            companies = {cid: name for cid, name in targets.items() if not selected or name in selected}
+            run = BulkReportRun.create(companies, options={"full": full_refresh})
+            runner.start(run, processor(run), workers=REPORT_CONCURRENCY, timeout=REPORT_TIMEOUT_SECONDS)
+            st.rerun()
+        if unfinished is not None:
+            mode = "全件から再解析" if unfinished.state["options"].get("full") else "差分更新"
+            if st.button(f"中断された実行を再開 (残り {len(unfinished.pending())}社・{mode})", key="bulk_resume"):
+                runner.start(unfinished, processor(unfinished), workers=REPORT_CONCURRENCY, timeout=REPORT_TIMEOUT_SECONDS)
+                st.rerun()
+
+show_trace_panel = False
+if is_super_admin:
+    st.sidebar.divider()
+    render_bulk_panel()
+    st.sidebar.divider()
+    show_trace_panel = st.sidebar.checkbox("パフォーマンス計測を表示", help="Supabase・Gemini・PDF生成などの所要時間を再実行ごとに表示します")
+
 st.sidebar.divider()
 if st.sidebar.button("ログアウト"):
     st.session_state.user = None
@@ -517,29 +639,216 @@ if st.sidebar.button("ログアウト"):
     st.session_state.access_token = None
     st.session_state.refresh_token = None
     supabase.auth.sign_out()
+    st.session_state.pop("supabase_client", None)
+    st.session_state.auth_applied_token = None
     st.rerun()
 
+# ==========================================
+# 9. パフォーマンス計測パネル (特権管理者向け)
+# ==========================================
+def render_trace_panel(trace_id):
+    with st.expander("🔍 パフォーマンス計測", expanded=True):
+        cache = get_grievance_loader().footprint()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("課題キャッシュ使用量", f"{cache['bytes'] / 1024 / 1024:.1f} MB", help=f"上限 {cache['max_bytes'] / 1024 / 1024:.0f} MB")
+        col2.metric("保持中の企業数", cache["frames"])
+        col3.metric("追い出し回数", cache["evictions"], help=f"ヒット {cache['hits']} / ミス {cache['misses']}")
+        current = pd.DataFrame(tracer.spans(trace_id))
+        if current.empty:
+            st.caption("この再実行では計測データがありません。")
+        else:
+            st.markdown("**今回の再実行**")
+            attrs = pd.json_normalize(current["attributes"].tolist())
+            st.dataframe(pd.concat([current[["name", "duration_ms", "status"]], attrs], axis=1), use_container_width=True)
+
+        recent = pd.DataFrame(tracer.spans())
+        if not recent.empty:
+            st.markdown("**直近の集計 (処理段階 × 企業)**")
+            recent["company_id"] = recent["attributes"].map(lambda a: a.get("company_id"))
+            recent["company"] = recent["company_id"].map(lambda cid: get_all_companies().get(cid, cid))
+            summary = recent.groupby(["name", "company"])["duration_ms"].agg(
+                count="count",
+                p50=lambda x: x.quantile(0.5),
+                p95=lambda x: x.quantile(0.95),
+                total="sum",
+            ).sort_values("total", ascending=False)
+            st.dataframe(summary, use_container_width=True)
+            st.download_button(
+                label="📥 計測ログをダウンロード (JSON Lines)",
+                data=tracer.export_jsonl(),
+                file_name="dashboard_traces.jsonl",
+                mime="application/x-ndjson"
+            )
+
+# 再実行1回分の計測を開始する (以降のスパンはこの trace と企業IDに紐づく)
+trace_id = begin_trace(company_id)
+rerun_started_ns = time.time_ns()
+# スクリプト先頭からここまで (設定・認証の復元・重いモジュールの読み込み) の所要時間。初回は読み込みを含む
+record_elapsed("dashboard.bootstrap", bootstrap_started_ns)
+
 st.title("■ AI解析・改善提言ダッシュボード")
-df = get_grievances(company_id)
+watch_grievance_changes(company_id)
+df = get_grievances(company_id, analysis_window)
+windowed = analysis_window["key"] != "all"
 
 if df.empty:
-    st.info("現在、従業員からの課題（現場の声）は投稿されていません。")
+    st.info(f"{analysis_window['label']}には、従業員からの課題（現場の声）は投稿されていません。" if windowed else "現在、従業員からの課題（現場の声）は投稿されていません。")
 else:
-    st.markdown(f"収集された全課題数: **{len(df)}件**")
+    # 変更通知を受信中はフレームが最新なので、集計を問い合わせずに件数を出す
+    stats = None if grievances_live() else get_grievance_stats(company_id)
+    if windowed:
+        total = f" (全期間: {stats['total_count']}件)" if stats else ""
+        st.markdown(f"解析期間: **{analysis_window['label']}** / 対象の課題数: **{len(df)}件**{total}")
+    else:
+        st.markdown(f"収集された全課題数: **{stats['total_count'] if stats else len(df)}件**")
+    # レポート・集計のキャッシュキーは全期間なら集計行 (件数・最終投稿日時) から作る
+    set_stats = None if windowed else stats
 
+    # 有料レポートはローカル集計で作成できるもののみ表示する (QUANTITATIVE_REPORTS)
+    # 経営層への要望 (management_feedback)・エンゲージメント予測 (employee_satisfaction)・
+    # 離職防止策 (retention_strategy) はLLMのプロンプトを用意するまで一覧に出さない
     reports = [
         {"id": "ai_intro", "title": "【無料】AI導入ポイント解析", "free": True},
         {"id": "human_relations_analysis", "title": "1. 人間関係・コミュニケーション分析", "free": False},
         {"id": "workload_analysis", "title": "2. 業務量・スケジュール過多分析", "free": False},
         {"id": "environment_analysis", "title": "3. 職場環境・ルール問題の抽出", "free": False},
         {"id": "equipment_analysis", "title": "4. 設備・機材によるボトルネック", "free": False},
-        {"id": "management_feedback", "title": "5. 経営・マネジメント層への直接的要望", "free": False},
-        {"id": "burnout_risk", "title": "6. バーンアウト(燃え尽き症候群)リスク判定", "free": False},
-        {"id": "productivity_bottlenecks", "title": "7. 生産性低下要因の特定", "free": False},
-        {"id": "employee_satisfaction", "title": "8. 従業員エンゲージメント予測", "free": False},
-        {"id": "retention_strategy", "title": "9. 離職防止(リテンション)戦略提案", "free": False},
+        {"id": "burnout_risk", "title": "5. バーンアウト(燃え尽き症候群)リスク判定", "free": False},
+        {"id": "productivity_bottlenecks", "title": "6. 生産性低下要因の特定", "free": False},
     ]
 
+    REPORT_PANEL_STYLE = "background-color: rgba(19, 27, 47, 0.8); padding: 24px; border-radius: 16px; border: 1px solid rgba(255,255,255,0.05); border-left: 4px solid #06b6d4; box-shadow: 0 10px 30px -10px rgba(0,0,0,0.5); color: #e2e8f0; font-size: 0.95em; line-height: 1.6;"
+
+    def render_report_charts(report_id):
+        import plotly.express as px
+        agg = get_aggregates(company_id, grievance_set_hash(df, set_stats), df)
+        by_category = agg["by_category"].reset_index()
+        by_category["label"] = by_category["category"].map(category_label)
+        trend = agg["trend"].reset_index(names="period")
+
+        figures = []
+        if report_id == "workload_analysis":
+            figures.append(px.line(trend, x="period", y="count", markers=True, title="投稿件数の推移 (週次)", labels={"period": "週", "count": "件数"}))
+            figures.append(px.bar(by_category, x="label", y="count", title="カテゴリ別の投稿件数", labels={"label": "カテゴリ", "count": "件数"}))
+        elif report_id == "burnout_risk":
+            dist = agg["stress_distribution"].rename_axis("stress_level").reset_index()
+            figures.append(px.bar(dist, x="stress_level", y="count", title="ストレス度の分布", labels={"stress_level": "ストレス度", "count": "件数"}))
+            figures.append(px.line(trend, x="period", y="mean_stress", markers=True, title="平均ストレス度の推移 (週次)", labels={"period": "週", "mean_stress": "平均ストレス度"}))
+        elif report_id == "productivity_bottlenecks":
+            figures.append(px.bar(by_category, x="label", y="impact", title="カテゴリ別の影響度 (件数 × 平均ストレス度)", labels={"label": "カテゴリ", "impact": "影響度"}))
+        elif report_id in CATEGORY_REPORTS and CATEGORY_REPORTS[report_id] in agg["category_trend"].columns:
+            category = CATEGORY_REPORTS[report_id]
+            category_trend = agg["category_trend"][category].rename("count").reset_index(names="period")
+            figures.append(px.line(category_trend, x="period", y="count", markers=True, title=f"{category_label(category)}の投稿件数の推移 (週次)", labels={"period": "週", "count": "件数"}))
+            dist = agg["category_distribution"].loc[category].rename("count").rename_axis("stress_level").reset_index()
+            figures.append(px.bar(dist, x="stress_level", y="count", title=f"{category_label(category)}のストレス度の分布", labels={"stress_level": "ストレス度", "count": "件数"}))
+
+        for i, fig in enumerate(figures):
+            fig.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)")
+            st.plotly_chart(fig, use_container_width=True, key=f"chart_{report_id}_{i}")
+
+    def render_report_content(report_id, title, content):
+        st.markdown(f"<div style='{REPORT_PANEL_STYLE}'>{content}</div>", unsafe_allow_html=True)
+        if report_id in QUANTITATIVE_REPORTS:
+            render_report_charts(report_id)
+
+        # PDFエクスポートボタン (wkhtmltopdfは重いので、要求されたときだけ生成する)
+        if content and not content.startswith("【エラー】"):
+            requested_key = f"pdf_requested_{company_id}_{report_id}"
+            if not st.session_state.get(requested_key):
+                if st.button("📄 PDFを作成", key=f"pdf_button_{report_id}"):
+                    st.session_state[requested_key] = True
+                    st.rerun()
+                return
+
+            with st.spinner("PDFを作成中..."):
+                pdf_data = create_pdf_from_md(content, title)
+            if pdf_data:
+                st.download_button(
+                    label="📥 この解析レポートをPDFでダウンロード",
+                    data=pdf_data,
+                    file_name=f"{report_id}_report.pdf",
+                    mime="application/pdf",
+                    help="役員会議や稟議書の添付資料としてお使いいただけます",
+                    key=f"pdf_download_{report_id}"
+                )
+            else:
+                st.caption("※ローカル環境でPDFを出力するにはwkhtmltopdfのインストールが必要です（本番環境では利用可能です）")
+
+    def render_combined_pdf_panel(sections):
+        # 表示中の全レポートを目次付きの1つのPDFにまとめる (wkhtmltopdf の起動は1回)
+        # 生成はPDF用のスレッドで行い、画面はスピナーで止めずに完了を待つ
+        title = f"AI解析レポート一式 ({analysis_window['label']})" if windowed else "AI解析レポート一式"
+        state_key = f"combined_pdf_{company_id}_{analysis_window['key']}"
+        st.markdown("### 📚 全レポートをまとめてダウンロード")
+        if st.button("📚 全レポートをまとめたPDFを作成", key="combined_pdf_button", help=f"表示中の{len(sections)}件のレポートを目次付きの1つのPDFにまとめます"):
+            st.session_state[state_key], _future = get_pdf_renderer().submit_combined(sections, title)
+        key = st.session_state.get(state_key)
+        if not key:
+            return
+        if key != combined_pdf_key(sections, title):
+            st.caption("※作成後にレポートの内容が更新されています。最新の内容にするには作成し直してください。")
+        running = get_pdf_renderer().status(key) == "running"
+
+        # 作成中の間だけ、この部分だけを2秒おきに再実行して完了を確認する (ダッシュボード全体は再実行しない)
+        # run_every は全体の再実行で定義したときの値のままなので、完了したら全体を1回再実行して定期実行を止める
+        @st.fragment(run_every=2 if running else None)
+        def combined_pdf_status():
+            status = get_pdf_renderer().status(key)
+            if running and status != "running":
+                st.rerun(scope="app")
+            if status == "running":
+                st.caption("⏳ PDFを作成中です。完了するとここにダウンロードボタンが表示されます (他の操作はそのまま続けられます)")
+            elif status == "done":
+                st.download_button(
+                    label="📥 全レポートをまとめたPDFをダウンロード",
+                    data=get_pdf_renderer().get(key),
+                    file_name="ai_reports.pdf",
+                    mime="application/pdf",
+                    help="役員会議の資料一式としてお使いいただけます",
+                    key="combined_pdf_download"
+                )
+            else:
+                st.caption("※PDFを作成できませんでした。ローカル環境でPDFを出力するにはwkhtmltopdfのインストールが必要です（本番環境では利用可能です）")
+
+        combined_pdf_status()
+
+    def render_full_refresh_button(report_id):
+        # 通常は前回の結果に新着分を反映する差分更新なので、全件から解析し直したいときに使う
+        if report_id == "ai_intro" and REPORT_MODE != "precomputed" and GEMINI_API_KEY:
+            if st.button("🔄 全件から再解析", key=f"full_refresh_button_{report_id}", help="過去の全ての投稿を使ってレポートを作り直します"):
+                st.session_state[f"full_refresh_{company_id}_{report_id}"] = True
+                st.rerun()
+
+    # ストリーミング中のレポート: {report_id: (チャンクのキュー, パーサー)}
+    streams = {}
+
+    def build_report_job(report_id, title):
+        # ai_intro はモデル出力をストリーミングで受け取り、完成したセクションから表示する
+        if report_id == "ai_intro" and REPORT_MODE != "precomputed":
+            chunks = queue.Queue()
+            streams[report_id] = (chunks, AiIntroStreamParser())
+            full_refresh = st.session_state.pop(f"full_refresh_{company_id}_{report_id}", False)
+            def job():
+                return generate_report(report_id, title, df, company_id, on_chunk=chunks.put, full_refresh=full_refresh, window_key=analysis_window["report_key"], stats=set_stats)
+            return job
+        def job():
+            return generate_report(report_id, title, df, company_id, window_key=analysis_window["report_key"], stats=set_stats)
+        return job
+
+    def render_stream_progress():
+        # ワーカースレッドから届いたチャンクをメインスレッドで解析し、確定したセクションを描画する
+        for report_id, (chunks, parser) in streams.items():
+            events = []
+            while not chunks.empty():
+                events.extend(parser.feed(chunks.get_nowait()))
+            if events and report_id in pending_slots:
+                partial = format_ai_intro_markdown(parser.data, partial=True)
+                slots[report_id].markdown(f"<div style='{REPORT_PANEL_STYLE}'>{partial}</div>", unsafe_allow_html=True)
+
+    # まず全レポートの枠を表示順に確保し、解析は並列で走らせて完了したものから埋めていく
+    slots = {}
+    jobs = {}
     for rep in reports:
         report_id = rep["id"]
         title = rep["title"]
@@ -548,24 +857,39 @@ else:
         if rep["free"] or is_subscribed or report_id in purchased_reports:
             prefix = "○" if rep["free"] else "●"
             st.markdown(f"### {prefix} {title}")
-            with st.spinner("AIがデータを解析中..."):
-                content = generate_report(report_id, title, df, company_id)
-                st.markdown(f"<div style='background-color: rgba(19, 27, 47, 0.8); padding: 24px; border-radius: 16px; border: 1px solid rgba(255,255,255,0.05); border-left: 4px solid #06b6d4; box-shadow: 0 10px 30px -10px rgba(0,0,0,0.5); color: #e2e8f0; font-size: 0.95em; line-height: 1.6;'>{content}</div>", unsafe_allow_html=True)
-                
-                # PDFエクスポートボタン
-                if content and not content.startswith("【エラー】"):
-                    pdf_data = create_pdf_from_md(content, title)
-                    if pdf_data:
-                        st.download_button(
-                            label="📥 この解析レポートをPDFでダウンロード",
-                            data=pdf_data,
-                            file_name=f"{report_id}_report.pdf",
-                            mime="application/pdf",
-                            help="役員会議や稟議書の添付資料としてお使いいただけます"
-                        )
-                    else:
-                        st.caption("※ローカル環境でPDFを出力するにはwkhtmltopdfのインストールが必要です（本番環境では利用可能です）")
-
+            slots[report_id] = st.empty()
+            slots[report_id].info("AIがデータを解析中...")
+            jobs[report_id] = build_report_job(report_id, title)
             st.divider()
         else:
             render_locked_report(report_id, title, company_id, manager_id)
+
+    # ワーカースレッドからもst.cache_resource等を使えるようにスクリプト実行コンテキストを引き継ぐ
+    script_ctx = get_script_run_ctx()
+    titles = {rep["id"]: rep["title"] for rep in reports}
+    pending_slots = set(jobs)
+    contents = {}
+    for report_id, result, error in run_concurrently(
+        jobs,
+        max_workers=REPORT_CONCURRENCY,
+        timeout=REPORT_TIMEOUT_SECONDS,
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), script_ctx),
+        on_tick=render_stream_progress if streams else None
+    ):
+        pending_slots.discard(report_id)
+        with slots[report_id].container():
+            if error is not None:
+                st.error(f"【エラー】レポートの生成に失敗しました: {error}")
+            else:
+                render_report_content(report_id, titles[report_id], result)
+                render_full_refresh_button(report_id)
+                if result and not result.startswith("【エラー】"):
+                    contents[report_id] = result
+
+    # 2件以上表示できたときは、表示順にまとめたPDFを作れるようにする
+    if len(contents) >= 2:
+        render_combined_pdf_panel([(rep["title"], contents[rep["id"]]) for rep in reports if rep["id"] in contents])
+
+record_elapsed("dashboard.rerun", rerun_started_ns, grievances=len(df), window=analysis_window["key"], grievance_cache_bytes=get_grievance_loader().footprint()["bytes"])
+if show_trace_panel:
+    render_trace_panel(trace_id)
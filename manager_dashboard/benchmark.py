@@ -0,0 +1,253 @@
+import argparse
+import json
+import random
+import shutil
+import statistics
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from aggregates import CATEGORY_LABELS, QUANTITATIVE_REPORTS, compute_aggregates, format_quantitative_report
+from fake_gemini import FakeGemini
+from gemini_gateway import GeminiGateway
+from grievance_clusters import GrievanceClusterer
+from grievance_loader import IncrementalGrievanceLoader
+from local_supabase import LocalSupabase
+from report_cache import ReportLRU, grievance_set_hash
+from report_engine import format_ai_intro_report, generate_report_json
+
+# ==========================================
+# マネージャーダッシュボードのベンチマーク・負荷試験
+# ==========================================
+# app.py の1回の再実行 (rerun) で行われる処理を、Streamlit を使わずに同じ関数群で再現して計測する。
+#   課題の取得 (get_grievances) -> 集計 -> ai_intro 生成 (キャッシュ経由) -> 整形 -> (任意) PDF生成
+# Supabase はメモリ上の代替 (local_supabase.py)、Gemini は遅延を指定できる代替 (fake_gemini.py) を使う。
+# 代替サーバー自体の処理時間は db_ms として別に表示する (本番の PostgREST より遅いため)。
+#
+# 使い方:
+#   python benchmark.py                                   # 1k/10k/100k件で計測
+#   python benchmark.py --sizes 10000 --sessions 8 --latency 2
+#   python benchmark.py --json bench.json --max-p95-ms 500  # p95が閾値を超えたら終了コード1
+#   python benchmark.py --emit-sql seed_10k.sql --sizes 10000  # ローカルPostgres投入用のSQLを書き出す
+
+DETAIL_TEMPLATES = [
+    "残業代が固定残業を超えても支払われないのが不満です。業務量は増えるばかりなのに手取りが変わりません。",
+    "部署間の連携が悪く、いつも仕事の押し付け合いが発生しています。特に営業と開発の仲が最悪です。",
+    "会議ばかりで実働時間が確保できません。定時後に自分の作業を始めるのがデフォになっています。",
+    "社長の思いつきでコロコロ方針が変わるので、現場は振り回されています。事前の相談が欲しいです。",
+    "オフィスの空調が古くて夏は暑く、冬は寒いです。パソコンも5年前のスペックでフリーズが多いです。",
+    "入社後の研修がほぼなく、いきなり現場に放り込まれます。メンター制度も名前だけで機能していません。",
+    "属人化している業務が多すぎます。あの人が休むと仕事が回らない仕組みは早く改善すべきです。",
+    "上司のパワハラ・モラハラ気味な発言（「昔は徹夜が普通だった」等）にストレスを感じます。",
+    "紙の申請書に手書きして押印をもらうまで、経費精算に毎回一週間かかっています。",
+    "同じ内容をExcelと基幹システムに二重入力しており、転記ミスが頻発しています。",
+]
+
+
+def generate_grievances(cid, n, seed=0, days=365):
+    # insert_dummy_data.sql と同じ形の課題データを n 件生成する
+    rng = random.Random(seed)
+    users = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(max(1, int(n ** 0.5)))]
+    categories = list(CATEGORY_LABELS)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    step = timedelta(days=days) / max(1, n)
+    rows = []
+    for i in range(n):
+        rows.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "company_id": cid,
+            "user_id": rng.choice(users),
+            "category": rng.choice(categories),
+            "details": f"{rng.choice(DETAIL_TEMPLATES)} (#{i})",
+            "stress_level": rng.randint(1, 10),
+            "created_at": (start + step * i).isoformat(),
+        })
+    return rows
+
+
+def emit_sql(path, cid, rows):
+    # ローカルの Postgres (supabase start) に投入するためのSQL
+    # insert_dummy_data.sql と同様に、profiles の外部キーを満たすため auth.users にもダミーを作る (テスト用のみ)
+    user_ids = sorted({r["user_id"] for r in rows})
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("-- benchmark.py により生成\n")
+        f.write(f"INSERT INTO public.companies (id, name) VALUES ('{cid}', 'ベンチマーク用株式会社') ON CONFLICT DO NOTHING;\n")
+        for uid in user_ids:
+            f.write(
+                "INSERT INTO auth.users (id, instance_id, aud, role, email, encrypted_password, email_confirmed_at, created_at, updated_at) "
+                f"VALUES ('{uid}', '00000000-0000-0000-0000-000000000000', 'authenticated', 'authenticated', 'bench_{uid[:8]}@test.ui', '', now(), now(), now()) ON CONFLICT DO NOTHING;\n"
+            )
+            f.write(f"INSERT INTO public.profiles (id, company_id, role) VALUES ('{uid}', '{cid}', 'employee') ON CONFLICT DO NOTHING;\n")
+        for i in range(0, len(rows), 1000):
+            f.write("INSERT INTO public.grievances (id, company_id, user_id, category, details, stress_level, created_at) VALUES\n")
+            values = [
+                "('{id}', '{company_id}', '{user_id}', '{category}', '{details}', {stress_level}, '{created_at}')".format(
+                    **{**r, "details": r["details"].replace("'", "''")}
+                )
+                for r in rows[i:i + 1000]
+            ]
+            f.write(",\n".join(values) + ";\n")
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class RerunSimulator:
+    # app.py の1回の再実行に相当する処理 (Streamlitの描画以外)
+    def __init__(self, client, model, refresh_interval=0, pdf_renderer=None):
+        self.client = client
+        self.model = model
+        self.loader = IncrementalGrievanceLoader(refresh_interval=refresh_interval)
+        self.lru = ReportLRU(maxsize=256)
+        self.pdf_renderer = pdf_renderer
+        # 流量制限なしで、同時生成の集約だけを効かせる
+        self.gateway = GeminiGateway(rate_per_minute=0)
+        self.clusterer = GrievanceClusterer()
+        self._aggregates = {}
+        self._lock = threading.Lock()
+
+    def rerun(self, cid):
+        df = self.loader.load(self.client, cid)
+        set_hash = grievance_set_hash(df)
+        with self._lock:
+            agg = self._aggregates.get((cid, set_hash))
+        if agg is None:
+            agg = compute_aggregates(df)
+            with self._lock:
+                self._aggregates[(cid, set_hash)] = agg
+
+        json_text, _source = generate_report_json(self.client, self.lru, cid, "ai_intro", df, call_model=self.model, gateway=self.gateway, clusterer=self.clusterer)
+        contents = {"ai_intro": format_ai_intro_report(json_text)}
+        for report_id in QUANTITATIVE_REPORTS:
+            contents[report_id] = format_quantitative_report(report_id, agg)
+
+        if self.pdf_renderer is not None:
+            for report_id, content in contents.items():
+                self.pdf_renderer.render(content, report_id)
+        return len(df)
+
+
+def run_scenario(size, reruns, sessions, latency, refresh_interval, new_every, with_pdf):
+    client = LocalSupabase()
+    cid = str(uuid.uuid4())
+    client.seed("grievances", generate_grievances(cid, size))
+    model = FakeGemini(latency=latency)
+
+    pdf_renderer = None
+    if with_pdf:
+        from pdf_renderer import PdfRenderer
+        pdf_renderer = PdfRenderer(max_renderers=2)
+    sim = RerunSimulator(client, model, refresh_interval=refresh_interval, pdf_renderer=pdf_renderer)
+
+    timings = []
+    timings_lock = threading.Lock()
+    counter = {"n": 0}
+
+    def session(idx):
+        for i in range(reruns):
+            with timings_lock:
+                counter["n"] += 1
+                add_new = new_every and counter["n"] % new_every == 0
+            if add_new:
+                # 新しい投稿が届いた状況 (差分取得と再解析が走る)
+                row = generate_grievances(cid, 1, seed=counter["n"] + size)[0]
+                row["created_at"] = datetime.now(timezone.utc).isoformat()
+                client.seed("grievances", [row])
+            t0 = time.perf_counter()
+            sim.rerun(cid)
+            with timings_lock:
+                timings.append((time.perf_counter() - t0) * 1000)
+
+    # 1回目はコールドスタートとして別に計測する
+    t0 = time.perf_counter()
+    sim.rerun(cid)
+    cold_ms = (time.perf_counter() - t0) * 1000
+    cold_db_ms = client.server_seconds * 1000
+    cold_bytes = client.bytes_fetched
+    cold_calls = model.calls
+    client.reset_counters()
+    calls_before = model.calls
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    total = len(timings)
+    return {
+        "grievances": size,
+        "sessions": sessions,
+        "reruns": total,
+        "cold_ms": round(cold_ms, 1),
+        "cold_db_ms": round(cold_db_ms, 1),
+        "cold_bytes": cold_bytes,
+        "cold_model_calls": cold_calls,
+        "p50_ms": round(percentile(timings, 0.5), 2),
+        "p95_ms": round(percentile(timings, 0.95), 2),
+        "max_ms": round(max(timings), 2) if timings else 0.0,
+        "mean_ms": round(statistics.fmean(timings), 2) if timings else 0.0,
+        "db_ms_per_rerun": round(client.server_seconds * 1000 / total, 2) if total else 0,
+        "bytes_per_rerun": round(client.bytes_fetched / total, 1) if total else 0,
+        "requests_per_rerun": round(client.requests / total, 2) if total else 0,
+        "model_calls_per_rerun": round((model.calls - calls_before) / total, 3) if total else 0,
+        "prompt_chars_total": model.prompt_chars,
+        "coalesced_total": sim.gateway.stats["coalesced"],
+        "frame_cache_bytes": sim.loader.footprint()["bytes"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="マネージャーダッシュボードのベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="1企業あたりの課題件数")
+    parser.add_argument("--reruns", type=int, default=20, help="1セッションあたりの再実行回数")
+    parser.add_argument("--sessions", type=int, default=4, help="同時に開いているマネージャーのセッション数")
+    parser.add_argument("--latency", type=float, default=0.0, help="ダミーGeminiの応答遅延(秒)")
+    parser.add_argument("--refresh-interval", type=float, default=0, help="課題の差分取得間隔(秒)。0で毎回取得")
+    parser.add_argument("--new-every", type=int, default=10, help="何回の再実行ごとに新しい投稿を1件追加するか (0で追加なし)")
+    parser.add_argument("--pdf", action="store_true", help="PDF生成も計測する (wkhtmltopdf が必要)")
+    parser.add_argument("--json", help="結果をJSONで書き出すパス")
+    parser.add_argument("--max-p95-ms", type=float, help="p95がこの値を超えたら終了コード1で終了する")
+    parser.add_argument("--emit-sql", help="課題データを生成してSQLファイルに書き出して終了する")
+    args = parser.parse_args()
+
+    if args.emit_sql:
+        cid = str(uuid.uuid4())
+        emit_sql(args.emit_sql, cid, generate_grievances(cid, args.sizes[0]))
+        print(f"{args.emit_sql} に {args.sizes[0]}件の課題を書き出しました (company_id={cid})")
+        return
+
+    if args.pdf and not shutil.which("wkhtmltopdf"):
+        print("wkhtmltopdf が見つからないため PDF の計測をスキップします")
+        args.pdf = False
+
+    results = []
+    header = f"{'件数':>8} {'cold(ms)':>10} {'p50(ms)':>9} {'p95(ms)':>9} {'db(ms)/rerun':>13} {'bytes/rerun':>12} {'req/rerun':>10} {'model/rerun':>12}"
+    print(header)
+    for size in args.sizes:
+        r = run_scenario(size, args.reruns, args.sessions, args.latency, args.refresh_interval, args.new_every, args.pdf)
+        results.append(r)
+        print(f"{r['grievances']:>8} {r['cold_ms']:>10} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['db_ms_per_rerun']:>13} {r['bytes_per_rerun']:>12} {r['requests_per_rerun']:>10} {r['model_calls_per_rerun']:>12}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.max_p95_ms is not None:
+        slow = [r for r in results if r["p95_ms"] > args.max_p95_ms]
+        if slow:
+            print(f"p95 が {args.max_p95_ms}ms を超えました: {[r['grievances'] for r in slow]}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
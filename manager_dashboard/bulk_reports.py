@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from fake_gemini import FakeGemini
+from gemini_gateway import GeminiGateway
+from grievance_clusters import GrievanceClusterer
+from grievance_frames import DEFAULT_CACHE_BYTES
+from grievance_loader import IncrementalGrievanceLoader
+from grievance_snapshots import GrievanceSnapshotStore
+from report_cache import ReportLRU
+from report_engine import gemini_generate
+from report_runner import run_concurrently
+from report_worker import create_worker_client, process_company
+
+# ==========================================
+# 全企業 (または指定企業) のレポート一括生成
+# ==========================================
+# 特権管理者が企業を1社ずつ選んで生成する代わりに、上限付きのワーカープールでまとめて生成する。
+# - 進捗は状態ファイル (JSON) に1社完了するごとに保存し、中断しても --resume で未完了・失敗分だけ再開できる
+# - 完了後は企業ごとの結果 (件数・取得元・所要時間・エラー) をCSVの集計にまとめる
+# ダッシュボードの特権管理者メニューからも同じ処理をバックグラウンドで実行できる。
+#
+# 使い方:
+#   python bulk_reports.py                                   # 全企業
+#   python bulk_reports.py --match 株式会社A --match B社      # 企業名に指定文字列を含む企業のみ
+#   python bulk_reports.py --resume                           # 最新の中断した実行を再開 (--resume <状態ファイル> で指定も可)
+#   python bulk_reports.py --workers 8 --summary summary.csv --fake-gemini
+
+# 状態ファイルには企業名が含まれるため、既定ではリポジトリの外 (ユーザーの状態ディレクトリ) に保存する
+DEFAULT_STATE_DIR = os.environ.get("BULK_STATE_DIR") or os.path.join(
+    os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"), "guchi_ai", "bulk_runs"
+)
+SYSTEM_COMPANY_NAME = "【システム管理用マスターアカウント】"
+SUMMARY_COLUMNS = ["company_id", "company_name", "status", "grievances", "sources", "elapsed_ms", "error", "finished_at"]
+
+
+def select_companies(companies, matches=None):
+    # companies: {id: 企業名}。システム管理用の企業は除外し、matches があれば企業名の部分一致で絞り込む
+    selected = {}
+    for cid, name in companies.items():
+        if name == SYSTEM_COMPANY_NAME:
+            continue
+        if matches and not any(m in name for m in matches):
+            continue
+        selected[cid] = name
+    return selected
+
+
+class BulkReportRun:
+    # 一括生成1回分の状態。record() のたびに状態ファイルへ書き出す
+    def __init__(self, state):
+        self.state = state
+        self.path = state["path"]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, companies, state_dir=DEFAULT_STATE_DIR, options=None):
+        run_id = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        run = cls({
+            "run_id": run_id,
+            "path": os.path.join(state_dir, f"{run_id}.json"),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "finished_at": None,
+            "options": options or {},
+            "companies": companies,
+            "results": {},
+        })
+        run.save()
+        return run
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        state["path"] = path
+        return cls(state)
+
+    @classmethod
+    def latest_unfinished(cls, state_dir=DEFAULT_STATE_DIR):
+        # 中断された (finished_at が無い) 最新の実行
+        if not os.path.isdir(state_dir):
+            return None
+        for name in sorted(os.listdir(state_dir), reverse=True):
+            if name.endswith(".json"):
+                run = cls.load(os.path.join(state_dir, name))
+                if run.state["finished_at"] is None:
+                    return run
+        return None
+
+    def save(self):
+        # 書き込み途中で中断されても壊れないよう、一時ファイルに書いてから置き換える
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def pending(self):
+        # 未処理 + 前回失敗した企業
+        with self._lock:
+            results = self.state["results"]
+            return [cid for cid in self.state["companies"] if results.get(cid, {}).get("status") != "done"]
+
+    def record(self, cid, status, elapsed_ms, result=None, error=None):
+        with self._lock:
+            self.state["results"][cid] = {
+                "status": status,
+                "grievances": (result or {}).get("grievances"),
+                "sources": (result or {}).get("sources"),
+                "elapsed_ms": round(elapsed_ms, 1),
+                "error": str(error) if error else None,
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self.save()
+
+    def finish(self):
+        with self._lock:
+            self.state["finished_at"] = datetime.now(timezone.utc).isoformat()
+            self.save()
+
+    def progress(self):
+        with self._lock:
+            results = self.state["results"].values()
+            return {
+                "total": len(self.state["companies"]),
+                "done": sum(1 for r in results if r["status"] == "done"),
+                "failed": sum(1 for r in results if r["status"] == "failed"),
+                "finished": self.state["finished_at"] is not None,
+            }
+
+    def summary(self):
+        with self._lock:
+            rows = [
+                {"company_id": cid, "company_name": name, **self.state["results"].get(cid, {"status": "pending"})}
+                for cid, name in self.state["companies"].items()
+            ]
+        return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+    def write_summary(self, path=None):
+        path = path or self.path.replace(".json", "_summary.csv")
+        self.summary().to_csv(path, index=False, encoding="utf-8-sig")
+        return path
+
+
+def run_bulk(run, process, workers=4, timeout=600, on_progress=None):
+    # process(cid) -> {"grievances": 件数, "sources": 取得元} を企業ごとに並列実行し、完了するたびに状態を保存する
+    started = {}
+
+    def job(cid):
+        def run_one():
+            started[cid] = time.perf_counter()
+            return process(cid)
+        return run_one
+
+    jobs = {cid: job(cid) for cid in run.pending()}
+    for cid, result, error in run_concurrently(jobs, max_workers=workers, timeout=timeout):
+        elapsed_ms = (time.perf_counter() - started.get(cid, time.perf_counter())) * 1000
+        run.record(cid, "failed" if error else "done", elapsed_ms, result, error)
+        if on_progress is not None:
+            on_progress(run)
+    run.finish()
+    return run
+
+
+class BulkReportRunner:
+    # ダッシュボードから一括生成をバックグラウンドで動かすための入れ物 (プロセス内で1実行のみ)
+    def __init__(self):
+        self.run = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, run, process, workers=4, timeout=600):
+        with self._lock:
+            if self.is_running():
+                return False
+            self.run = run
+            self._thread = threading.Thread(
+                target=run_bulk, args=(run, process), kwargs={"workers": workers, "timeout": timeout},
+                name="bulk-reports", daemon=True
+            )
+            self._thread.start()
+            return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全企業のAIレポート一括生成")
+    parser.add_argument("--match", action="append", default=[], help="企業名に含まれる文字列で絞り込む (複数指定可)")
+    parser.add_argument("--resume", nargs="?", const="latest", help="中断した実行を再開する (状態ファイルのパス。省略時は最新の未完了分)")
+    parser.add_argument("--workers", type=int, default=4, help="同時に処理する企業数")
+    parser.add_argument("--timeout", type=float, default=600, help="1企業あたりのタイムアウト(秒)")
+    parser.add_argument("--state-dir", default=DEFAULT_STATE_DIR, help="状態ファイルの保存先")
+    parser.add_argument("--summary", help="集計CSVの出力先 (省略時は状態ファイルと同じ場所)")
+    parser.add_argument("--full", action="store_true", help="差分更新ではなく全件から解析し直す")
+    parser.add_argument("--fake-gemini", action="store_true", help="Geminiの代わりにローカルのダミー応答を使う")
+    parser.add_argument("--rate-per-minute", type=float, default=60, help="Gemini呼び出しの上限(回/分)。0で制限なし")
+    args = parser.parse_args()
+
+    client = create_worker_client()
+    if args.fake_gemini:
+        call_model = FakeGemini()
+    else:
+        api_key = os.environ.get("GEMINI_API_KEY", "")
+        if not api_key:
+            raise SystemExit("GEMINI_API_KEY を設定するか --fake-gemini を指定してください")
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        call_model = gemini_generate
+
+    if args.resume:
+        run = BulkReportRun.latest_unfinished(args.state_dir) if args.resume == "latest" else BulkReportRun.load(args.resume)
+        if run is None:
+            raise SystemExit("再開できる実行がありません")
+        print(f"[bulk] {run.state['run_id']} を再開します (残り {len(run.pending())}社)")
+    else:
+        res = client.table("companies").select("id, name").order("created_at").execute()
+        companies = select_companies({row["id"]: row["name"] for row in res.data}, args.match)
+        run = BulkReportRun.create(companies, args.state_dir, {"full": args.full, "match": args.match})
+        print(f"[bulk] {run.state['run_id']}: {len(companies)}社を処理します (状態ファイル: {run.path})")
+
+    # 全企業を順に読むため、処理済みの企業のフレームはメモリ上限に応じて捨てる
+    loader = IncrementalGrievanceLoader(refresh_interval=0, snapshot_store=GrievanceSnapshotStore(), max_bytes=DEFAULT_CACHE_BYTES)
+    lru = ReportLRU(maxsize=64)
+    gateway = GeminiGateway(rate_per_minute=args.rate_per_minute)
+    clusterer = GrievanceClusterer()
+    # 再開時は途中で差分更新と全件の解析が入れ替わらないよう、開始時のオプションに従う
+    full_refresh = run.state["options"].get("full", False)
+    if args.resume and args.full and not full_refresh:
+        print("[bulk] 再開する実行は差分更新で開始されているため、--full は無視します")
+
+    def process(cid):
+        return process_company(client, loader, lru, cid, call_model, gateway=gateway, clusterer=clusterer, full_refresh=full_refresh)
+
+    def on_progress(run):
+        p = run.progress()
+        print(f"[bulk] {p['done'] + p['failed']}/{p['total']} 完了 (失敗 {p['failed']})")
+
+    run_bulk(run, process, workers=args.workers, timeout=args.timeout, on_progress=on_progress)
+    summary_path = run.write_summary(args.summary)
+    p = run.progress()
+    print(f"[bulk] 完了: 成功 {p['done']}社 / 失敗 {p['failed']}社。集計: {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import threading
+import time
+
+# ==========================================
+# 閲覧権限 (サブスク状態・単発購入) の一括取得
+# ==========================================
+# companies に subscriptions / report_purchases を埋め込んで1回のクエリで取得し、
+# 企業名・サブスク有無・購入済みレポートをまとめて短時間キャッシュする。
+# 購入やデバッグ用の強制有効化の直後は invalidate() で明示的に破棄すること。
+
+ENTITLEMENT_SELECT = "id, name, subscriptions(status), report_purchases(report_type)"
+
+
+def parse_entitlement(row):
+    return {
+        "name": row["name"],
+        "is_subscribed": any(s.get("status") == "active" for s in row.get("subscriptions") or []),
+        "purchased_reports": sorted({p["report_type"] for p in row.get("report_purchases") or []}),
+    }
+
+
+class EntitlementService:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entries = {}
+        self._all_loaded_at = None
+        self._order = []
+        self._ids_by_name = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, client, cids=None):
+        query = client.table("companies").select(ENTITLEMENT_SELECT)
+        if cids is not None:
+            query = query.in_("id", list(cids))
+        res = query.order("created_at").execute()
+        now = time.monotonic()
+        with self._lock:
+            for row in res.data:
+                self._entries[row["id"]] = (now, parse_entitlement(row))
+            if cids is None:
+                self._order = [row["id"] for row in res.data]
+                self._ids_by_name = {row["name"]: row["id"] for row in res.data}
+                self._all_loaded_at = now
+        return res.data
+
+    def _fresh(self, cid):
+        entry = self._entries.get(cid)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def get_many(self, client, cids):
+        # 期限切れ・未取得の企業だけをまとめて1回で取得する
+        missing = [cid for cid in cids if self._fresh(cid) is None]
+        if missing:
+            self._fetch(client, missing)
+        return {cid: self._fresh(cid) or self._entries[cid][1] for cid in cids if cid in self._entries}
+
+    def get(self, client, cid):
+        result = self.get_many(client, [cid])
+        if cid in result:
+            return result[cid]
+        return {"name": "", "is_subscribed": False, "purchased_reports": []}
+
+    def all_companies(self, client):
+        # 閲覧可能な全企業 {id: 企業名} (作成日順)
+        if self._all_loaded_at is None or time.monotonic() - self._all_loaded_at >= self.ttl:
+            self._fetch(client)
+        with self._lock:
+            return {cid: self._entries[cid][1]["name"] for cid in self._order if cid in self._entries}
+
+    def company_id_by_name(self, name):
+        return self._ids_by_name.get(name)
+
+    def invalidate(self, cid=None):
+        with self._lock:
+            if cid is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(cid, None)
+            self._all_loaded_at = None
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import threading
+import time
+
+from report_engine import MAP_PROMPT_INSTRUCTIONS
+
+# ==========================================
+# ローカル検証用の Gemini 代替
+# ==========================================
+# report_engine の call_model と同じ「プロンプト文字列 -> JSONテキスト」の関数として振る舞う。
+# ネットワークを使わず、同じプロンプトには常に同じ応答を返す。応答までの遅延も指定できる。
+
+
+class FakeGemini:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt):
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        # map段階のプロンプトだけに部分要約のスキーマで応答する
+        # (reduce のプロンプトも部分要約を埋め込むため "grievance_count" を含む)
+        if MAP_PROMPT_INSTRUCTIONS in prompt:
+            return json.dumps(self._partial(seed), ensure_ascii=False)
+        return json.dumps(self._ai_intro(seed), ensure_ascii=False)
+
+    def _partial(self, seed):
+        return {
+            "grievance_count": seed % 50 + 1,
+            "key_pains": [
+                {
+                    "category": "業務内容・量",
+                    "summary": "ダミーの部分要約です。",
+                    "representative_quotes": ["会議ばかりで実働時間が確保できません。"],
+                    "occurrences": seed % 20 + 1,
+                    "severity": seed % 10 + 1
+                }
+            ],
+            "pain_signals": {
+                "manual_work": seed % 5 + 1,
+                "communication": (seed >> 3) % 5 + 1,
+                "knowledge_silo": (seed >> 6) % 5 + 1,
+                "workflow": (seed >> 9) % 5 + 1
+            }
+        }
+
+    def _ai_intro(self, seed):
+        return {
+            "executive_summary": "【ローカル検証用ダミー】組織の課題に関するエグゼクティブサマリーです。",
+            "readiness_score": seed % 101,
+            "chart_data": {
+                "manual_work": seed % 5 + 1,
+                "communication": (seed >> 3) % 5 + 1,
+                "knowledge_silo": (seed >> 6) % 5 + 1,
+                "workflow": (seed >> 9) % 5 + 1
+            },
+            "ai_solutions": [
+                {
+                    "title": f"ダミー提案 {i + 1}",
+                    "current_pain_and_cause": "ダミーの現状分析です。",
+                    "tech_architecture": "ダミーの技術構成です。",
+                    "quantitative_roi": "ダミーのROI試算です。"
+                }
+                for i in range(3)
+            ],
+            "earned_g_points": 100 + seed % 9901
+        }
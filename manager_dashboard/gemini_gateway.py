@@ -0,0 +1,164 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from tracing import span
+
+# ==========================================
+# Gemini 呼び出しの集約・流量制御 (プロセス全体で共有)
+# ==========================================
+# 同じ企業のマネージャーが同時に画面を開くと、各セッションが同じデータで同じレポートを生成しようとする。
+# - 同じキー (企業・レポート・課題セットの指紋) の生成は1回だけ実行し、後から来た呼び出しはその結果を待つ
+# - モデル呼び出しはトークンバケットで流量を制限し、待ち行列の長さにも上限を設ける
+# - クォータ超過・一時的な障害はバックオフ(ジッター付き)で再試行し、使い切ったら GeminiUnavailableError にする
+
+
+class GeminiUnavailableError(Exception):
+    pass
+
+
+def is_retryable(error):
+    # 再試行してよい (一時的な) エラーか。google.api_core は読み込みが重いので、エラーが起きたときだけ読み込む
+    from google.api_core import exceptions as google_exceptions
+    return isinstance(error, (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+    ))
+
+
+class TokenBucket:
+    # rate_per_minute 件/分 のペースでトークンを補充し、最大 capacity 件までのバーストを許す
+    def __init__(self, rate_per_minute, capacity):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        # トークンを1つ取得できたら True、timeout 秒以内に取得できなければ False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_for = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - now
+                if remaining <= 0:
+                    return False
+                wait_for = min(wait_for, remaining)
+            time.sleep(wait_for)
+
+
+class SingleFlight:
+    # 同じキーで同時に呼ばれた処理を1回の実行にまとめる
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        # 戻り値: (結果, 他の呼び出しの結果を共有したかどうか)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def inflight(self):
+        with self._lock:
+            return len(self._inflight)
+
+
+class GeminiGateway:
+    def __init__(self, rate_per_minute=60, burst=10, max_waiting=32, acquire_timeout=60,
+                 max_attempts=4, backoff_base=1.0, backoff_max=30.0):
+        # rate_per_minute が 0 以下なら流量制限なし (ベンチマーク等)
+        self.bucket = TokenBucket(rate_per_minute, burst) if rate_per_minute > 0 else None
+        self.max_waiting = max_waiting
+        self.acquire_timeout = acquire_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.flights = SingleFlight()
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "coalesced": 0, "retries": 0, "rejected": 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def coalesce(self, key, fn):
+        result, shared = self.flights.do(key, fn)
+        if shared:
+            self._count("coalesced")
+        return result, shared
+
+    def _acquire(self):
+        if self.bucket is None:
+            return
+        with self._lock:
+            if self._waiting >= self.max_waiting:
+                self.stats["rejected"] += 1
+                raise GeminiUnavailableError("AIへのリクエストが混み合っています。しばらくしてから再度お試しください。")
+            self._waiting += 1
+        try:
+            with span("gemini.rate_limit_wait") as s:
+                acquired = self.bucket.acquire(timeout=self.acquire_timeout)
+                s.set(acquired=acquired)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            self._count("rejected")
+            raise GeminiUnavailableError(f"AIへのリクエストが混み合っているため、{self.acquire_timeout}秒以内に実行できませんでした。")
+
+    def call(self, call_model, prompt):
+        for attempt in range(1, self.max_attempts + 1):
+            self._acquire()
+            self._count("calls")
+            try:
+                return call_model(prompt)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt == self.max_attempts:
+                    raise GeminiUnavailableError(f"AIの利用上限に達したため生成できませんでした ({attempt}回試行): {e}") from e
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))) + random.uniform(0, self.backoff_base)
+                print(f"Gemini呼び出しの一時エラー ({e})。{delay:.1f}秒後に再試行します")
+                self._count("retries")
+                time.sleep(delay)
+
+    def limited(self, call_model):
+        # call_model と同じ形 (prompt -> テキスト) の関数を返す
+        def call(prompt):
+            return self.call(call_model, prompt)
+        return call
@@ -0,0 +1,199 @@
+import math
+import re
+import threading
+import unicodedata
+import zlib
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 類似した課題 (ほぼ同じ内容の投稿) のクラスタリング
+# ==========================================
+# 同じ不満が言い回しを少し変えて何度も投稿されるため、プロンプトに送る前に代表例1件 + 件数 + 平均ストレス度にまとめる。
+# ネットワークも外部ライブラリも使わず、日本語でも分かち書き不要な「文字n-gram」で比較する。
+# - MinHash + LSH (バンド分割) で候補となる既存クラスタを絞り込む
+# - 候補の代表例と TF-IDF (文字n-gram) のコサイン類似度を計算し、閾値以上なら同じクラスタに入れる
+# - 割り当て結果は企業ごとに保持し、新しい投稿だけを追加で割り当てる (既存の割り当ては変えない)
+
+NGRAM_SIZE = 2
+DEFAULT_SIMILARITY = 0.6
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_details(text):
+    # 全角/半角・大文字/小文字・記号や空白の違いは無視する
+    text = unicodedata.normalize("NFKC", str(text or "")).lower()
+    return _NON_WORD.sub("", text)
+
+
+def char_ngrams(text, n=NGRAM_SIZE):
+    if len(text) <= n:
+        return [text] if text else []
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+
+def shingle_hash(shingle):
+    # プロセスをまたいでも同じ値になるハッシュ (組み込みの hash() はプロセスごとに変わる)
+    return zlib.crc32(shingle.encode("utf-8"))
+
+
+class MinHasher:
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        # 32bitハッシュ x 29bit係数 + 61bit定数 が uint64 で桁あふれしない範囲に収める
+        self._a = rng.integers(1, 1 << 29, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingles):
+        if not shingles:
+            return np.full(self.num_perm, _MERSENNE_PRIME, dtype=np.uint64)
+        hashes = np.fromiter((shingle_hash(s) for s in set(shingles)), dtype=np.uint64)
+        values = (np.outer(hashes, self._a) + self._b) % np.uint64(_MERSENNE_PRIME)
+        return values.min(axis=0)
+
+
+def _json_value(value):
+    # 欠損値は JSON の null として渡す
+    return None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+
+
+def _cosine(u, v):
+    if len(u) > len(v):
+        u, v = v, u
+    return sum(w * v.get(k, 0.0) for k, w in u.items())
+
+
+class GrievanceClusterIndex:
+    # 1企業分のクラスタ割り当て (スレッドセーフではないので GrievanceClusterer 経由で使う)
+    def __init__(self, threshold=DEFAULT_SIMILARITY, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm は bands で割り切れる必要があります")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.assignments = {}       # 課題ID -> クラスタ番号
+        self.representatives = []   # クラスタ番号 -> (課題ID, n-gram頻度)
+        self._doc_freq = Counter()
+        self._docs = 0
+        self._buckets = defaultdict(list)  # (カテゴリ, バンド番号, バンドの値) -> クラスタ番号
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def _tfidf(self, counts):
+        # 文字n-gramの TF-IDF (サブリニアTF・L2正規化)。IDF は割り当て時点までの文書頻度で計算する
+        vector = {
+            g: (1 + math.log(c)) * (math.log((1 + self._docs) / (1 + self._doc_freq[g])) + 1)
+            for g, c in counts.items()
+        }
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {g: w / norm for g, w in vector.items()}
+
+    def _band_keys(self, category, signature):
+        return [
+            (category, b, signature[b * self.rows:(b + 1) * self.rows].tobytes())
+            for b in range(self.bands)
+        ]
+
+    def add(self, gid, details, category=None):
+        if gid in self.assignments:
+            return self.assignments[gid]
+        grams = char_ngrams(normalize_details(details))
+        counts = Counter(grams)
+        self._docs += 1
+        self._doc_freq.update(counts.keys())
+
+        keys = self._band_keys(category, self.hasher.signature(grams))
+        candidates = {c for key in keys for c in self._buckets.get(key, ())}
+        vector = self._tfidf(counts)
+        best, best_score = None, self.threshold
+        for c in candidates:
+            score = _cosine(vector, self._tfidf(self.representatives[c][1]))
+            if score >= best_score:
+                best, best_score = c, score
+
+        if best is None:
+            best = len(self.representatives)
+            self.representatives.append((gid, counts))
+        # 代表例以外のメンバーもバケットに登録し、言い回しが少しずつ違う投稿でも候補に挙がるようにする
+        for key in keys:
+            bucket = self._buckets[key]
+            if not bucket or bucket[-1] != best:
+                bucket.append(best)
+        self.assignments[gid] = best
+        return best
+
+    def add_frame(self, df):
+        new = df.loc[~df["id"].isin(self.assignments.keys())] if len(self.assignments) else df
+        categories = new["category"] if "category" in new.columns else [None] * len(new)
+        for gid, details, category in zip(new["id"], new["details"], categories):
+            self.add(gid, details, category)
+        return len(new)
+
+    def summarize(self, df):
+        # df に含まれる課題だけを対象に、クラスタごとの代表例・件数・平均ストレス度を返す (件数の多い順)
+        # 期間で絞った df でも使えるよう、代表例が df に無い場合は df 内の最初のメンバーを代表にする
+        cols = [c for c in ("id", "category", "details", "stress_level") if c in df.columns]
+        frame = df[cols].assign(_cluster=df["id"].map(self.assignments).to_numpy())
+        rep_ids = np.array([gid for gid, _ in self.representatives], dtype=object)
+        frame["_is_rep"] = frame["id"].to_numpy() == rep_ids[frame["_cluster"].to_numpy(dtype=np.int64)]
+        reps = frame.sort_values("_is_rep", ascending=False, kind="stable").drop_duplicates("_cluster").set_index("_cluster")
+        counts = frame["_cluster"].value_counts()
+        if "stress_level" in frame.columns:
+            mean_stress = pd.to_numeric(frame["stress_level"], errors="coerce").groupby(frame["_cluster"]).mean().round(1)
+        else:
+            mean_stress = pd.Series(dtype="float64")
+
+        records = []
+        for cluster, count in counts.items():
+            rep = reps.loc[cluster]
+            stress = mean_stress.get(cluster)
+            records.append({
+                "category": _json_value(rep.get("category")),
+                "details": _json_value(rep.get("details")),
+                "stress_level": None if stress is None or pd.isna(stress) else float(stress),
+                "count": int(count),
+            })
+        return records
+
+
+class GrievanceClusterer:
+    # 企業ごとのクラスタ割り当てをプロセス内で保持し、新しい投稿だけを追加で割り当てる
+    def __init__(self, threshold=DEFAULT_SIMILARITY, max_companies=256):
+        self.threshold = threshold
+        self.max_companies = max_companies
+        self._indexes = {}
+        self._locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def _index(self, cid):
+        with self._lock:
+            index = self._indexes.pop(cid, None)
+            if index is None:
+                index = GrievanceClusterIndex(threshold=self.threshold)
+            # 最近使った企業を末尾に置き、上限を超えたら古いものから捨てる
+            self._indexes[cid] = index
+            while len(self._indexes) > self.max_companies:
+                self._indexes.pop(next(iter(self._indexes)))
+            return index, self._locks[cid]
+
+    def cluster_records(self, cid, df):
+        index, lock = self._index(cid)
+        with lock:
+            index.add_frame(df)
+            return index.summarize(df)
+
+    def invalidate(self, cid=None):
+        with self._lock:
+            if cid is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(cid, None)
@@ -0,0 +1,159 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 課題 DataFrame のコンパクト表現とメモリ上限付きキャッシュ
+# ==========================================
+# 特権管理者が企業を次々に切り替えると、企業ごとの DataFrame がプロセス内に溜まり続ける。
+# - 列の型を詰める: category / user_id はカテゴリ型 (辞書エンコード)、stress_level は int8、created_at は datetime
+#   (id は行ごとに一意で辞書化しても小さくならないため、pandas 既定の Arrow 文字列のまま)
+# - ダッシュボードで使わない列は持たない
+# - 企業ごとのフレームは合計バイト数の上限付きLRUに入れ、上限を超えたら最も古く使われた企業から捨てる
+#   (捨てた企業は次に開いたときにスナップショット or Supabase から読み直す)
+
+# ダッシュボードで実際に使う列のみ保持する
+GRIEVANCE_COLUMNS = ["id", "user_id", "category", "details", "stress_level", "created_at"]
+CATEGORICAL_COLUMNS = ["user_id", "category"]
+
+# プロセス内に保持する課題フレームの合計の上限 (MB)
+DEFAULT_CACHE_BYTES = int(float(os.environ.get("GRIEVANCE_CACHE_MB", "512")) * 1024 * 1024)
+
+
+def compact_stress(values):
+    # 1〜10 の整数。欠損がある場合は NaN を持てる float32 にする
+    stress = pd.to_numeric(values, errors="coerce")
+    if stress.isna().any():
+        return stress.astype(np.float32)
+    return stress.astype(np.int8)
+
+
+def is_compact(df):
+    # compact_grievances の結果と同じ列・型か (スナップショットから読んだフレームなど)
+    if list(df.columns) != GRIEVANCE_COLUMNS:
+        return False
+    dtypes = df.dtypes
+    return (
+        pd.api.types.is_string_dtype(dtypes["id"]) and pd.api.types.is_string_dtype(dtypes["details"])
+        and all(isinstance(dtypes[col], pd.CategoricalDtype) for col in CATEGORICAL_COLUMNS)
+        and dtypes["stress_level"] in (np.int8, np.float32)
+        and str(dtypes["created_at"]).startswith("datetime64[") and str(dtypes["created_at"]).endswith(", UTC]")
+    )
+
+
+def compact_grievances(df):
+    # Supabase の行 (文字列・object) から作った DataFrame を型を詰めたものに変換する
+    # 変換済みのものはそのまま返す (メモリマップしたスナップショットの列を複製しない)
+    if is_compact(df):
+        return df
+    frame = df.reindex(columns=GRIEVANCE_COLUMNS)
+    return pd.DataFrame({
+        "id": frame["id"].astype("str"),
+        "user_id": frame["user_id"].astype("category"),
+        "category": frame["category"].astype("category"),
+        "details": frame["details"].astype("str"),
+        "stress_level": compact_stress(frame["stress_level"]),
+        "created_at": pd.to_datetime(frame["created_at"], utc=True, errors="coerce", format="ISO8601"),
+    })
+
+
+def append_compact(frame, new):
+    # 既存のフレームに新着分を追加する。カテゴリ型の列は既存のカテゴリに新しい値を足すだけで、既存の行は作り直さない
+    new = compact_grievances(new)
+    frame = frame.copy(deep=False)
+    for col in CATEGORICAL_COLUMNS:
+        categories = frame[col].cat.categories.union(new[col].cat.categories)
+        frame[col] = frame[col].cat.set_categories(categories)
+        new[col] = new[col].cat.set_categories(categories)
+    if frame["stress_level"].dtype != new["stress_level"].dtype:
+        frame["stress_level"] = frame["stress_level"].astype(np.float32)
+        new["stress_level"] = new["stress_level"].astype(np.float32)
+    return pd.concat([frame, new], ignore_index=True)
+
+
+def slice_window(frame, start=None, end=None):
+    # 期間 [start, end) の行だけを取り出す (start / end は ISO 8601 文字列。None は制限なし)
+    mask = pd.Series(True, index=frame.index)
+    if start is not None:
+        mask &= frame["created_at"] >= pd.Timestamp(start)
+    if end is not None:
+        mask &= frame["created_at"] < pd.Timestamp(end)
+    return frame.loc[mask].reset_index(drop=True)
+
+
+def frame_nbytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+class FrameCache:
+    # 企業ごとのフレームを合計 max_bytes までに抑える LRU (max_bytes=None で上限なし)
+    # 1社だけで上限を超える場合も、直前に入れたフレームは捨てない
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.stats["misses"] += 1
+                return None
+            self._frames.move_to_end(key)
+            self.stats["hits"] += 1
+            return frame
+
+    def peek(self, key):
+        # 使用順・ヒット数を変えずに参照する
+        with self._lock:
+            return self._frames.get(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._frames)
+
+    def put(self, key, frame):
+        # 戻り値: 上限を超えたために捨てた企業のキー
+        size = frame_nbytes(frame)
+        evicted = []
+        with self._lock:
+            self._discard(key)
+            self._frames[key] = frame
+            self._sizes[key] = size
+            self._bytes += size
+            while self.max_bytes is not None and self._bytes > self.max_bytes and len(self._frames) > 1:
+                oldest = next(iter(self._frames))
+                self._discard(oldest)
+                self.stats["evictions"] += 1
+                evicted.append(oldest)
+        return evicted
+
+    def _discard(self, key):
+        if self._frames.pop(key, None) is not None:
+            self._bytes -= self._sizes.pop(key)
+
+    def pop(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def footprint(self):
+        # 現在のキャッシュ使用量 (ダッシュボードの計測パネル・ベンチマークで表示する)
+        with self._lock:
+            return {
+                "bytes": self._bytes,
+                "frames": len(self._frames),
+                "max_bytes": self.max_bytes,
+                **self.stats,
+            }
@@ -0,0 +1,234 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from grievance_frames import GRIEVANCE_COLUMNS, FrameCache, append_compact, compact_grievances, slice_window
+from grievance_stats import parse_timestamp
+
+# ==========================================
+# 課題データの差分ローダー (ウォーターマーク方式)
+# ==========================================
+# 企業ごとにローカルのDataFrameを保持し、前回取得した (created_at, id) 以降の行だけを
+# キーセットページネーションで取得してマージする。
+# 更新コストは総履歴ではなく新着件数に比例する。
+# 企業ごとの集計 (grievance_stats) を渡すと、件数と最終投稿日時が変わっていない限り問い合わせ自体を省略する。
+# snapshot_store (GrievanceSnapshotStore) を渡すと、プロセスで初めて読む企業はディスクのスナップショットから復元し、
+# 新着を取得するたびにスナップショットも更新する。
+# 保持するフレームは型を詰めたもの (grievance_frames.compact_grievances) で、合計が max_bytes を超えると
+# 最も古く使われた企業から捨てる。
+# 変更通知 (grievance_notifications) を notify_change で受け取っている間は load(live=True) とし、
+# 通知が来た企業だけ新着を取得する (通知の無い企業は集計の確認も含めて問い合わせない)。
+# load_window は期間 [start, end) の課題だけを扱う。全期間のフレームを保持していればそこから切り出し、
+# 無ければ期間内の行だけを (company_id, created_at) インデックスで取得して (企業, 開始, 終了) ごとに保持する。
+
+# 書き込みトランザクションのコミット遅延で取りこぼさないよう、ウォーターマークを少し巻き戻して再取得する
+WATERMARK_OVERLAP_SECONDS = 5
+
+
+class IncrementalGrievanceLoader:
+    def __init__(self, page_size=1000, refresh_interval=60, snapshot_store=None, max_bytes=None):
+        self.page_size = page_size
+        self.refresh_interval = refresh_interval
+        self.snapshot_store = snapshot_store
+        self._frames = FrameCache(max_bytes)
+        self._watermarks = {}
+        self._refreshed_at = {}
+        # 最後の取得以降に変更通知が来ていない企業
+        self._synced = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _company_lock(self, cid):
+        with self._lock:
+            if cid not in self._locks:
+                self._locks[cid] = threading.Lock()
+            return self._locks[cid]
+
+    def _fetch_page(self, client, cid, after, start=None, end=None):
+        query = client.table("grievances").select(", ".join(GRIEVANCE_COLUMNS)).eq("company_id", cid)
+        if start is not None:
+            query = query.gte("created_at", start)
+        if end is not None:
+            query = query.lt("created_at", end)
+        if after is not None:
+            ts, gid = after
+            if gid is None:
+                query = query.gt("created_at", ts)
+            else:
+                query = query.or_(f'created_at.gt."{ts}",and(created_at.eq."{ts}",id.gt.{gid})')
+        res = query.order("created_at").order("id").limit(self.page_size).execute()
+        return res.data
+
+    def _fetch_since(self, client, cid, watermark, start=None, end=None):
+        after = None
+        if watermark is not None:
+            ts = datetime.fromisoformat(watermark[0]) - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)
+            after = (ts.isoformat(), None)
+
+        rows = []
+        while True:
+            page = self._fetch_page(client, cid, after, start, end)
+            rows.extend(page)
+            if len(page) < self.page_size:
+                break
+            after = (page[-1]["created_at"], page[-1]["id"])
+        return rows
+
+    def _rows_counted_in_stats(self, frame, stats):
+        # 集計の最終投稿日時までの行数。集計 (数秒キャッシュされる) を読んだ後に取得した新着は数えない
+        if stats["last_submitted_at"] is None:
+            return len(frame)
+        return int((frame["created_at"] <= pd.Timestamp(stats["last_submitted_at"])).sum())
+
+    def _matches_stats(self, cid, frame, stats):
+        if stats["total_count"] != self._rows_counted_in_stats(frame, stats):
+            return False
+        watermark = self._watermarks.get(cid)
+        if stats["last_submitted_at"] is None:
+            return watermark is None
+        return watermark is not None and parse_timestamp(watermark[0]) >= stats["last_submitted_at"]
+
+    def load(self, client, cid, force=False, stats=None, live=False):
+        # stats: grievance_stats.fetch_grievance_stats() の結果。渡した場合は refresh_interval より優先して新着判定に使う
+        # live: 変更通知を受信中。通知が来ていなければ stats・refresh_interval に関係なく保持中のフレームを返す
+        with self._company_lock(cid):
+            frame = self._frames.get(cid)
+            if frame is None:
+                # 初めて読む or メモリ上限で捨てられた企業は全件 (スナップショットがあればその続き) から読み直す
+                self._watermarks.pop(cid, None)
+                if self.snapshot_store is not None:
+                    restored = self.snapshot_store.load(cid)
+                    if restored is not None:
+                        # ウォーターマーク以降の新着は以下の差分取得で補う
+                        frame, self._watermarks[cid] = compact_grievances(restored[0]), restored[1]
+            last = self._refreshed_at.get(cid, 0)
+            if live and not force:
+                if frame is not None and self._synced.get(cid):
+                    self._refreshed_at[cid] = time.monotonic()
+                    return frame
+            elif stats is not None and not force:
+                if frame is None and stats["total_count"] == 0:
+                    return compact_grievances(pd.DataFrame(columns=GRIEVANCE_COLUMNS))
+                if frame is not None and self._rows_counted_in_stats(frame, stats) > stats["total_count"]:
+                    # 削除された課題は差分取得では検知できないため、全件を取り直す
+                    # (集計より新しい行は比較から除くため、集計を読んだ後の新着を削除と取り違えない)
+                    frame = None
+                    self._watermarks.pop(cid, None)
+                elif frame is not None and self._matches_stats(cid, frame, stats):
+                    self._refreshed_at[cid] = time.monotonic()
+                    return frame
+            elif frame is not None and not force and time.monotonic() - last < self.refresh_interval:
+                return frame
+
+            before = len(frame) if frame is not None else None
+            frame = self._refresh(client, cid, cid, frame)
+
+            # ウォーターマークの巻き戻し分だけを再取得した場合 (件数が変わらない場合) は書き直さない
+            if self.snapshot_store is not None and len(frame) != before:
+                try:
+                    self.snapshot_store.save(cid, frame, self._watermarks.get(cid))
+                except Exception as e:
+                    print(f"課題スナップショットの保存エラー ({cid}): {e}")
+
+            # 上限を超えて捨てられた企業のウォーターマークは、次に読むときに frame が無いことで破棄される
+            self._frames.put(cid, frame)
+            self._refreshed_at[cid] = time.monotonic()
+            return frame
+
+    def _refresh(self, client, key, cid, frame, start=None, end=None):
+        # key (企業ID or (企業ID, 開始, 終了)) のウォーターマーク以降の行を取得して frame にマージする
+        # 取得中に届いた通知で False に戻った場合は、次回もう一度取得する
+        self._synced[key] = True
+        rows = self._fetch_since(client, cid, self._watermarks.get(key), start, end)
+        if frame is None:
+            frame = compact_grievances(pd.DataFrame(rows, columns=GRIEVANCE_COLUMNS))
+        elif rows:
+            frame = append_compact(frame, pd.DataFrame(rows, columns=GRIEVANCE_COLUMNS))
+            # 巻き戻し分の重複を除去する
+            frame = frame.drop_duplicates(subset="id", keep="first", ignore_index=True)
+
+        if rows:
+            last_row = max(rows, key=lambda r: (r["created_at"], r["id"]))
+            current = self._watermarks.get(key)
+            if current is None or (last_row["created_at"], last_row["id"]) > current:
+                self._watermarks[key] = (last_row["created_at"], last_row["id"])
+        return frame
+
+    def _window_is_current(self, key, start, end, stats, live):
+        # 保持中の期間フレームに、まだ取り込んでいない課題が無いと判断できるか
+        if end is not None and parse_timestamp(end) <= datetime.now(timezone.utc) - timedelta(seconds=WATERMARK_OVERLAP_SECONDS):
+            # 終了日時を過ぎた期間には新しい課題は入らない (削除は通知・invalidate で破棄される)
+            return True
+        if live:
+            return bool(self._synced.get(key))
+        if stats is not None:
+            last = stats["last_submitted_at"]
+            watermark = self._watermarks.get(key)
+            if last is None:
+                return True
+            if watermark is not None:
+                return parse_timestamp(watermark[0]) >= last
+            return start is not None and last < parse_timestamp(start)
+        return time.monotonic() - self._refreshed_at.get(key, 0) < self.refresh_interval
+
+    def load_window(self, client, cid, start=None, end=None, stats=None, live=False):
+        # 期間 [start, end) の課題 (start / end は ISO 8601 文字列。None は制限なし)
+        # 期間で絞った行数は集計の件数と比べられないため、削除の検知は変更通知・invalidate に任せる
+        if start is None and end is None:
+            return self.load(client, cid, stats=stats, live=live)
+        if self._frames.peek(cid) is not None:
+            # 全期間を保持している企業は新着を確認してから切り出す (期間のための問い合わせはしない)
+            return slice_window(self.load(client, cid, stats=stats, live=live), start, end)
+
+        key = (cid, start, end)
+        with self._company_lock(cid):
+            frame = self._frames.get(key)
+            if frame is None:
+                self._watermarks.pop(key, None)
+            elif self._window_is_current(key, start, end, stats, live):
+                self._refreshed_at[key] = time.monotonic()
+                return frame
+
+            frame = self._refresh(client, key, cid, frame, start, end)
+            self._frames.put(key, frame)
+            self._refreshed_at[key] = time.monotonic()
+            return frame
+
+    def _keys_for(self, cid):
+        # 企業の全期間・期間ごとのキー
+        keys = set(self._frames.keys()) | set(self._watermarks.copy()) | set(self._refreshed_at.copy()) | set(self._synced.copy())
+        return [key for key in keys if key == cid or (isinstance(key, tuple) and key[0] == cid)]
+
+    def footprint(self):
+        return self._frames.footprint()
+
+    def notify_change(self, event):
+        # GrievanceChangeListener から呼ばれる。INSERT は次回の load で新着分を取得し、
+        # DELETE は差分取得では反映できないため取り直す。RESYNC (再接続) は全企業を確認し直す
+        if event["op"] == "DELETE":
+            # 取得中のフレームで上書きされないよう、その企業の load が終わるのを待ってから捨てる
+            with self._company_lock(event["company_id"]):
+                self.invalidate(event["company_id"])
+        elif event["op"] == "INSERT":
+            for key in self._keys_for(event["company_id"]):
+                self._synced[key] = False
+        else:
+            self._synced.clear()
+
+    def invalidate(self, cid=None):
+        with self._lock:
+            if cid is None:
+                self._frames.clear()
+                self._watermarks.clear()
+                self._refreshed_at.clear()
+                self._synced.clear()
+            else:
+                for key in self._keys_for(cid):
+                    self._frames.pop(key)
+                    self._watermarks.pop(key, None)
+                    self._refreshed_at.pop(key, None)
+                    self._synced.pop(key, None)
+        if self.snapshot_store is not None:
+            self.snapshot_store.remove(cid)
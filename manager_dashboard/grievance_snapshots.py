@@ -0,0 +1,114 @@
+import json
+import os
+
+import pyarrow as pa
+
+from grievance_frames import CATEGORICAL_COLUMNS, GRIEVANCE_COLUMNS
+
+# ==========================================
+# 課題データのカラム型スナップショット (Arrow IPC)
+# ==========================================
+# 企業ごとの課題 DataFrame を Arrow IPC ファイルとしてディスクに保存し、プロセスの再起動・新しいセッション・
+# 同じホストの別プロセス (ワーカー等) は Supabase から JSON で取り直さずにメモリマップで読み込む。
+# - 各列は pandas が使う型そのままの Arrow 型で保存する (文字列は large_string、カテゴリ型の列は
+#   pandas のコード幅と同じインデックスの辞書型)。DataFrame 化しても列のバッファはメモリマップを指したままで、
+#   ファイルは OS のページキャッシュを介してプロセス間で共有される (新着を追加したときに初めて複製される)
+# - 書き込みは一時ファイル + 置き換えのため途中まで書かれたファイルは見えない。読み込み時は形式・行数と
+#   Arrow の構造検証 (内容は走査しない) だけを行い、壊れた/古い形式のファイルは捨てる
+# - 読み込み後は通常の差分取得でウォーターマーク以降の新着だけを Supabase から補う
+# 従業員の投稿本文を含むため、既定ではリポジトリの外 (ユーザーのキャッシュディレクトリ) に保存する
+
+SNAPSHOT_FORMAT = "grievances-v3"
+DEFAULT_SNAPSHOT_DIR = os.environ.get("GRIEVANCE_SNAPSHOT_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "guchi_ai", "grievance_snapshots"
+)
+
+# grievance_frames.compact_grievances と同じ型で保存する (辞書型のインデックス幅は保存時に列ごとに決める)
+SNAPSHOT_TYPES = {
+    "id": pa.large_string(),
+    "details": pa.large_string(),
+    "stress_level": pa.int8(),
+    "created_at": pa.timestamp("us", tz="UTC"),
+}
+
+
+def snapshot_schema(frame):
+    fields = []
+    for col in GRIEVANCE_COLUMNS:
+        if col in CATEGORICAL_COLUMNS:
+            # pandas のカテゴリコードと同じ幅にして、読み込み時にコードを変換 (複製) しないようにする
+            index_type = pa.from_numpy_dtype(frame[col].cat.codes.dtype)
+            fields.append((col, pa.dictionary(index_type, pa.large_string())))
+        elif col == "stress_level" and frame[col].dtype != "int8":
+            # 欠損がある場合は float32 (compact_stress)
+            fields.append((col, pa.float32()))
+        else:
+            fields.append((col, SNAPSHOT_TYPES[col]))
+    return pa.schema(fields)
+
+
+class GrievanceSnapshotStore:
+    def __init__(self, root=DEFAULT_SNAPSHOT_DIR):
+        self.root = root
+
+    def path(self, cid):
+        return os.path.join(self.root, f"{cid}.arrow")
+
+    def save(self, cid, frame, watermark):
+        # 一時ファイルに書いてから置き換える (読み込み中の他プロセスは古いファイルをそのまま読み続けられる)
+        os.makedirs(self.root, exist_ok=True)
+        table = pa.Table.from_pandas(frame[GRIEVANCE_COLUMNS], schema=snapshot_schema(frame), preserve_index=False)
+        table = table.replace_schema_metadata({
+            "format": SNAPSHOT_FORMAT,
+            "watermark": json.dumps(list(watermark) if watermark else None),
+            "rows": str(len(frame)),
+        })
+        path = self.path(cid)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    def load(self, cid):
+        # 戻り値: (DataFrame, ウォーターマーク) / スナップショットが無い・使えない場合は None
+        path = self.path(cid)
+        if not os.path.exists(path):
+            return None
+        try:
+            source = pa.memory_map(path, "r")
+            table = pa.ipc.open_file(source).read_all()
+            metadata = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+            if metadata.get("format") != SNAPSHOT_FORMAT:
+                raise ValueError(f"形式が異なります: {metadata.get('format')}")
+            if table.num_rows != int(metadata["rows"]):
+                raise ValueError("行数が一致しません")
+            table.validate()
+            # split_blocks: 列ごとに別のブロックにして、列をまとめるための複製をしない
+            frame = table.to_pandas(split_blocks=True)
+            watermark = json.loads(metadata["watermark"])
+        except Exception as e:
+            print(f"課題スナップショットを破棄します ({cid}): {e}")
+            self.remove(cid)
+            return None
+        return frame, tuple(watermark) if watermark else None
+
+    def remove(self, cid=None):
+        targets = [self.path(cid)] if cid is not None else [
+            os.path.join(self.root, name) for name in (os.listdir(self.root) if os.path.isdir(self.root) else [])
+            if name.endswith(".arrow")
+        ]
+        for path in targets:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def footprint(self):
+        # ディスク上のスナップショットの合計バイト数
+        if not os.path.isdir(self.root):
+            return 0
+        return sum(
+            os.path.getsize(os.path.join(self.root, name))
+            for name in os.listdir(self.root) if name.endswith(".arrow")
+        )
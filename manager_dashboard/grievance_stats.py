@@ -0,0 +1,56 @@
+from datetime import datetime
+
+# ==========================================
+# 企業ごとの課題集計 (grievance_stats_update.sql) の読み取り
+# ==========================================
+# 件数・カテゴリ別内訳・最終投稿日時はDB側のトリガーが常に最新に保っているため、
+# grievances を取得しなくても1行読むだけでヘッダー表示や新着判定ができる。
+# マイグレーション未適用の環境では None を返し、呼び出し側は従来通り DataFrame から求める。
+
+STATS_VIEW = "grievance_stats_summary"
+STATS_SELECT = "company_id, total_count, stress_sum, stress_count, high_stress_count, last_submitted_at, categories"
+
+
+def parse_timestamp(value):
+    # PostgREST の timestamptz 文字列 (小数秒の桁数が可変) を datetime にする
+    if not value:
+        return None
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+def parse_stats(row):
+    stress_count = row.get("stress_count") or 0
+    return {
+        "total_count": int(row.get("total_count") or 0),
+        "average_stress_level": round(row["stress_sum"] / stress_count, 2) if stress_count else None,
+        "high_stress_count": int(row.get("high_stress_count") or 0),
+        "last_submitted_at": parse_timestamp(row.get("last_submitted_at")),
+        "categories": {
+            category: int(values.get("total_count") or 0)
+            for category, values in (row.get("categories") or {}).items()
+        },
+    }
+
+
+def empty_stats():
+    return {"total_count": 0, "average_stress_level": None, "high_stress_count": 0, "last_submitted_at": None, "categories": {}}
+
+
+def fetch_grievance_stats(client, cid):
+    # 戻り値: 集計のdict (投稿が無い企業は件数0) / 集計テーブルが使えない場合は None
+    try:
+        res = client.table(STATS_VIEW).select(STATS_SELECT).eq("company_id", cid).limit(1).execute()
+    except Exception as e:
+        print(f"課題集計の取得エラー: {e}")
+        return None
+    return parse_stats(res.data[0]) if res.data else empty_stats()
+
+
+def fetch_all_grievance_stats(client):
+    # 全企業分 (Service Role / 特権管理者向け)。戻り値: {company_id: 集計} / 使えない場合は None
+    try:
+        res = client.table(STATS_VIEW).select(STATS_SELECT).execute()
+    except Exception as e:
+        print(f"課題集計の取得エラー: {e}")
+        return None
+    return {row["company_id"]: parse_stats(row) for row in res.data}
@@ -0,0 +1,170 @@
+import copy
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+# ==========================================
+# ベンチマーク・ローカル検証用の Supabase (PostgREST) 代替
+# ==========================================
+# ダッシュボードが使うクエリビルダーの範囲 (select / eq / gt / in_ / or_ / order / limit / insert 等) を
+# メモリ上のテーブルで再現する。レスポンスのJSONサイズを数えて「取得バイト数」を計測できる。
+# 本物のローカルスタック (`supabase start`) を使う場合は create_client() の戻り値と差し替えればよい。
+
+# report_cache / grievance_loader が使う or_ の形式 (キーセットページネーション) のみ解釈する
+KEYSET_FILTER = re.compile(r'^created_at\.gt\."([^"]+)",and\(created_at\.eq\."([^"]+)",id\.gt\.([^)]+)\)$')
+
+
+class LocalResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class LocalQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self._columns = None
+        self._filters = []
+        self._orders = []
+        self._limit = None
+        self._single = False
+        self._op = "select"
+        self._payload = None
+
+    def select(self, columns="*", count=None):
+        if columns.strip() != "*":
+            # 埋め込みリソース (例: subscriptions(status)) は無視し、通常の列だけを射影する
+            cols = re.sub(r"\w+\([^)]*\)", "", columns)
+            self._columns = [c.strip() for c in cols.split(",") if c.strip()]
+        return self
+
+    def eq(self, column, value):
+        self._filters.append(lambda r: r.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self._filters.append(lambda r: r.get(column) != value)
+        return self
+
+    def gt(self, column, value):
+        self._filters.append(lambda r: r.get(column) is not None and str(r.get(column)) > str(value))
+        return self
+
+    def gte(self, column, value):
+        self._filters.append(lambda r: r.get(column) is not None and str(r.get(column)) >= str(value))
+        return self
+
+    def lt(self, column, value):
+        self._filters.append(lambda r: r.get(column) is not None and str(r.get(column)) < str(value))
+        return self
+
+    def lte(self, column, value):
+        self._filters.append(lambda r: r.get(column) is not None and str(r.get(column)) <= str(value))
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self._filters.append(lambda r: r.get(column) in values)
+        return self
+
+    def or_(self, expression):
+        m = KEYSET_FILTER.match(expression)
+        if not m:
+            raise NotImplementedError(f"LocalSupabase は or_({expression!r}) に対応していません")
+        ts, _, gid = m.groups()
+        self._filters.append(lambda r: (r["created_at"], r["id"]) > (ts, gid))
+        return self
+
+    def order(self, column, desc=False):
+        self._orders.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def insert(self, payload):
+        self._op = "insert"
+        self._payload = payload
+        return self
+
+    def update(self, payload):
+        self._op = "update"
+        self._payload = payload
+        return self
+
+    def execute(self):
+        return self.db._execute(self)
+
+
+class LocalSupabase:
+    def __init__(self):
+        self.tables = {}
+        self.bytes_fetched = 0
+        self.requests = 0
+        # 代替サーバー側で費やした時間 (計測結果からアプリ側の処理時間を切り分けるため)
+        self.server_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return LocalQuery(self, name)
+
+    def reset_counters(self):
+        with self._lock:
+            self.bytes_fetched = 0
+            self.requests = 0
+            self.server_seconds = 0.0
+
+    def seed(self, table, rows):
+        with self._lock:
+            self.tables.setdefault(table, []).extend(rows)
+
+    def _execute(self, query):
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                return self._execute_locked(query)
+            finally:
+                self.server_seconds += time.perf_counter() - started
+
+    def _execute_locked(self, query):
+        self.requests += 1
+        rows = self.tables.setdefault(query.table, [])
+
+        if query._op == "insert":
+            payload = query._payload if isinstance(query._payload, list) else [query._payload]
+            inserted = []
+            for item in payload:
+                row = {"id": str(uuid.uuid4()), "created_at": datetime.now(timezone.utc).isoformat(), **copy.deepcopy(item)}
+                rows.append(row)
+                inserted.append(row)
+            return LocalResponse(inserted)
+
+        matched = [r for r in rows if all(f(r) for f in query._filters)]
+
+        if query._op == "update":
+            for r in matched:
+                r.update(query._payload)
+            return LocalResponse(matched)
+
+        # 複数キーの安定ソートは後ろのキーから順に適用する
+        for column, desc in reversed(query._orders):
+            matched.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        if query._limit is not None:
+            matched = matched[:query._limit]
+        if query._columns is not None:
+            matched = [{c: r.get(c) for c in query._columns} for r in matched]
+        else:
+            matched = [dict(r) for r in matched]
+
+        data = matched[0] if query._single else matched
+        self.bytes_fetched += len(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        return LocalResponse(data)
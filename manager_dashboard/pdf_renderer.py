@@ -0,0 +1,208 @@
+import contextvars
+import hashlib
+import html
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from tracing import span
+
+# ==========================================
+# PDFレンダリング (wkhtmltopdf)
+# ==========================================
+# wkhtmltopdf はレンダリングのたびにプロセスを起動し日本語フォントを読み込むため重い。
+# - 生成結果は (タイトル + マークダウン) のハッシュで容量上限付きのLRUにキャッシュする
+# - 同時に起動するレンダラー数は固定サイズのプールで制限する
+# - ダッシュボード側はダウンロードが要求されたときだけ render() を呼ぶ
+# - 全レポートのまとめてPDFは目次付きの1つのHTMLにして、wkhtmltopdf を1回だけ起動する (submit_combined)
+
+PDF_OPTIONS = {
+    'page-size': 'A4',
+    'margin-top': '0.75in',
+    'margin-right': '0.75in',
+    'margin-bottom': '0.75in',
+    'margin-left': '0.75in',
+    'encoding': "UTF-8",
+    'no-outline': None
+}
+
+
+PDF_STYLE = """
+            body {
+                font-family: "Noto Sans JP", "Hiragino Kaku Gothic ProN", "Meiryo", sans-serif;
+                color: #333;
+                line-height: 1.6;
+                padding: 20px;
+                background-color: #fff;
+            }
+            h1, h2, h3, h4 { color: #1e293b; border-bottom: 1px solid #cbd5e1; padding-bottom: 8px; }
+            h1 { font-size: 24px; }
+            h2 { font-size: 20px; margin-top: 24px; }
+            h3 { font-size: 16px; margin-top: 20px; }
+            code { background-color: #f1f5f9; padding: 2px 6px; border-radius: 4px; font-family: monospace; color: #0f172a; font-weight: bold; }
+            pre code { display: block; padding: 10px; overflow-x: auto; }
+            ul { padding-left: 20px; }
+            hr { border: 0; border-top: 1px dashed #cbd5e1; margin: 20px 0; }
+            .toc ol { padding-left: 20px; line-height: 2; }
+            .toc a { color: #1e293b; text-decoration: none; }
+            .report { page-break-before: always; }
+"""
+
+# まとめてPDF: 目次から各レポートへのリンクに加え、PDFビューアのしおり (アウトライン) も出力する
+COMBINED_PDF_OPTIONS = {key: value for key, value in PDF_OPTIONS.items() if key != 'no-outline'}
+COMBINED_PDF_OPTIONS['outline-depth'] = '1'
+
+
+def wrap_pdf_html(title, body):
+    # PDF用のCSS＆HTMLラッパー (日本語フォント対応)
+    return f"""
+    <!DOCTYPE html>
+    <html lang="ja">
+    <head>
+        <meta charset="UTF-8">
+        <title>{title}</title>
+        <style>{PDF_STYLE}        </style>
+    </head>
+    <body>
+        {body}
+    </body>
+    </html>
+    """
+
+
+def markdown_to_html(md_content):
+    # markdown / pdfkit はPDFが要求されたときだけ読み込む
+    import markdown
+    return markdown.markdown(md_content, extensions=['tables'])
+
+
+def build_pdf_html(md_content, title):
+    # マークダウンをHTMLに変換
+    html_body = markdown_to_html(md_content)
+    return wrap_pdf_html(title, f"<h1>■ {title}</h1>\n        {html_body}")
+
+
+def build_combined_pdf_html(sections, title):
+    # sections: [(レポート名, マークダウン), ...] を目次付きの1つのHTMLにする (各レポートは改ページして始める)
+    toc = "\n".join(
+        f'<li><a href="#report-{i}">{html.escape(name)}</a></li>' for i, (name, _md) in enumerate(sections, 1)
+    )
+    body = [f'<h1>■ {title}</h1>\n        <div class="toc"><h2>目次</h2><ol>{toc}</ol></div>']
+    for i, (name, md_content) in enumerate(sections, 1):
+        body.append(f'<div class="report"><h1 id="report-{i}">■ {html.escape(name)}</h1>\n{markdown_to_html(md_content)}</div>')
+    return wrap_pdf_html(title, "\n".join(body))
+
+
+def render_pdf(html_content, options=PDF_OPTIONS):
+    try:
+        # ローカル環境のパスやCloud環境に応じてwkhtmltopdfを実行
+        # Streamlit Cloudでは packages.txt で wkhtmltopdf をインストール済み
+        with span("pdf.render", html_bytes=len(html_content.encode("utf-8"))) as s:
+            import pdfkit
+            pdf_bytes = pdfkit.from_string(html_content, False, options=options)
+            s.set(pdf_bytes=len(pdf_bytes) if pdf_bytes else 0)
+            return pdf_bytes
+    except Exception as e:
+        print(f"PDF生成エラー: {e}")
+        return None
+
+
+def pdf_cache_key(md_content, title):
+    h = hashlib.sha256()
+    h.update(title.encode("utf-8"))
+    h.update(b"\0")
+    h.update(md_content.encode("utf-8"))
+    return h.hexdigest()
+
+
+def combined_pdf_key(sections, title):
+    h = hashlib.sha256(b"combined\0")
+    h.update(title.encode("utf-8"))
+    for name, md_content in sections:
+        h.update(b"\0")
+        h.update(pdf_cache_key(md_content, name).encode("ascii"))
+    return h.hexdigest()
+
+
+class PdfRenderer:
+    def __init__(self, max_renderers=2, cache_bytes=64 * 1024 * 1024):
+        self.cache_bytes = cache_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_renderers, thread_name_prefix="pdf")
+        self._cache = OrderedDict()
+        self._cache_size = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _get_cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            return None
+
+    def _put_cached(self, key, pdf_bytes):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = pdf_bytes
+            self._cache_size += len(pdf_bytes)
+            # 容量上限を超えたら古いものから捨てる
+            while self._cache_size > self.cache_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_size -= len(evicted)
+
+    def _submit(self, key, build_html, options):
+        # 同じ内容のレンダリングが進行中ならその Future を共有する
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._executor.submit(contextvars.copy_context().run, self._render, key, build_html, options)
+                self._inflight[key] = future
+        return future
+
+    def submit(self, md_content, title):
+        return self._submit(pdf_cache_key(md_content, title), lambda: build_pdf_html(md_content, title), PDF_OPTIONS)
+
+    def submit_combined(self, sections, title):
+        # 戻り値: (キー, Future)。キーを保持しておけば、後の再実行で get() / status() から結果を取り出せる
+        key = combined_pdf_key(sections, title)
+        cached = self._get_cached(key)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return key, future
+        sections = list(sections)
+        return key, self._submit(key, lambda: build_combined_pdf_html(sections, title), COMBINED_PDF_OPTIONS)
+
+    def _render(self, key, build_html, options):
+        try:
+            pdf_bytes = render_pdf(build_html(), options)
+            if pdf_bytes:
+                self._put_cached(key, pdf_bytes)
+            return pdf_bytes
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def render(self, md_content, title, timeout=None):
+        cached = self._get_cached(pdf_cache_key(md_content, title))
+        if cached is not None:
+            return cached
+        return self.submit(md_content, title).result(timeout=timeout)
+
+    def get(self, key):
+        # 生成済みのPDF (無ければ None)。レンダリングの完了を待たない
+        return self._get_cached(key)
+
+    def status(self, key):
+        # "done": 生成済み / "running": 生成中 / "failed": 生成に失敗 (またはキャッシュから追い出された)
+        with self._lock:
+            if key in self._cache:
+                return "done"
+            if key in self._inflight:
+                return "running"
+        return "failed"
+
+    def cache_footprint(self):
+        with self._lock:
+            return len(self._cache), self._cache_size
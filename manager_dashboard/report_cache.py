@@ -0,0 +1,202 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import timezone
+
+import pandas as pd
+
+# ==========================================
+# AIレポートのコンテンツアドレス型キャッシュ
+# ==========================================
+# (company_id, report_id, プロンプト版, 課題セットの識別子) からフィンガープリントを作り、
+# 同じ入力に対しては Gemini を呼ばずに保存済みの結果を返す。
+# 参照順: プロセス内LRU -> ai_reports テーブル -> モデル呼び出し
+
+
+def grievance_set_hash(df, stats=None):
+    # 課題の集合を (件数, 最終投稿日時) で識別する (行ごとの id は走査しない)
+    # grievances は created_at = now() で追記されるため、期間 [開始, 終了) の課題は「最終投稿日時までの直近 N 件」として
+    # 件数と最終投稿日時で決まる。削除は件数の変化として表れる。
+    # stats (grievance_stats の集計行) を渡し、件数が df と一致する場合 (全期間のフレーム) はフレームを走査せずにその値を使う
+    if df is None or df.empty:
+        return "empty"
+    if stats is not None and stats["total_count"] == len(df) and stats["last_submitted_at"] is not None:
+        last = stats["last_submitted_at"]
+    else:
+        created_at = df["created_at"]
+        if not isinstance(created_at.dtype, pd.DatetimeTZDtype):
+            # 型を詰める前の DataFrame (created_at が文字列) も受け付ける
+            created_at = pd.to_datetime(created_at, utc=True, format="ISO8601")
+        last = created_at.max().to_pydatetime()
+    raw = json.dumps([len(df), last.astimezone(timezone.utc).isoformat()])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def report_fingerprint(cid, report_id, prompt_version, grievance_hash):
+    raw = json.dumps([str(cid), report_id, prompt_version, grievance_hash])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ReportLRU:
+    # プロセス全体で共有するスレッドセーフなLRU (値はレポートのJSONテキスト)
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def fetch_stored_report(client, cid, fingerprint):
+    # ai_reports に同じフィンガープリントの結果があれば report_data (dict) を返す
+    try:
+        res = (
+            client.table("ai_reports")
+            .select("report_data")
+            .eq("company_id", cid)
+            .eq("fingerprint", fingerprint)
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+    except Exception as e:
+        # fingerprint 列が未マイグレーションの環境ではキャッシュミス扱いにする
+        print(f"レポートキャッシュ参照エラー: {e}")
+        return None
+    if res.data:
+        return res.data[0]["report_data"]
+    return None
+
+
+class ReportStoreError(Exception):
+    pass
+
+
+def store_report(client, cid, report_id, fingerprint, report_data, metadata=None):
+    # metadata: 差分再解析用の列 (prompt_version, grievance_count, last_grievance_at, incremental_depth)
+    # 保存できなかった場合は ReportStoreError (RLS で INSERT が許可されていない場合など)
+    row = {
+        "company_id": cid,
+        "report_type": report_id,
+        "fingerprint": fingerprint,
+        "report_data": report_data
+    }
+    try:
+        client.table("ai_reports").insert({**row, **(metadata or {})}).execute()
+        return
+    except Exception as e:
+        if not metadata:
+            raise ReportStoreError(f"DB保存エラー: {e}") from e
+        # 差分再解析用の列が未マイグレーションの環境では、従来の列だけで保存する
+        print(f"DB保存エラー (メタデータなしで再試行します): {e}")
+    try:
+        client.table("ai_reports").insert(row).execute()
+    except Exception as e:
+        raise ReportStoreError(f"DB保存エラー: {e}") from e
+
+
+def fetch_latest_report(client, cid, report_id):
+    # フィンガープリントに関係なく、その企業の最新のレポート (report_data, created_at) を返す
+    try:
+        res = (
+            client.table("ai_reports")
+            .select("report_data, created_at")
+            .eq("company_id", cid)
+            .eq("report_type", report_id)
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+    except Exception as e:
+        print(f"レポートキャッシュ参照エラー: {e}")
+        return None, None
+    if res.data:
+        return res.data[0]["report_data"], res.data[0]["created_at"]
+    return None, None
+
+
+def fetch_analysis_base(client, cid, report_id):
+    # 差分再解析の基準にする最新レポート (report_data と生成時の条件) を返す。無ければ None
+    try:
+        res = (
+            client.table("ai_reports")
+            .select("report_data, created_at, prompt_version, grievance_count, last_grievance_at, incremental_depth")
+            .eq("company_id", cid)
+            .eq("report_type", report_id)
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+    except Exception as e:
+        # 差分再解析用の列が未マイグレーションの環境では常に全件から解析する
+        print(f"レポートキャッシュ参照エラー: {e}")
+        return None
+    return res.data[0] if res.data else None
+
+
+def lookup_report(client, lru, cid, fingerprint):
+    # モデルを呼ばずに取得できる結果を探す
+    # 戻り値: (JSONテキスト, 取得元 "memory" | "db") / 見つからなければ (None, None)
+    cached = lru.get(fingerprint)
+    if cached is not None:
+        return cached, "memory"
+
+    if cid:
+        stored = fetch_stored_report(client, cid, fingerprint)
+        if stored is not None:
+            json_text = json.dumps(stored, ensure_ascii=False)
+            lru.put(fingerprint, json_text)
+            return json_text, "db"
+    return None, None
+
+
+def get_or_generate(client, lru, cid, report_id, fingerprint, generate, refresh=False, strict_store=False):
+    # generate() はモデルを呼び出して (JSONテキスト, 保存時のメタデータ) を返す関数
+    # refresh=True の場合は保存済みの結果を使わずに必ず生成し直す
+    # strict_store=True の場合は ai_reports に保存できなければ ReportStoreError を送出する (ワーカー・一括生成用)
+    # False の場合は表示を優先し、エラーを出力して生成結果をそのまま返す
+    # 戻り値: (JSONテキスト, 取得元 "memory" | "db" | "model")
+    if not refresh:
+        json_text, source = lookup_report(client, lru, cid, fingerprint)
+        if json_text is not None:
+            return json_text, source
+
+    json_text, metadata = generate()
+
+    try:
+        json_data = json.loads(json_text)
+    except Exception as e:
+        # パースできない応答はキャッシュせず、そのまま表示側に渡す
+        print(f"レポートJSONパースエラー: {e}")
+        return json_text, "model"
+
+    if cid:
+        try:
+            store_report(client, cid, report_id, fingerprint, json_data, metadata)
+        except ReportStoreError as e:
+            if strict_store:
+                # 保存できなかった結果は LRU にも入れない (再試行時に保存済みと誤認しないため)
+                raise
+            print(e)
+    lru.put(fingerprint, json_text)
+    return json_text, "model"
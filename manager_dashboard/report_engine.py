@@ -0,0 +1,519 @@
+import contextvars
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from aggregates import aggregates_for_prompt, compute_aggregates
+from grievance_clusters import GrievanceClusterIndex
+from grievance_stats import parse_timestamp
+from report_cache import fetch_analysis_base, fetch_latest_report, get_or_generate, grievance_set_hash, lookup_report, report_fingerprint
+from tracing import span
+
+# ==========================================
+# AIレポート生成エンジン (Streamlitに依存しない部分)
+# ==========================================
+# 課題データの射影・プロンプト構築・モデル呼び出しを担当する。
+# 課題件数が多い場合はトークン予算ごとにバッチ化して部分要約を並列に作り (map)、
+# それらを最終的な ai_intro スキーマに統合する (reduce)。
+
+MODEL_NAME = "gemini-2.5-flash"
+
+# プロンプトを変更したら必ずバージョンを上げること (古いキャッシュが無効になる)
+PROMPT_VERSIONS = {
+    "ai_intro": "ai_intro-v4",
+}
+
+# プロンプトに渡す列 (UUIDやタイムスタンプはモデルの判断に不要なので送らない)
+PROMPT_FIELDS = ["category", "details", "stress_level"]
+
+# 1回のプロンプトに載せる課題データの上限 (概算トークン数)
+DEFAULT_TOKEN_BUDGET = 24000
+DEFAULT_MAP_CONCURRENCY = 4
+
+# 差分更新を何回まで重ねてよいか (超えたら全件から作り直し、要約の劣化が積み重ならないようにする)
+INCREMENTAL_MAX_DEPTH = 10
+
+AI_INTRO_INSTRUCTIONS = """
+あなたは、時給数万円のトップレベルDX・AIコンサルタントです。
+提供された「現場の不満（生の声）」の裏に潜む組織的なボトルネックを特定し、経営者が即座に予算承認できるレベルの、極めて詳細かつ重厚な「AI導入提案レポート」を作成してください。
+出力は以下のJSONフォーマットのみとし、各プロパティの指示（思考フレームワーク、文字数、必須項目）を絶対に厳守すること。
+"""
+
+AI_INTRO_SCHEMA = """
+{
+  "executive_summary": "(String) 組織の病巣と、AI導入による変革のビジョン。入力された具体的な不満を引用しながら、なぜ今、既存のやり方を捨ててAI投資が必要なのかを論理的かつ情熱的に説くこと。経営者の危機感と期待を煽るストーリー仕立てで、必ず800文字以上で記述せよ。",
+  "readiness_score": "(Integer, 0-100) 組織のアナログ度合いから算出する、AI導入による「投資対効果の出やすさ」。",
+  "chart_data": {
+    "manual_work": "(Integer 1-5) 手入力・転記作業の深刻度",
+    "communication": "(Integer 1-5) 連絡・確認待ちのロスの深刻度",
+    "knowledge_silo": "(Integer 1-5) ナレッジの属人化の深刻度",
+    "workflow": "(Integer 1-5) 承認フローの滞留の深刻度"
+  },
+  "ai_solutions": [
+    {
+      "title": "(String) 経営者の目を引く、具体的な導入案の名称（例：「社内規程RAG構築による問い合わせゼロ化」等）",
+      "current_pain_and_cause": "(String) 現場の不満を起点とし、ECRSの原則（排除・結合・交換・簡素化）を用いて現状の業務プロセスがなぜ破綻しているかを分析すること。（400文字以上）",
+      "tech_architecture": "(String) 推奨する具体的な技術スタック（例：Gemini 1.5 Pro, Dify, Supabase, OCR等）を挙げ、それが現場の業務フローにどう組み込まれるのか、データの流れと操作手順をエンジニアが実装できるレベルで詳細に解説すること。（500文字以上）",
+      "quantitative_roi": "(String) 削減される想定労働時間、平均的な人件費換算でのコストダウン金額（年額）、およびミスの削減率など、具体的な数値を交えた「シビアな投資対効果のシミュレーション」を提示すること。（400文字以上）"
+    },
+    { ...提案2... },
+    { ...提案3... }
+  ],
+  "earned_g_points": "(Integer) 今回の不満群から獲得した「Gポイント」（深刻度と解決時のインパクトに応じ100〜10000で算出）"
+}
+"""
+
+CLUSTERED_DATA_NOTICE = "データの各項目は、ほぼ同じ内容の投稿をまとめた代表例です。count はまとめた投稿の件数、stress_level はその平均です。件数の多い声ほど組織全体で共有されている課題として重視してください。"
+
+JSON_ONLY_NOTICE = "重要: 出力は純粋なJSONテキストのみとし、マークダウンブロック(`json `)などを含めないでください。JSONとしてそのままパース可能な形式にしてください。"
+
+
+def estimate_tokens(text):
+    # 日本語は概ね1文字=1トークン前後なので、文字数を保守的な概算値として使う
+    return len(text)
+
+
+def project_grievances(df, clusterer=None, cid=None):
+    # プロンプトに必要な列だけを残し、カテゴリ順に並べる (バッチ内の話題をまとめるため)
+    # ほぼ同じ内容の投稿は代表例1件にまとめる (count: 件数, stress_level: 平均)
+    # clusterer (GrievanceClusterer) を渡すと企業ごとの割り当てを再利用し、新しい投稿だけを追加で割り当てる
+    if "id" in df.columns and "details" in df.columns:
+        if clusterer is not None:
+            records = clusterer.cluster_records(cid, df)
+        else:
+            index = GrievanceClusterIndex()
+            index.add_frame(df)
+            records = index.summarize(df)
+        return sorted(records, key=lambda r: str(r["category"]))
+
+    cols = [c for c in PROMPT_FIELDS if c in df.columns]
+    projected = df[cols]
+    if "category" in cols:
+        projected = projected.sort_values("category", kind="stable")
+    # 欠損値は JSON の null として渡す
+    projected = projected.astype(object).where(projected.notna(), None)
+    return projected.to_dict(orient="records")
+
+
+def batch_by_token_budget(items, budget):
+    batches = []
+    current = []
+    used = 0
+    for item in items:
+        size = estimate_tokens(json.dumps(item, ensure_ascii=False)) + 1
+        if current and used + size > budget:
+            batches.append(current)
+            current = []
+            used = 0
+        current.append(item)
+        used += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def dataset_overview(df):
+    # 件数・平均・分布などの集計値はLLMに数えさせず、ローカルで計算して渡す
+    return aggregates_for_prompt(compute_aggregates(df))
+
+
+def build_ai_intro_prompt(records_json, overview):
+    # プロンプトの調整（Gポイント・重厚なDXコンサルタント形式）
+    return f"""{AI_INTRO_INSTRUCTIONS}{AI_INTRO_SCHEMA}
+全体統計 (ローカルで集計済みの正確な値。件数や平均はこちらを根拠とすること): 
+{json.dumps(overview, ensure_ascii=False)}
+
+{CLUSTERED_DATA_NOTICE}
+データ: 
+{records_json}
+
+{JSON_ONLY_NOTICE}
+"""
+
+
+# map段階のプロンプトだけに含まれる一文 (reduce のプロンプトは部分要約を埋め込むため、スキーマのキーでは区別できない)
+MAP_PROMPT_INSTRUCTIONS = "後段の経営向けレポート作成に必要な論点を漏れなく圧縮してください。"
+
+
+def build_map_prompt(items_json, source_label, data_notice=""):
+    return f"""
+あなたは組織課題の分析アシスタントです。
+以下の{source_label}を読み、{MAP_PROMPT_INSTRUCTIONS}
+出力は以下のJSONフォーマットのみとすること。
+
+{{
+  "grievance_count": "(Integer) 入力に含まれる課題の件数 (count の合計。部分要約の場合は各要約の件数の合計)",
+  "key_pains": [
+    {{
+      "category": "(String) 課題カテゴリ",
+      "summary": "(String) 共通するペインと根本原因の要約 (200文字以内)",
+      "representative_quotes": ["(String) 代表的な生の声をそのまま引用 (最大3件)"],
+      "occurrences": "(Integer) 該当する課題の件数 (count の合計)",
+      "severity": "(Integer 1-10) 平均的な深刻度"
+    }}
+  ],
+  "pain_signals": {{
+    "manual_work": "(Integer 1-5) 手入力・転記作業の深刻度",
+    "communication": "(Integer 1-5) 連絡・確認待ちのロスの深刻度",
+    "knowledge_silo": "(Integer 1-5) ナレッジの属人化の深刻度",
+    "workflow": "(Integer 1-5) 承認フローの滞留の深刻度"
+  }}
+}}
+
+{data_notice}
+入力: 
+{items_json}
+
+{JSON_ONLY_NOTICE}
+"""
+
+
+def build_reduce_prompt(partials_json, overview):
+    return f"""{AI_INTRO_INSTRUCTIONS}
+入力は、全ての「現場の不満（生の声）」をバッチごとに要約した部分分析結果と、ローカルで集計した全体統計です。
+各部分分析の key_pains・representative_quotes・pain_signals を統合し、組織全体としての結論を導いてください。
+{AI_INTRO_SCHEMA}
+全体統計: 
+{json.dumps(overview, ensure_ascii=False)}
+
+部分分析: 
+{partials_json}
+
+{JSON_ONLY_NOTICE}
+"""
+
+
+def build_incremental_prompt(previous_json, records_json, overview, new_count):
+    return f"""{AI_INTRO_INSTRUCTIONS}
+入力は、前回作成した同じ企業のレポート (JSON) と、その後に新しく寄せられた{new_count}件の「現場の不満（生の声）」、およびローカルで集計した最新の全体統計です。
+前回のレポートを土台に、新しい声で裏付けられた論点は強化し、新たに浮上した課題は追加し、全体統計と矛盾する記述は修正して、更新版のレポートを作成してください。
+新しい声が少ない場合でも、前回の分析内容を不必要に削らないこと。
+{AI_INTRO_SCHEMA}
+全体統計 (ローカルで集計済みの正確な値。件数や平均はこちらを根拠とすること): 
+{json.dumps(overview, ensure_ascii=False)}
+
+前回のレポート: 
+{previous_json}
+
+{CLUSTERED_DATA_NOTICE}
+新しく寄せられた声: 
+{records_json}
+
+{JSON_ONLY_NOTICE}
+"""
+
+
+def _usage_attributes(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return {}
+    return {
+        "prompt_tokens": getattr(usage, "prompt_token_count", None),
+        "response_tokens": getattr(usage, "candidates_token_count", None),
+    }
+
+
+def gemini_generate(prompt):
+    # genai.configure() は呼び出し側で済ませておくこと
+    # google.generativeai は読み込みが重いため、実際にモデルを呼ぶときだけ読み込む
+    import google.generativeai as genai
+    with span("gemini.generate_content", model=MODEL_NAME, prompt_chars=len(prompt)) as s:
+        model = genai.GenerativeModel(MODEL_NAME)
+        response = model.generate_content(
+            prompt,
+            generation_config=genai.types.GenerationConfig(
+                response_mime_type="application/json"
+            )
+        )
+        s.set(response_chars=len(response.text), **_usage_attributes(response))
+        return response.text
+
+
+def gemini_generate_stream(prompt):
+    # 応答をチャンク単位で返すジェネレータ
+    import google.generativeai as genai
+    with span("gemini.generate_content_stream", model=MODEL_NAME, prompt_chars=len(prompt)) as s:
+        model = genai.GenerativeModel(MODEL_NAME)
+        response = model.generate_content(
+            prompt,
+            generation_config=genai.types.GenerationConfig(
+                response_mime_type="application/json"
+            ),
+            stream=True
+        )
+        first_chunk_ns = None
+        response_chars = 0
+        for chunk in response:
+            if first_chunk_ns is None:
+                first_chunk_ns = time.time_ns()
+                s.set(time_to_first_chunk_ms=round((first_chunk_ns - s.start_ns) / 1e6, 1))
+            response_chars += len(chunk.text)
+            yield chunk.text
+        s.set(response_chars=response_chars, **_usage_attributes(response))
+
+
+class StreamInterruptedError(Exception):
+    # 一部のチャンクを渡した後に失敗した (表示側が途中まで描画済みなので再試行しない)
+    pass
+
+
+def streaming_caller(stream_model, on_chunk):
+    # ストリーミング応答を on_chunk に逐次渡しつつ、最後に全文を返す call_model を作る
+    def call(prompt):
+        parts = []
+        try:
+            for text in stream_model(prompt):
+                parts.append(text)
+                on_chunk(text)
+        except Exception as e:
+            if parts:
+                raise StreamInterruptedError(f"応答の受信中に失敗しました: {e}") from e
+            raise
+        return "".join(parts)
+    return call
+
+
+def _map_stage(items, source_label, call_model, token_budget, max_workers, data_notice=""):
+    batches = batch_by_token_budget(items, token_budget)
+    prompts = [build_map_prompt(json.dumps(b, ensure_ascii=False), source_label, data_notice) for b in batches]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report-map") as executor:
+        # 計測の trace を引き継ぐため、呼び出し元のコンテキストで実行する
+        futures = [executor.submit(contextvars.copy_context().run, call_model, p) for p in prompts]
+        results = [f.result() for f in futures]
+
+    partials = []
+    for text in results:
+        try:
+            partials.append(json.loads(text))
+        except Exception as e:
+            # 1バッチの失敗でレポート全体を落とさず、生テキストとして後段に渡す
+            print(f"部分要約のJSONパースエラー: {e}")
+            partials.append({"raw_summary": text})
+    return partials
+
+
+def generate_ai_intro_json(df, call_model=gemini_generate, token_budget=DEFAULT_TOKEN_BUDGET, max_workers=DEFAULT_MAP_CONCURRENCY, final_model=None, clusterer=None, cid=None):
+    # ai_intro レポートのJSONテキストを返す
+    # final_model: 最終出力を生成する呼び出しだけに使う関数 (ストリーミング表示用)。省略時は call_model
+    final_model = final_model or call_model
+    with span("report.cluster_grievances", grievances=len(df)) as s:
+        records = project_grievances(df, clusterer=clusterer, cid=cid)
+        s.set(clusters=len(records))
+    records_json = json.dumps(records, ensure_ascii=False)
+    overview = dataset_overview(df)
+
+    # 予算内に収まる場合は従来通り1回の呼び出しで済ませる
+    if estimate_tokens(records_json) <= token_budget:
+        return final_model(build_ai_intro_prompt(records_json, overview))
+
+    partials = _map_stage(records, "従業員から寄せられた「現場の不満（生の声）」", call_model, token_budget, max_workers, CLUSTERED_DATA_NOTICE)
+
+    # 部分要約自体が予算を超える場合は、収まるまで要約同士をさらに統合する
+    while len(partials) > 1 and estimate_tokens(json.dumps(partials, ensure_ascii=False)) > token_budget:
+        merged = _map_stage(partials, "部分分析結果 (複数バッチの要約)", call_model, token_budget, max_workers)
+        if len(merged) >= len(partials):
+            # これ以上縮約できない (1件ごとに予算を超えている) 場合はそのまま reduce に進む
+            break
+        partials = merged
+
+    return final_model(build_reduce_prompt(json.dumps(partials, ensure_ascii=False), overview))
+
+
+def latest_created_at(df):
+    if df.empty or "created_at" not in df.columns:
+        return None
+    return pd.to_datetime(df["created_at"], utc=True, errors="coerce", format="ISO8601").max()
+
+
+def plan_incremental_update(base, report_id, df, token_budget=DEFAULT_TOKEN_BUDGET):
+    # 前回のレポートに新着課題だけを足して更新できるかを判定する
+    # 戻り値: (前回の report_data, 新着課題の DataFrame) / 全件から解析すべき場合は None
+    if not base or base.get("prompt_version") != PROMPT_VERSIONS[report_id]:
+        return None
+    if (base.get("incremental_depth") or 0) >= INCREMENTAL_MAX_DEPTH:
+        return None
+    since = parse_timestamp(base.get("last_grievance_at") or base.get("created_at"))
+    if since is None or df.empty:
+        return None
+
+    created = pd.to_datetime(df["created_at"], utc=True, errors="coerce", format="ISO8601")
+    new_df = df.loc[created > since]
+    # 前回以降に削除された課題がある場合や、新着が無いのに指紋が変わった場合は差分では正しく更新できない
+    if new_df.empty or (base.get("grievance_count") is not None and len(df) - len(new_df) != base["grievance_count"]):
+        return None
+    # 新着が1回の呼び出しに収まらないほど多い場合は、全件から map-reduce で作り直す
+    if estimate_tokens(json.dumps(project_grievances(new_df), ensure_ascii=False)) > token_budget:
+        return None
+    return base["report_data"], new_df
+
+
+def generate_ai_intro_update_json(previous, new_df, df, call_model=gemini_generate, final_model=None, clusterer=None, cid=None):
+    # 前回の report_data と新着課題だけからレポートを更新する
+    final_model = final_model or call_model
+    with span("report.cluster_grievances", grievances=len(new_df), incremental=True) as s:
+        records = project_grievances(new_df, clusterer=clusterer, cid=cid)
+        s.set(clusters=len(records))
+    return final_model(build_incremental_prompt(
+        json.dumps(previous, ensure_ascii=False),
+        json.dumps(records, ensure_ascii=False),
+        dataset_overview(df),
+        len(new_df),
+    ))
+
+
+def analyze_ai_intro(client, cid, report_id, df, call_model=gemini_generate, final_model=None, clusterer=None, full_refresh=False, incremental=True):
+    # 前回のレポートがあれば新着課題だけで更新し、無ければ (または full_refresh なら) 全件から解析する
+    # incremental=False (期間を絞った解析) の場合は前回のレポートを使わず、常に df 全体から解析する
+    # 戻り値: (JSONテキスト, ai_reports に保存するメタデータ)
+    base = None if full_refresh or not incremental or not cid else fetch_analysis_base(client, cid, report_id)
+    plan = plan_incremental_update(base, report_id, df)
+    with span("report.analyze", report_id=report_id, mode="incremental" if plan else "full") as s:
+        if plan:
+            previous, new_df = plan
+            s.set(new_grievances=len(new_df))
+            json_text = generate_ai_intro_update_json(previous, new_df, df, call_model=call_model, final_model=final_model, clusterer=clusterer, cid=cid)
+            depth = (base.get("incremental_depth") or 0) + 1
+        else:
+            json_text = generate_ai_intro_json(df, call_model=call_model, final_model=final_model, clusterer=clusterer, cid=cid)
+            depth = 0
+
+    last_at = latest_created_at(df)
+    return json_text, {
+        "prompt_version": PROMPT_VERSIONS[report_id],
+        "grievance_count": len(df),
+        "last_grievance_at": last_at.isoformat() if last_at is not None and not pd.isna(last_at) else None,
+        "incremental_depth": depth,
+    }
+
+
+def report_fingerprint_for(cid, report_id, df, stats=None):
+    return report_fingerprint(cid, report_id, PROMPT_VERSIONS[report_id], grievance_set_hash(df, stats))
+
+
+def report_type_for(report_id, window_key=None):
+    # 期間を絞ったレポートは ai_reports に 'ai_intro@<期間>' として保存し、全期間のレポート (差分更新の基準) と分ける
+    # window_key は analysis_windows の report_key (日付を含まない固定のキー)
+    return f"{report_id}@{window_key}" if window_key and window_key != "all" else report_id
+
+
+def generate_report_json(client, lru, cid, report_id, df, call_model=gemini_generate, final_model=None, gateway=None, clusterer=None, full_refresh=False, window_key=None, strict_store=False, stats=None):
+    # キャッシュ (LRU -> ai_reports) に無い場合のみモデルを呼ぶ
+    # 前回のレポートがあれば新着課題だけで差分更新する (full_refresh=True なら保存済みの結果を使わず全件から解析し直す)
+    # gateway (GeminiGateway) を渡すと、同じ指紋の同時生成を1回にまとめ、モデル呼び出しを流量制限する
+    # clusterer (GrievanceClusterer) を渡すと、類似投稿のまとめ結果を企業ごとに再利用する
+    # window_key (analysis_windows の report_key) を渡すと、その期間の df だけを解析して期間ごとに保存する
+    # strict_store=True なら ai_reports に保存できなかったときに ReportStoreError を送出する (ワーカー・一括生成用)
+    # stats (grievance_stats の集計行) を渡すと、全期間の df の指紋を集計の件数・最終投稿日時から作る
+    # (指紋は課題セットから作るため、一度解析した期間は見比べるたびに保存済みの結果を再利用する)
+    # 戻り値: (JSONテキスト, 取得元 "memory" | "db" | "model" | "coalesced")
+    fingerprint = report_fingerprint_for(cid, report_id, df, stats)
+    report_type = report_type_for(report_id, window_key)
+    incremental = report_type == report_id
+    if gateway is None:
+        return get_or_generate(
+            client, lru, cid, report_type, fingerprint,
+            lambda: analyze_ai_intro(client, cid, report_id, df, call_model=call_model, final_model=final_model, clusterer=clusterer, full_refresh=full_refresh, incremental=incremental),
+            refresh=full_refresh, strict_store=strict_store
+        )
+
+    limited_call = gateway.limited(call_model)
+    limited_final = gateway.limited(final_model) if final_model else None
+    flight_key = f"{fingerprint}:full" if full_refresh else fingerprint
+    if strict_store:
+        # 保存の失敗を表示側で握りつぶす生成に相乗りしない (一括生成が保存できていない企業を完了扱いにしないため)
+        flight_key += ":strict"
+    (json_text, source), shared = gateway.coalesce(flight_key, lambda: get_or_generate(
+        client, lru, cid, report_type, fingerprint,
+        lambda: analyze_ai_intro(client, cid, report_id, df, call_model=limited_call, final_model=limited_final, clusterer=clusterer, full_refresh=full_refresh, incremental=incremental),
+        refresh=full_refresh, strict_store=strict_store
+    ))
+    return json_text, ("coalesced" if shared else source)
+
+
+def read_precomputed_report_json(client, lru, cid, report_id, df, window_key=None, stats=None):
+    # モデルを呼ばずに表示できる結果を返す
+    # 戻り値: (JSONテキスト or None, 最新の課題セットが未反映かどうか)
+    fingerprint = report_fingerprint_for(cid, report_id, df, stats)
+    json_text, _source = lookup_report(client, lru, cid, fingerprint)
+    if json_text is not None:
+        return json_text, False
+    latest, _created_at = fetch_latest_report(client, cid, report_type_for(report_id, window_key))
+    if latest is None:
+        return None, False
+    return json.dumps(latest, ensure_ascii=False), True
+
+
+def render_stars(score):
+    return f"`{'★' * score}{'☆' * (5 - score)}` ({score}/5)"
+
+
+def format_summary_section(data):
+    md = f"## 📊 Executive Summary\n"
+    md += f"> {data.get('executive_summary', '')}\n\n"
+    return md
+
+
+def format_index_section(data, g_points_default=0):
+    # 2カラムレイアウト風のスコア表示 (マークダウンテーブルを使用)
+    md = "---\n\n"
+    md += "### 🎯 組織の現状インデックス\n\n"
+    md += "| 指標 | スコア | 評価 |\n"
+    md += "| :--- | :---: | :--- |\n"
+    
+    readiness = data.get('readiness_score', 0)
+    readiness_eval = "高 (即時導入推奨)" if readiness >= 70 else ("中 (基盤整備が必要)" if readiness >= 40 else "低 (意識改革から)")
+    md += f"| **AI導入 Readiness Score** | `{readiness} / 100` | {readiness_eval} |\n"
+    md += f"| **蓄積された深刻度 (Gポイント)** | `{data.get('earned_g_points', g_points_default)} Gpt` | 組織の不満の総量 |\n\n"
+    
+    md += "### 📉 課題別 ペイン・インジケーター (ECRS分析起点)\n"
+    charts = data.get('chart_data', {})
+    md += f"- **手入力・転記作業の疲弊**: {render_stars(charts.get('manual_work', 0))}\n"
+    md += f"- **連絡・確認待ちのタイムロス**: {render_stars(charts.get('communication', 0))}\n"
+    md += f"- **ナレッジの属人化・ブラックボックス化**: {render_stars(charts.get('knowledge_silo', 0))}\n"
+    md += f"- **承認フローの滞留・サイロ化**: {render_stars(charts.get('workflow', 0))}\n\n"
+    return md
+
+
+def format_solution_section(idx, sol):
+    md = ""
+    if idx > 0:
+        md += "<br><hr><br>\n\n"
+    md += f"### 【提案 {idx+1}】 {sol.get('title', '')}\n\n"
+    
+    md += f"#### 🔍 現状のペインと根本原因\n"
+    md += f"{sol.get('current_pain_and_cause', '')}\n\n"
+    
+    md += f"#### ⚙️ 推奨技術アーキテクチャ\n"
+    md += f"{sol.get('tech_architecture', '')}\n\n"
+    
+    md += f"#### 💰 定量的ROIシミュレーション\n"
+    md += f"> **想定インパクト:**\n> {sol.get('quantitative_roi', '')}\n\n"
+    return md
+
+
+def format_ai_intro_markdown(data, partial=False):
+    # partial=True の場合はストリーミング途中のデータとして、確定済みのセクションだけを組み立てる
+    md = ""
+    if not partial or "executive_summary" in data:
+        md += format_summary_section(data)
+    if not partial or ("readiness_score" in data and "chart_data" in data):
+        md += format_index_section(data, g_points_default="集計中" if partial else 0)
+
+    solutions = data.get('ai_solutions', [])
+    if not partial or solutions:
+        md += "---\n\n"
+        md += "## 💡 具体的なDX/AI 導入プラン (ROI最適化)\n\n"
+        for idx, sol in enumerate(solutions):
+            md += format_solution_section(idx, sol)
+    return md
+
+
+def format_ai_intro_report(json_str):
+    try:
+        with span("report.format", report_id="ai_intro", json_chars=len(json_str)):
+            data = json.loads(json_str)
+            return format_ai_intro_markdown(data)
+    except Exception as e:
+        return f"レポートの表示フォーマット構築に失敗しました。\nエラー詳細: {e}\n\n生データ:\n```json\n{json_str}\n```"
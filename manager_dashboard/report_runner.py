@@ -0,0 +1,58 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# ==========================================
+# レポート生成の並列実行
+# ==========================================
+# 各レポートの生成処理をスレッドプールで同時に走らせ、完了した順に結果を返す。
+# ダッシュボード全体の待ち時間は「全レポートの合計」ではなく「最も遅い1本」に近づく。
+
+
+class ReportTimeoutError(Exception):
+    pass
+
+
+def run_concurrently(jobs, max_workers=4, timeout=120, initializer=None, on_tick=None, tick_interval=0.2):
+    # jobs: {key: 引数なしの関数}
+    # 完了順に (key, 結果, 例外) をyieldする。timeout は各ジョブの実行開始からの秒数。
+    # on_tick: 待機中に tick_interval 秒ごとに呼び出し元スレッドで実行される関数 (途中経過の表示用)
+    started = {}
+
+    def wrap(key, fn):
+        def run():
+            started[key] = time.monotonic()
+            return fn()
+        return run
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report", initializer=initializer)
+    try:
+        # 呼び出し元の contextvars (計測の trace 等) を各ジョブに引き継ぐ
+        futures = {executor.submit(contextvars.copy_context().run, wrap(key, fn)): key for key, fn in jobs.items()}
+        pending = set(futures)
+        while pending:
+            # 実行中ジョブのうち最も早く期限を迎えるものまで待つ
+            now = time.monotonic()
+            deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+            wait_for = max(0, min(deadlines) - now) if deadlines else timeout
+            if on_tick is not None:
+                wait_for = min(wait_for, tick_interval)
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            if on_tick is not None:
+                on_tick()
+
+            for f in done:
+                key = futures[f]
+                try:
+                    yield key, f.result(), None
+                except Exception as e:
+                    yield key, None, e
+
+            now = time.monotonic()
+            expired = {f for f in pending if futures[f] in started and now - started[futures[f]] >= timeout}
+            for f in expired:
+                # スレッドは強制停止できないため、結果を待たずに打ち切る (完了後のキャッシュ保存はそのまま行われる)
+                yield futures[f], None, ReportTimeoutError(f"{timeout}秒以内に生成が完了しませんでした")
+            pending -= expired
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
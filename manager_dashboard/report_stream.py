@@ -0,0 +1,93 @@
+import json
+
+# ==========================================
+# ai_intro JSON のストリーミング解析
+# ==========================================
+# モデルから断片的に届くJSONテキストを逐次読み込み、完成したセクションから順に取り出す。
+# - トップレベルのプロパティ (executive_summary, readiness_score 等) は値が閉じた時点で確定
+# - ai_solutions は配列の要素 (提案1件) が閉じるたびに確定
+# feed() の戻り値は新しく確定したセクションの一覧 [("field", key, value) | ("solution", index, dict)]
+
+
+class AiIntroStreamParser:
+    def __init__(self):
+        self.buffer = ""
+        self.data = {}
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+        self._in_solutions = False
+        self._element_start = None
+        self._solution_count = 0
+
+    def feed(self, text):
+        self.buffer += text
+        events = []
+        buf = self.buffer
+        while self._pos < len(buf):
+            i = self._pos
+            ch = buf[i]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 1 and ch == "{":
+                    self._member_start = i + 1
+                elif self._depth == 2 and ch == "[":
+                    # トップレベルの ai_solutions 配列に入ったかどうか
+                    key_text = buf[self._member_start:i].strip()
+                    self._in_solutions = key_text.startswith('"ai_solutions"')
+                elif self._depth == 3 and ch == "{" and self._in_solutions:
+                    self._element_start = i
+            elif ch in "}]":
+                if self._depth == 3 and ch == "}" and self._in_solutions and self._element_start is not None:
+                    events.extend(self._emit_solution(buf[self._element_start:i + 1]))
+                    self._element_start = None
+                if self._depth == 2 and ch == "]":
+                    self._in_solutions = False
+                if self._depth == 1 and ch == "}":
+                    events.extend(self._emit_member(buf[self._member_start:i]))
+                    self._member_start = None
+                self._depth -= 1
+            elif ch == "," and self._depth == 1:
+                events.extend(self._emit_member(buf[self._member_start:i]))
+                self._member_start = i + 1
+        return events
+
+    def _emit_member(self, text):
+        if self._member_start is None or not text.strip():
+            return []
+        try:
+            member = json.loads("{" + text + "}")
+        except ValueError:
+            return []
+        events = []
+        for key, value in member.items():
+            self.data[key] = value
+            # 提案は要素単位で通知済みなので、配列全体は改めて通知しない
+            if key != "ai_solutions":
+                events.append(("field", key, value))
+        return events
+
+    def _emit_solution(self, text):
+        try:
+            solution = json.loads(text)
+        except ValueError:
+            return []
+        index = self._solution_count
+        self._solution_count += 1
+        self.data.setdefault("ai_solutions", []).append(solution)
+        return [("solution", index, solution)]
@@ -0,0 +1,227 @@
+import argparse
+import os
+import queue
+import random
+import threading
+import time
+
+from analysis_windows import PRECOMPUTED_WINDOWS, preset_window, window_report_is_stale
+from fake_gemini import FakeGemini
+from gemini_gateway import GeminiGateway
+from grievance_clusters import GrievanceClusterer
+from grievance_frames import DEFAULT_CACHE_BYTES, slice_window
+from grievance_loader import IncrementalGrievanceLoader
+from grievance_snapshots import GrievanceSnapshotStore
+from grievance_stats import fetch_all_grievance_stats, parse_timestamp
+from report_cache import ReportLRU
+from report_engine import gemini_generate, generate_report_json, report_type_for
+
+# ==========================================
+# AIレポートの事前計算ワーカー
+# ==========================================
+# Streamlit のリクエスト処理とは別プロセスで動き、課題が増えた企業のレポートを先回りして生成する。
+# ダッシュボードを REPORT_MODE=precomputed で動かすと、画面側は完成済みの結果を読むだけになる。
+#
+# 使い方:
+#   python report_worker.py --once                       # 更新が必要な企業を1回だけ処理
+#   python report_worker.py --interval 300               # 5分おきにポーリング
+#   python report_worker.py --company <company_id>       # 指定した企業だけを処理
+#   python report_worker.py --once --fake-gemini         # Geminiを使わずローカルで検証
+#   python report_worker.py --once --full                # 差分更新ではなく全件から解析し直す (プロンプト変更時など)
+#   python report_worker.py --once --windows 30d,quarter  # 全期間に加えて作成する期間 (既定: 30d,90d,quarter。"" で全期間のみ)
+#
+# ローカル検証時は `supabase start` で起動したローカルスタックを向ける:
+#   NEXT_PUBLIC_SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_SERVICE_ROLE_KEY=<ローカルのキー> python report_worker.py --once --fake-gemini
+
+PRECOMPUTED_REPORTS = ["ai_intro"]
+
+
+def create_worker_client():
+    # RLSを越えて全企業を読むため Service Role Key を使う
+    # (ダッシュボードからは process_company だけを使うので、CLI専用の依存はここで読み込む)
+    from dotenv import load_dotenv
+    from supabase import create_client
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    load_dotenv(os.path.join(current_dir, '..', '.env.local'))
+    url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL", "")
+    key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
+    if not url or not key:
+        raise SystemExit("NEXT_PUBLIC_SUPABASE_URL と SUPABASE_SERVICE_ROLE_KEY を設定してください")
+    return create_client(url, key)
+
+
+def latest_created_at(client, table, cid, report_id=None):
+    query = client.table(table).select("created_at").eq("company_id", cid)
+    if report_id:
+        query = query.eq("report_type", report_id)
+    res = query.order("created_at", desc=True).limit(1).execute()
+    return res.data[0]["created_at"] if res.data else None
+
+
+def find_stale_companies(client, report_id="ai_intro", windows=()):
+    # 最新の ai_reports より後に課題が投稿されている企業を返す
+    # windows を渡すと、期間ごとのレポートが古い企業も含める (直近N日は投稿が無くても1日1回。window_report_is_stale)
+    # 課題の最終投稿日時は grievance_stats から全企業分を1回で読む (未適用の環境では企業ごとに問い合わせる)
+    all_stats = fetch_all_grievance_stats(client)
+    res = client.table("companies").select("id").order("created_at").execute()
+    stale = []
+    for company in res.data:
+        cid = company["id"]
+        if all_stats is not None:
+            stats = all_stats.get(cid)
+            last_grievance = stats["last_submitted_at"] if stats else None
+        else:
+            last_grievance = parse_timestamp(latest_created_at(client, "grievances", cid))
+        if last_grievance is None:
+            continue
+        last_report = parse_timestamp(latest_created_at(client, "ai_reports", cid, report_id))
+        if last_report is None or last_grievance > last_report:
+            stale.append(cid)
+            continue
+        for window in windows:
+            last_window_report = parse_timestamp(latest_created_at(client, "ai_reports", cid, report_type_for(report_id, window["report_key"])))
+            if window_report_is_stale(window, last_grievance, last_window_report):
+                stale.append(cid)
+                break
+    return stale
+
+
+def process_company(client, loader, lru, cid, call_model, gateway=None, clusterer=None, full_refresh=False, windows=()):
+    # 1企業分の事前計算レポートを生成する (bulk_reports.py からも使う)
+    # ai_reports に保存できなかった場合は ReportStoreError を送出し、呼び出し元で失敗として扱う
+    # windows: 全期間に加えて作成する期間 (analysis_windows の期間。全期間のフレームから切り出して解析する)
+    # 戻り値: {"grievances": 課題件数, "sources": 取得元 (レポートごとにカンマ区切り)}
+    df = loader.load(client, cid, force=True)
+    if df.empty:
+        return {"grievances": 0, "sources": "skipped"}
+    sources = []
+    for report_id in PRECOMPUTED_REPORTS:
+        _json_text, source = generate_report_json(client, lru, cid, report_id, df, call_model=call_model, gateway=gateway, clusterer=clusterer, full_refresh=full_refresh, strict_store=True)
+        sources.append(source)
+        for window in windows:
+            window_df = slice_window(df, window["start"], window["end"])
+            if window_df.empty:
+                continue
+            _json_text, source = generate_report_json(client, lru, cid, report_id, window_df, call_model=call_model, gateway=gateway, clusterer=clusterer, full_refresh=full_refresh, window_key=window["report_key"], strict_store=True)
+            sources.append(f"{window['report_key']}:{source}")
+    return {"grievances": len(df), "sources": ",".join(sources)}
+
+
+class ReportJobQueue:
+    # 上限付きのジョブキューと固定数のワーカースレッド。失敗時は指数バックオフで再試行する。
+    def __init__(self, client, call_model, workers=2, maxsize=100, max_attempts=4, backoff_base=2.0, gateway=None, full_refresh=False, windows=PRECOMPUTED_WINDOWS):
+        self.client = client
+        self.call_model = call_model
+        self.gateway = gateway
+        self.full_refresh = full_refresh
+        self.windows = windows
+        self.clusterer = GrievanceClusterer()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.loader = IncrementalGrievanceLoader(refresh_interval=0, snapshot_store=GrievanceSnapshotStore(), max_bytes=DEFAULT_CACHE_BYTES)
+        self.lru = ReportLRU(maxsize=64)
+        self.results = {}
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"report-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, cid):
+        # 同じ企業が既にキューにあれば積まない。満杯なら False を返す (次回のポーリングで拾われる)
+        with self._lock:
+            if cid in self._queued:
+                return True
+            try:
+                self._queue.put_nowait(cid)
+            except queue.Full:
+                return False
+            self._queued.add(cid)
+            return True
+
+    def join(self):
+        self._queue.join()
+
+    def process(self, cid):
+        # 直近N日・今四半期は日付で変わるため、処理のたびに作り直す
+        result = process_company(
+            self.client, self.loader, self.lru, cid, self.call_model,
+            gateway=self.gateway, clusterer=self.clusterer, full_refresh=self.full_refresh,
+            windows=[preset_window(name) for name in self.windows]
+        )
+        return result["sources"]
+
+    def _run(self):
+        while True:
+            cid = self._queue.get()
+            with self._lock:
+                self._queued.discard(cid)
+            try:
+                for attempt in range(1, self.max_attempts + 1):
+                    try:
+                        self.results[cid] = self.process(cid)
+                        print(f"[worker] {cid}: {self.results[cid]}")
+                        break
+                    except Exception as e:
+                        if attempt == self.max_attempts:
+                            self.results[cid] = f"failed: {e}"
+                            print(f"[worker] {cid}: {attempt}回失敗したため諦めます: {e}")
+                            break
+                        delay = self.backoff_base * (2 ** (attempt - 1)) + random.uniform(0, 1)
+                        print(f"[worker] {cid}: 失敗 ({e})。{delay:.1f}秒後に再試行します")
+                        time.sleep(delay)
+            finally:
+                self._queue.task_done()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AIレポートの事前計算ワーカー")
+    parser.add_argument("--company", action="append", default=[], help="処理する企業ID (複数指定可)。省略時は更新が必要な企業を自動検出")
+    parser.add_argument("--once", action="store_true", help="1回処理して終了する")
+    parser.add_argument("--interval", type=float, default=300, help="ポーリング間隔(秒)")
+    parser.add_argument("--workers", type=int, default=2, help="同時に処理する企業数")
+    parser.add_argument("--queue-size", type=int, default=100, help="ジョブキューの上限")
+    parser.add_argument("--max-attempts", type=int, default=4, help="1企業あたりの最大試行回数")
+    parser.add_argument("--fake-gemini", action="store_true", help="Geminiの代わりにローカルのダミー応答を使う")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="--fake-gemini 使用時の応答遅延(秒)")
+    parser.add_argument("--full", action="store_true", help="前回のレポートからの差分更新ではなく、全件から解析し直す")
+    parser.add_argument("--windows", default=",".join(PRECOMPUTED_WINDOWS), help="全期間に加えてレポートを作成する期間 (30d, 90d, quarter, last_quarter のカンマ区切り)")
+    parser.add_argument("--rate-per-minute", type=float, default=60, help="Gemini呼び出しの上限(回/分)。0で制限なし")
+    args = parser.parse_args()
+    windows = [name.strip() for name in args.windows.split(",") if name.strip()]
+    for name in windows:
+        try:
+            preset_window(name)
+        except ValueError as e:
+            parser.error(str(e))
+
+    client = create_worker_client()
+    if args.fake_gemini:
+        call_model = FakeGemini(latency=args.fake_latency)
+    else:
+        api_key = os.environ.get("GEMINI_API_KEY", "")
+        if not api_key:
+            raise SystemExit("GEMINI_API_KEY を設定するか --fake-gemini を指定してください")
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        call_model = gemini_generate
+
+    gateway = GeminiGateway(rate_per_minute=args.rate_per_minute)
+    jobs = ReportJobQueue(client, call_model, workers=args.workers, maxsize=args.queue_size, max_attempts=args.max_attempts, gateway=gateway, full_refresh=args.full, windows=windows)
+    while True:
+        targets = args.company or find_stale_companies(client, windows=[preset_window(name) for name in windows])
+        for cid in targets:
+            if not jobs.submit(cid):
+                print(f"[worker] キューが満杯のため {cid} は次回に回します")
+        jobs.join()
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+
+# ==========================================
+# ダッシュボードの起動時間 (コールドスタート) の計測と予算チェック
+# ==========================================
+# app.py はログイン画面を出すまでに必要な軽いモジュールだけを先頭で読み込み、pandas・Gemini SDK・
+# レポート関連モジュールはログイン後、plotly はグラフ描画時に読み込む。
+# その分け方が崩れていないかを、新しいプロセスでの import 時間として計測する。
+# Streamlit が入っている環境では AppTest で初回実行・再実行 (ログイン画面) の所要時間も計測する。
+#
+# 使い方:
+#   python startup_budget.py
+#   python startup_budget.py --max-login-import-ms 800 --max-first-run-ms 2000 --json startup.json  # 超えたら終了コード1
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ログイン画面の表示までに読み込まれるモジュール
+LOGIN_MODULES = ["streamlit", "streamlit.components.v1", "dotenv", "tracing"]
+# ログイン後・必要になったときに読み込むモジュール
+DEFERRED_MODULES = [
+    "pandas", "supabase", "google.generativeai", "plotly.express", "pyarrow",
+    "report_engine", "pdf_renderer", "grievance_loader", "grievance_clusters", "bulk_reports",
+]
+
+
+def module_available(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+def measure_import(modules):
+    # 新しいプロセスで modules を順に読み込み、合計の所要時間(ms)を返す (他のテストの読み込み済みモジュールの影響を受けない)
+    code = (
+        "import sys, time\n"
+        f"sys.path.insert(0, {APP_DIR!r})\n"
+        "t = time.perf_counter()\n"
+        + "".join(f"import {m}\n" for m in modules)
+        + "print((time.perf_counter() - t) * 1000)\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=APP_DIR)
+    if out.returncode != 0:
+        return None
+    return round(float(out.stdout.strip().splitlines()[-1]), 1)
+
+
+def measure_app(reruns=3):
+    # AppTest でログイン画面までの初回実行と再実行を計測する (Streamlit が無い環境では None)
+    if not module_available("streamlit"):
+        return None
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(APP_DIR, "app.py"), default_timeout=60)
+    t = time.perf_counter()
+    at.run()
+    first_run_ms = (time.perf_counter() - t) * 1000
+    rerun_ms = []
+    for _ in range(reruns):
+        t = time.perf_counter()
+        at.run()
+        rerun_ms.append((time.perf_counter() - t) * 1000)
+    return {
+        "first_run_ms": round(first_run_ms, 1),
+        "rerun_ms": round(max(rerun_ms), 1),
+        "exceptions": [str(e.value) for e in at.exception],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ダッシュボードの起動時間の計測")
+    parser.add_argument("--reruns", type=int, default=3, help="AppTest での再実行回数")
+    parser.add_argument("--json", help="結果をJSONで書き出すパス")
+    parser.add_argument("--max-login-import-ms", type=float, help="ログイン画面までの import 時間がこの値を超えたら終了コード1")
+    parser.add_argument("--max-first-run-ms", type=float, help="初回実行がこの値を超えたら終了コード1")
+    parser.add_argument("--max-rerun-ms", type=float, help="再実行がこの値を超えたら終了コード1")
+    args = parser.parse_args()
+
+    result = {"imports": {}, "app": None}
+    login_modules = [m for m in LOGIN_MODULES if module_available(m.split(".")[0])]
+    result["login_import_ms"] = measure_import(login_modules)
+    print(f"{'ログイン画面までの import':<28} {result['login_import_ms']:>9} ms  ({', '.join(login_modules)})")
+    for name in DEFERRED_MODULES:
+        if not module_available(name.split(".")[0]) and not os.path.exists(os.path.join(APP_DIR, f"{name}.py")):
+            print(f"{name:<28} {'-':>9}     (未インストール)")
+            continue
+        result["imports"][name] = measure_import([name])
+        print(f"{name:<28} {result['imports'][name]:>9} ms")
+
+    result["app"] = measure_app(args.reruns)
+    if result["app"] is None:
+        print("Streamlit が見つからないため AppTest による計測をスキップします")
+    else:
+        app = result["app"]
+        print(f"{'初回実行 (ログイン画面)':<28} {app['first_run_ms']:>9} ms")
+        print(f"{'再実行 (最大)':<28} {app['rerun_ms']:>9} ms")
+        for error in app["exceptions"]:
+            print(f"  例外: {error}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    over = []
+    if args.max_login_import_ms is not None and (result["login_import_ms"] or 0) > args.max_login_import_ms:
+        over.append(f"ログイン画面までの import {result['login_import_ms']}ms > {args.max_login_import_ms}ms")
+    if result["app"] is not None:
+        if args.max_first_run_ms is not None and result["app"]["first_run_ms"] > args.max_first_run_ms:
+            over.append(f"初回実行 {result['app']['first_run_ms']}ms > {args.max_first_run_ms}ms")
+        if args.max_rerun_ms is not None and result["app"]["rerun_ms"] > args.max_rerun_ms:
+            over.append(f"再実行 {result['app']['rerun_ms']}ms > {args.max_rerun_ms}ms")
+    if over:
+        print("起動時間の予算を超えました: " + " / ".join(over))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
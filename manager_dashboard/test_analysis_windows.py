@@ -0,0 +1,60 @@
+from datetime import date, datetime, timezone
+
+import pytest
+
+from analysis_windows import custom_window, preset_window, quarter_window, rolling_window, window_report_is_stale
+
+TODAY = date(2024, 5, 10)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_quarter_is_bounded_by_jst_midnight():
+    window = quarter_window(2024, 4)
+    assert window["report_key"] == window["key"] == "2024q4"
+    assert window["start"] == "2024-09-30T15:00:00+00:00"
+    assert window["end"] == "2024-12-31T15:00:00+00:00"
+
+
+def test_rolling_report_key_does_not_change_with_the_date():
+    window = rolling_window(30, TODAY)
+    assert window["start"] == "2024-04-10T15:00:00+00:00"
+    assert window["end"] is None
+    assert window["report_key"] == rolling_window(30, date(2024, 5, 11))["report_key"] == "30d"
+    # 画面の状態は日付ごとに分ける
+    assert window["key"] != rolling_window(30, date(2024, 5, 11))["key"]
+
+
+def test_custom_window_includes_both_days_and_shares_a_report_key():
+    window = custom_window(date(2024, 3, 31), date(2024, 3, 1))
+    assert window["start"] == "2024-02-29T15:00:00+00:00"
+    assert window["end"] == "2024-03-31T15:00:00+00:00"
+    assert window["report_key"] == "custom"
+
+
+def test_preset_windows():
+    assert preset_window("all", TODAY)["start"] is None
+    assert preset_window("90d", TODAY)["report_key"] == "90d"
+    assert preset_window("quarter", TODAY)["key"] == "2024q2"
+    assert preset_window("last_quarter", date(2024, 2, 1))["key"] == "2023q4"
+    with pytest.raises(ValueError):
+        preset_window("custom", TODAY)
+
+
+def test_window_report_staleness():
+    quarter = quarter_window(2024, 1)
+    # 期間内に投稿が無ければ作らない
+    assert not window_report_is_stale(quarter, None, None)
+    assert not window_report_is_stale(quarter, utc(2023, 12, 1), None)
+    assert window_report_is_stale(quarter, utc(2024, 2, 1), None)
+    assert window_report_is_stale(quarter, utc(2024, 2, 1), utc(2024, 1, 15))
+    assert not window_report_is_stale(quarter, utc(2024, 2, 1), utc(2024, 2, 2))
+    # 期間の終了後に作ったレポートは、その後の投稿があっても作り直さない
+    assert not window_report_is_stale(quarter, utc(2024, 5, 1), utc(2024, 4, 2))
+
+    rolling = rolling_window(30, TODAY)
+    # 直近N日は投稿が無くても日付が変わったら作り直す
+    assert window_report_is_stale(rolling, utc(2024, 5, 1), utc(2024, 5, 9, 12), today=TODAY)
+    assert not window_report_is_stale(rolling, utc(2024, 5, 1), utc(2024, 5, 9, 16), today=TODAY)
@@ -0,0 +1,30 @@
+import json
+
+import pandas as pd
+
+from benchmark import generate_grievances
+from fake_gemini import FakeGemini
+from report_engine import MAP_PROMPT_INSTRUCTIONS, format_ai_intro_report, generate_ai_intro_json
+
+
+def test_map_reduce_returns_ai_intro():
+    # 予算を小さくして map -> reduce を必ず通す
+    df = pd.DataFrame(generate_grievances("company-a", 300))
+    model = FakeGemini()
+    prompts = []
+
+    def call_model(prompt):
+        prompts.append(prompt)
+        return model(prompt)
+
+    data = json.loads(generate_ai_intro_json(df, call_model=call_model, token_budget=4000, max_workers=2))
+
+    map_prompts = [p for p in prompts if MAP_PROMPT_INSTRUCTIONS in p]
+    assert len(map_prompts) >= 2
+    # 最後の呼び出しは部分要約を埋め込んだ reduce のプロンプト
+    assert MAP_PROMPT_INSTRUCTIONS not in prompts[-1]
+    assert '"grievance_count"' in prompts[-1]
+
+    assert "grievance_count" not in data
+    assert set(data) >= {"executive_summary", "readiness_score", "chart_data", "ai_solutions"}
+    assert "表示フォーマット構築に失敗" not in format_ai_intro_report(json.dumps(data, ensure_ascii=False))
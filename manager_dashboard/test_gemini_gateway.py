@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from gemini_gateway import GeminiGateway, GeminiUnavailableError, SingleFlight, TokenBucket
+
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate_per_minute=600, capacity=2)
+    assert bucket.acquire(timeout=0)
+    assert bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0)
+
+    # 10件/秒で補充されるため、約0.1秒待てば次のトークンが取れる
+    started = time.monotonic()
+    assert bucket.acquire(timeout=1)
+    assert 0.05 <= time.monotonic() - started < 0.5
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "結果"
+
+    def run():
+        results.append(flights.do("key", work))
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    threads[0].start()
+    while flights.inflight() == 0:
+        time.sleep(0.001)
+    for t in threads[1:]:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [("結果", False)] + [("結果", True)] * 3
+    assert flights.inflight() == 0
+    # 完了したキーは次の呼び出しで実行し直す
+    assert flights.do("key", lambda: "次") == ("次", False)
+
+
+def test_single_flight_releases_key_on_error():
+    flights = SingleFlight()
+    with pytest.raises(ValueError):
+        flights.do("key", lambda: (_ for _ in ()).throw(ValueError("失敗")))
+    assert flights.inflight() == 0
+
+
+def test_gateway_counts_coalesced_calls():
+    gateway = GeminiGateway(rate_per_minute=0)
+    release = threading.Event()
+
+    def work():
+        release.wait(5)
+        return "結果"
+
+    leader = threading.Thread(target=lambda: gateway.coalesce("fp", work))
+    leader.start()
+    while gateway.flights.inflight() == 0:
+        time.sleep(0.001)
+    follower_result = []
+    follower = threading.Thread(target=lambda: follower_result.append(gateway.coalesce("fp", lambda: "別の結果")))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert follower_result == [("結果", True)]
+    assert gateway.stats["coalesced"] == 1
+
+
+def test_gateway_rejects_when_rate_limit_is_exhausted():
+    gateway = GeminiGateway(rate_per_minute=1, burst=1, acquire_timeout=0)
+    limited = gateway.limited(lambda prompt: f"応答: {prompt}")
+
+    assert limited("1回目") == "応答: 1回目"
+    with pytest.raises(GeminiUnavailableError):
+        limited("2回目")
+    assert gateway.stats["calls"] == 1
+    assert gateway.stats["rejected"] == 1
+
+    queued = GeminiGateway(rate_per_minute=1, burst=1, max_waiting=0)
+    with pytest.raises(GeminiUnavailableError):
+        queued.call(lambda prompt: prompt, "待ち行列が上限")
@@ -0,0 +1,58 @@
+import pandas as pd
+
+from grievance_clusters import GrievanceClusterer, GrievanceClusterIndex, normalize_details
+
+
+def grievance_frame(rows):
+    return pd.DataFrame(rows, columns=["id", "category", "details", "stress_level"])
+
+
+def test_normalize_details_ignores_width_case_and_symbols():
+    assert normalize_details("ＰＣが　遅い！！") == normalize_details("pcが遅い")
+
+
+def test_near_duplicates_share_a_cluster_within_category():
+    index = GrievanceClusterIndex()
+    first = index.add("g1", "残業代が固定残業を超えても支払われないのが不満です。", "workload")
+    again = index.add("g2", "残業代が固定残業を超えても支払われないのが不満です！！", "workload")
+    other = index.add("g3", "オフィスの空調が古くて夏は暑く、冬は寒いです。", "workload")
+    # 本文が同じでもカテゴリが違えば別のクラスタにする
+    elsewhere = index.add("g4", "残業代が固定残業を超えても支払われないのが不満です。", "human_relations")
+
+    assert first == again
+    assert len({first, other, elsewhere}) == 3
+    # 割り当て済みの課題はそのまま返す
+    assert index.add("g2", "全く別の内容", "workload") == first
+
+
+def test_add_frame_assigns_only_new_rows():
+    index = GrievanceClusterIndex()
+    df = grievance_frame([
+        ("g1", "workload", "会議ばかりで実働時間が確保できません。", 6),
+        ("g2", "workload", "会議ばかりで実働時間が確保できません", 8),
+    ])
+    assert index.add_frame(df) == 2
+    before = dict(index.assignments)
+
+    df = pd.concat([df, grievance_frame([("g3", "equipment", "パソコンが5年前のスペックでフリーズが多いです。", 4)])], ignore_index=True)
+    assert index.add_frame(df) == 1
+    assert {gid: index.assignments[gid] for gid in before} == before
+
+
+def test_summarize_counts_and_averages_per_cluster():
+    clusterer = GrievanceClusterer()
+    df = grievance_frame([
+        ("g1", "workload", "会議ばかりで実働時間が確保できません。", 6),
+        ("g2", "workload", "会議ばかりで実働時間が確保できません!", 8),
+        ("g3", "equipment", "パソコンが5年前のスペックでフリーズが多いです。", 4),
+    ])
+    records = clusterer.cluster_records("company-a", df)
+
+    assert [r["count"] for r in records] == [2, 1]
+    assert records[0]["stress_level"] == 7.0
+    assert records[0]["details"] == "会議ばかりで実働時間が確保できません。"
+
+    # 代表例が含まれない期間のフレームでも、その中のメンバーを代表にする
+    window = clusterer.cluster_records("company-a", df.iloc[1:])
+    assert window[0]["details"] == "会議ばかりで実働時間が確保できません!"
+    assert sum(r["count"] for r in window) == 2
@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, timezone
+
+from benchmark import generate_grievances
+from grievance_loader import WATERMARK_OVERLAP_SECONDS, IncrementalGrievanceLoader
+from grievance_stats import parse_timestamp
+from local_supabase import LocalSupabase
+
+CID = "company-a"
+
+
+def seeded_client(n=50):
+    client = LocalSupabase()
+    rows = generate_grievances(CID, n)
+    client.seed("grievances", rows)
+    return client, rows
+
+
+def grievance_row(gid, created_at):
+    return {
+        "id": gid, "company_id": CID, "user_id": "user-1", "category": "workload",
+        "details": f"追加の投稿 {gid}", "stress_level": 5, "created_at": created_at.isoformat(),
+    }
+
+
+def stats_for(rows):
+    return {
+        "total_count": len(rows),
+        "last_submitted_at": max(parse_timestamp(r["created_at"]) for r in rows) if rows else None,
+    }
+
+
+def test_refresh_rereads_overlap_and_drops_duplicates():
+    client, rows = seeded_client()
+    loader = IncrementalGrievanceLoader(page_size=20)
+    assert len(loader.load(client, CID)) == len(rows)
+
+    # ウォーターマークの直前にコミットされた行 (巻き戻し幅の内側) も取りこぼさない
+    last = parse_timestamp(rows[-1]["created_at"])
+    late = grievance_row("late", last - timedelta(seconds=WATERMARK_OVERLAP_SECONDS - 1))
+    newer = grievance_row("newer", last + timedelta(minutes=1))
+    client.seed("grievances", [late, newer])
+    client.reset_counters()
+
+    frame = loader.load(client, CID, force=True)
+    assert len(frame) == len(rows) + 2
+    assert frame["id"].is_unique
+    # 新着分だけを取得する (全件は取り直さない)
+    assert client.requests == 1
+
+
+def test_matching_stats_skip_the_query():
+    client, rows = seeded_client()
+    loader = IncrementalGrievanceLoader()
+    loader.load(client, CID, stats=stats_for(rows))
+    client.reset_counters()
+
+    loader.load(client, CID, stats=stats_for(rows))
+    assert client.requests == 0
+
+
+def test_rows_newer_than_stats_are_not_taken_for_deletions():
+    client, rows = seeded_client()
+    loader = IncrementalGrievanceLoader()
+    stale = stats_for(rows)
+    newer = grievance_row("newer", stale["last_submitted_at"] + timedelta(minutes=1))
+    client.seed("grievances", [newer])
+    loader.load(client, CID, force=True)
+    client.reset_counters()
+
+    # 集計を読んだ後に届いた新着は、集計より件数が多くても削除とみなさない
+    frame = loader.load(client, CID, stats=stale)
+    assert client.requests == 0
+    assert len(frame) == len(rows) + 1
+
+
+def test_deletion_in_stats_triggers_full_reload():
+    client, rows = seeded_client()
+    loader = IncrementalGrievanceLoader()
+    loader.load(client, CID, stats=stats_for(rows))
+
+    deleted = rows[10]["id"]
+    client.tables["grievances"] = [r for r in client.tables["grievances"] if r["id"] != deleted]
+    remaining = [r for r in rows if r["id"] != deleted]
+    frame = loader.load(client, CID, stats=stats_for(remaining))
+
+    assert len(frame) == len(remaining)
+    assert deleted not in set(frame["id"])
+
+
+def test_closed_window_is_fetched_once():
+    client, rows = seeded_client(100)
+    loader = IncrementalGrievanceLoader()
+    start, end = "2024-02-01T00:00:00+00:00", "2024-03-01T00:00:00+00:00"
+    expected = [r for r in rows if start <= r["created_at"] < end]
+
+    frame = loader.load_window(client, CID, start, end)
+    assert sorted(frame["id"]) == sorted(r["id"] for r in expected)
+    client.reset_counters()
+
+    # 終了日時を過ぎた期間は新着を確認しない
+    assert len(loader.load_window(client, CID, start, end, stats=stats_for(rows))) == len(expected)
+    assert client.requests == 0
+
+
+def test_window_is_sliced_from_the_full_frame():
+    client, rows = seeded_client(100)
+    loader = IncrementalGrievanceLoader()
+    loader.load(client, CID)
+    client.reset_counters()
+
+    start = "2024-06-01T00:00:00+00:00"
+    frame = loader.load_window(client, CID, start, None, stats=stats_for(rows))
+    assert len(frame) == sum(r["created_at"] >= start for r in rows)
+    assert client.requests == 0
+
+
+def test_live_mode_fetches_only_after_notification():
+    client, rows = seeded_client()
+    loader = IncrementalGrievanceLoader()
+    loader.load(client, CID, live=True)
+    client.reset_counters()
+
+    loader.load(client, CID, live=True)
+    assert client.requests == 0
+
+    client.seed("grievances", [grievance_row("notified", datetime.now(timezone.utc))])
+    loader.notify_change({"op": "INSERT", "company_id": CID})
+    frame = loader.load(client, CID, live=True)
+    assert client.requests == 1
+    assert "notified" in set(frame["id"])
+
+    # 削除は差分取得では反映できないため、保持中のフレームを捨てて取り直す
+    client.tables["grievances"] = [r for r in client.tables["grievances"] if r["id"] != "notified"]
+    loader.notify_change({"op": "DELETE", "company_id": CID})
+    assert len(loader.load(client, CID, live=True)) == len(rows)
@@ -0,0 +1,74 @@
+import pandas as pd
+
+import grievance_snapshots
+from benchmark import generate_grievances
+from grievance_frames import compact_grievances
+from grievance_loader import IncrementalGrievanceLoader
+from grievance_snapshots import GrievanceSnapshotStore
+from local_supabase import LocalSupabase
+
+CID = "company-a"
+
+
+def compact_frame(n=100):
+    return compact_grievances(pd.DataFrame(generate_grievances(CID, n)))
+
+
+def test_round_trip_keeps_types_and_watermark(tmp_path):
+    store = GrievanceSnapshotStore(str(tmp_path))
+    frame = compact_frame()
+    watermark = ("2024-12-30T00:00:00+00:00", "last-id")
+    store.save(CID, frame, watermark)
+
+    restored, restored_watermark = store.load(CID)
+    pd.testing.assert_frame_equal(restored, frame)
+    assert restored_watermark == watermark
+    # 型を詰めた状態のまま読めるため、変換 (複製) せずにそのまま使う
+    assert compact_grievances(restored) is restored
+    assert store.footprint() > 0
+
+
+def test_missing_stress_levels_round_trip(tmp_path):
+    store = GrievanceSnapshotStore(str(tmp_path))
+    rows = generate_grievances(CID, 10)
+    rows[3]["stress_level"] = None
+    frame = compact_grievances(pd.DataFrame(rows))
+    store.save(CID, frame, None)
+
+    restored, watermark = store.load(CID)
+    pd.testing.assert_frame_equal(restored, frame)
+    assert watermark is None
+
+
+def test_old_format_is_discarded(tmp_path, monkeypatch):
+    store = GrievanceSnapshotStore(str(tmp_path))
+    monkeypatch.setattr(grievance_snapshots, "SNAPSHOT_FORMAT", "grievances-old")
+    store.save(CID, compact_frame(), None)
+    monkeypatch.undo()
+
+    assert store.load(CID) is None
+    assert not (tmp_path / f"{CID}.arrow").exists()
+
+
+def test_corrupt_file_is_discarded(tmp_path):
+    store = GrievanceSnapshotStore(str(tmp_path))
+    (tmp_path / f"{CID}.arrow").write_bytes(b"not an arrow file")
+    assert store.load(CID) is None
+    assert store.footprint() == 0
+
+
+def test_loader_resumes_from_snapshot(tmp_path):
+    client = LocalSupabase()
+    rows = generate_grievances(CID, 200)
+    client.seed("grievances", rows[:150])
+    store = GrievanceSnapshotStore(str(tmp_path))
+    IncrementalGrievanceLoader(snapshot_store=store).load(client, CID)
+
+    # 再起動後のプロセスはスナップショットから復元し、新着だけを取得する
+    client.seed("grievances", rows[150:])
+    client.reset_counters()
+    frame = IncrementalGrievanceLoader(snapshot_store=store).load(client, CID)
+    assert sorted(frame["id"]) == sorted(r["id"] for r in rows)
+    assert client.requests == 1
+    assert client.bytes_fetched < len(str(rows[140:]).encode("utf-8"))
+    assert len(store.load(CID)[0]) == len(rows)
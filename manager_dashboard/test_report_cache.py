@@ -0,0 +1,83 @@
+import json
+
+import pandas as pd
+import pytest
+
+from benchmark import generate_grievances
+from grievance_frames import compact_grievances
+from grievance_stats import parse_timestamp
+from local_supabase import LocalSupabase
+from report_cache import ReportLRU, ReportStoreError, get_or_generate, grievance_set_hash
+
+CID = "company-a"
+
+
+class RejectingSupabase(LocalSupabase):
+    # RLS で INSERT が許可されていないクライアントの代わり
+    def _execute_locked(self, query):
+        if query._op == "insert":
+            self.requests += 1
+            raise RuntimeError("new row violates row-level security policy")
+        return super()._execute_locked(query)
+
+
+def test_grievance_set_hash_matches_stats_and_frame():
+    rows = generate_grievances(CID, 200)
+    raw = pd.DataFrame(rows)
+    stats = {"total_count": len(rows), "last_submitted_at": parse_timestamp(rows[-1]["created_at"])}
+
+    digest = grievance_set_hash(compact_grievances(raw), stats)
+    # 集計・型を詰めたフレーム・文字列のままのフレームのどれから求めても同じ指紋になる
+    assert digest == grievance_set_hash(compact_grievances(raw))
+    assert digest == grievance_set_hash(raw)
+    # 件数か最終投稿日時が変われば指紋も変わる
+    assert digest != grievance_set_hash(raw.iloc[:-1])
+    assert digest != grievance_set_hash(raw.iloc[1:])
+    assert grievance_set_hash(raw.iloc[:0]) == "empty"
+
+
+def test_stats_for_another_set_are_ignored():
+    rows = generate_grievances(CID, 50)
+    window = pd.DataFrame(rows[:20])
+    stats = {"total_count": len(rows), "last_submitted_at": parse_timestamp(rows[-1]["created_at"])}
+    # 件数が一致しない (期間で絞った) フレームは集計を使わずにフレームから求める
+    assert grievance_set_hash(window, stats) == grievance_set_hash(window)
+
+
+def test_get_or_generate_reads_memory_then_db():
+    client = LocalSupabase()
+    lru = ReportLRU()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return json.dumps({"executive_summary": "要約"}), {"prompt_version": "v1"}
+
+    assert get_or_generate(client, lru, CID, "ai_intro", "fp-1", generate)[1] == "model"
+    assert get_or_generate(client, lru, CID, "ai_intro", "fp-1", generate)[1] == "memory"
+    # 別プロセス (LRU が空) でも ai_reports に保存済みの結果を使う
+    json_text, source = get_or_generate(client, ReportLRU(), CID, "ai_intro", "fp-1", generate)
+    assert source == "db"
+    assert json.loads(json_text) == {"executive_summary": "要約"}
+    assert len(calls) == 1
+
+    assert get_or_generate(client, lru, CID, "ai_intro", "fp-1", generate, refresh=True)[1] == "model"
+    assert len(calls) == 2
+    assert client.tables["ai_reports"][0]["prompt_version"] == "v1"
+
+
+def test_store_failure_raises_only_when_strict():
+    client = RejectingSupabase()
+    lru = ReportLRU()
+
+    def generate():
+        return json.dumps({"executive_summary": "要約"}), {"prompt_version": "v1"}
+
+    # 表示用の生成は保存に失敗しても結果を返す
+    assert get_or_generate(client, lru, CID, "ai_intro", "fp-1", generate)[1] == "model"
+
+    lru = ReportLRU()
+    with pytest.raises(ReportStoreError):
+        get_or_generate(client, lru, CID, "ai_intro", "fp-2", generate, strict_store=True)
+    # 保存できなかった結果は LRU にも残さない
+    assert lru.get("fp-2") is None
@@ -0,0 +1,99 @@
+import json
+
+import pandas as pd
+
+from benchmark import generate_grievances
+from fake_gemini import FakeGemini
+from local_supabase import LocalSupabase
+from report_cache import ReportLRU
+from report_engine import INCREMENTAL_MAX_DEPTH, PROMPT_VERSIONS, generate_report_json, plan_incremental_update, report_type_for
+
+CID = "company-a"
+
+
+def base_for(df, **overrides):
+    last = pd.to_datetime(df["created_at"], utc=True, format="ISO8601").max()
+    return {
+        "report_data": {"executive_summary": "前回の要約"},
+        "created_at": last.isoformat(),
+        "prompt_version": PROMPT_VERSIONS["ai_intro"],
+        "grievance_count": len(df),
+        "last_grievance_at": last.isoformat(),
+        "incremental_depth": 0,
+        **overrides,
+    }
+
+
+def test_plan_incremental_update_uses_only_new_rows():
+    rows = generate_grievances(CID, 120)
+    previous = pd.DataFrame(rows[:100])
+    df = pd.DataFrame(rows)
+
+    report_data, new_df = plan_incremental_update(base_for(previous), "ai_intro", df)
+    assert report_data == {"executive_summary": "前回の要約"}
+    assert list(new_df["id"]) == [r["id"] for r in rows[100:]]
+
+
+def test_plan_incremental_update_falls_back_to_full_analysis():
+    rows = generate_grievances(CID, 120)
+    previous = pd.DataFrame(rows[:100])
+    df = pd.DataFrame(rows)
+
+    assert plan_incremental_update(None, "ai_intro", df) is None
+    assert plan_incremental_update(base_for(previous, prompt_version="old"), "ai_intro", df) is None
+    assert plan_incremental_update(base_for(previous, incremental_depth=INCREMENTAL_MAX_DEPTH), "ai_intro", df) is None
+    # 新着が無い / 前回以降に削除がある
+    assert plan_incremental_update(base_for(df), "ai_intro", df) is None
+    assert plan_incremental_update(base_for(previous), "ai_intro", df.drop(index=5)) is None
+    # 新着が予算に収まらない
+    assert plan_incremental_update(base_for(previous), "ai_intro", df, token_budget=10) is None
+
+
+def test_generate_report_updates_previous_report_incrementally():
+    client = LocalSupabase()
+    lru = ReportLRU()
+    model = FakeGemini()
+    prompts = []
+
+    def call_model(prompt):
+        prompts.append(prompt)
+        return model(prompt)
+
+    rows = generate_grievances(CID, 120)
+    _, source = generate_report_json(client, lru, CID, "ai_intro", pd.DataFrame(rows[:100]), call_model=call_model)
+    assert source == "model"
+    stored = client.tables["ai_reports"][-1]
+    assert stored["grievance_count"] == 100
+    assert stored["incremental_depth"] == 0
+
+    prompts.clear()
+    json_text, source = generate_report_json(client, lru, CID, "ai_intro", pd.DataFrame(rows), call_model=call_model)
+    assert source == "model"
+    # 前回のレポートと新着20件だけを1回で渡す
+    assert len(prompts) == 1
+    assert "前回のレポート" in prompts[0] and "20件" in prompts[0]
+    assert client.tables["ai_reports"][-1]["incremental_depth"] == 1
+    assert "executive_summary" in json.loads(json_text)
+
+    # 同じ課題セットはモデルを呼ばずに再利用する
+    assert generate_report_json(client, lru, CID, "ai_intro", pd.DataFrame(rows), call_model=call_model)[1] == "memory"
+    assert len(prompts) == 1
+
+
+def test_window_reports_are_stored_separately_and_never_incremental():
+    client = LocalSupabase()
+    lru = ReportLRU()
+    model = FakeGemini()
+    rows = generate_grievances(CID, 120)
+    generate_report_json(client, lru, CID, "ai_intro", pd.DataFrame(rows[:100]), call_model=model)
+
+    prompts = []
+
+    def call_model(prompt):
+        prompts.append(prompt)
+        return model(prompt)
+
+    generate_report_json(client, lru, CID, "ai_intro", pd.DataFrame(rows[60:]), call_model=call_model, window_key="30d")
+    assert "前回のレポート" not in prompts[-1]
+    assert client.tables["ai_reports"][-1]["report_type"] == report_type_for("ai_intro", "30d") == "ai_intro@30d"
+    assert report_type_for("ai_intro", "all") == "ai_intro"
@@ -0,0 +1,48 @@
+import json
+
+from fake_gemini import FakeGemini
+from report_stream import AiIntroStreamParser
+
+
+def feed_in_chunks(text, size):
+    parser = AiIntroStreamParser()
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i:i + size]))
+    return parser, events
+
+
+def test_sections_are_emitted_as_they_close():
+    text = FakeGemini()("レポートを作成してください")
+    expected = json.loads(text)
+
+    for size in (1, 7, len(text)):
+        parser, events = feed_in_chunks(text, size)
+        assert parser.data == expected
+        fields = [e[1] for e in events if e[0] == "field"]
+        assert fields == [k for k in expected if k != "ai_solutions"]
+        solutions = [e for e in events if e[0] == "solution"]
+        assert [e[1] for e in solutions] == list(range(len(expected["ai_solutions"])))
+        assert [e[2] for e in solutions] == expected["ai_solutions"]
+
+
+def test_strings_containing_json_syntax_do_not_split_sections():
+    data = {
+        "executive_summary": "「{残業}」, \"引用\" や [括弧] を含む要約",
+        "ai_solutions": [{"title": "提案 {1}", "tech_architecture": "a, b ]"}],
+        "readiness_score": 42,
+    }
+    parser, events = feed_in_chunks(json.dumps(data, ensure_ascii=False), 3)
+    assert parser.data == data
+    assert events == [
+        ("field", "executive_summary", data["executive_summary"]),
+        ("solution", 0, data["ai_solutions"][0]),
+        ("field", "readiness_score", 42),
+    ]
+
+
+def test_incomplete_member_is_not_emitted():
+    parser = AiIntroStreamParser()
+    assert parser.feed('{"executive_summary": "途中') == []
+    assert parser.feed('まで", "readiness') == [("field", "executive_summary", "途中まで")]
+    assert "readiness_score" not in parser.data
@@ -0,0 +1,178 @@
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# ==========================================
+# ホットパスの計測 (再実行ごとのタイミングスパン)
+# ==========================================
+# Supabase 呼び出し・Gemini 呼び出し・JSON解析/整形・PDF生成の所要時間と、
+# ペイロードのバイト数・行数・トークン数を記録する。
+# - スパンは「再実行 (trace)」と「企業ID」に紐づけてメモリ上に一定件数だけ保持する
+# - TRACE_LOG_PATH を設定すると OpenTelemetry の span 形式に近い JSON Lines で追記出力する
+# - スレッドプールに渡す処理は contextvars.copy_context() 経由で実行すると同じ trace に記録される
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Span:
+    def __init__(self, name, trace, parent_id=None):
+        self.name = name
+        self.trace_id = trace["trace_id"] if trace else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.company_id = trace.get("company_id") if trace else None
+        self.attributes = {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    @property
+    def duration_ms(self):
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms or 0, 3),
+            "status": "ERROR" if self.error else "OK",
+            "attributes": {"company_id": self.company_id, **self.attributes, **({"error": self.error} if self.error else {})},
+        }
+
+
+class Tracer:
+    def __init__(self, max_spans=5000, log_path=None):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        self.log_path = log_path
+
+    def record(self, span):
+        record = span.to_dict()
+        with self._lock:
+            self._spans.append(record)
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                except OSError as e:
+                    print(f"トレースログ出力エラー: {e}")
+
+    def spans(self, trace_id=None):
+        with self._lock:
+            records = list(self._spans)
+        if trace_id is not None:
+            records = [r for r in records if r["trace_id"] == trace_id]
+        return records
+
+    def export_jsonl(self):
+        return "\n".join(json.dumps(r, ensure_ascii=False) for r in self.spans()) + "\n"
+
+
+tracer = Tracer(log_path=os.environ.get("TRACE_LOG_PATH") or None)
+
+
+def begin_trace(company_id=None, name="rerun"):
+    # 再実行1回分の trace を開始し、その trace_id を返す
+    trace = {"trace_id": secrets.token_hex(16), "company_id": company_id, "name": name, "span_id": None}
+    _current_trace.set(trace)
+    return trace["trace_id"]
+
+
+def current_trace_id():
+    trace = _current_trace.get()
+    return trace["trace_id"] if trace else None
+
+
+@contextmanager
+def span(name, **attributes):
+    trace = _current_trace.get()
+    parent_id = trace.get("span_id") if trace else None
+    s = Span(name, trace, parent_id)
+    s.set(**attributes)
+    # ネストしたスパンの親子関係を保持する
+    token = None
+    if trace is not None:
+        token = _current_trace.set({**trace, "span_id": s.span_id})
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if token is not None:
+            _current_trace.reset(token)
+        s.end_ns = time.time_ns()
+        tracer.record(s)
+
+
+def record_elapsed(name, start_ns, **attributes):
+    # with 文で囲めない区間 (Streamlitスクリプトの大きなブロック等) を後から記録する
+    trace = _current_trace.get()
+    s = Span(name, trace, trace.get("span_id") if trace else None)
+    s.start_ns = start_ns
+    s.set(**attributes)
+    s.end_ns = time.time_ns()
+    tracer.record(s)
+
+
+def payload_bytes(data):
+    try:
+        return len(json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _TracedQuery:
+    def __init__(self, query, table):
+        self._query = query
+        self._table = table
+        self._op = "select"
+
+    def __getattr__(self, name):
+        attr = getattr(self._query, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if name in ("insert", "update", "upsert", "delete"):
+                self._op = name
+            result = attr(*args, **kwargs)
+            # ビルダーのメソッドチェーンを維持する (select()/eq() 等はビルダーを返す)
+            if hasattr(result, "execute"):
+                self._query = result
+                return self
+            return result
+        return call
+
+    def execute(self):
+        with span(f"supabase.{self._table}.{self._op}", table=self._table) as s:
+            res = self._query.execute()
+            data = res.data
+            s.set(rows=len(data) if isinstance(data, list) else (1 if data else 0), bytes=payload_bytes(data))
+            return res
+
+
+class TracedClient:
+    # Supabase クライアントをラップし、table(...).execute() ごとにスパンを記録する
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return _TracedQuery(self._client.table(name), name)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)